@@ -0,0 +1,436 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+import numpy as np
+from scipy import sparse
+
+# similarity denominator used instead of 0, to avoid dividing by zero
+ZERO_DENOMINATOR = 1e-8
+
+
+def build_ratings_matrix(user_codes, item_codes, adjusted_ratings, shape):
+	"""
+	build the sparse users x items matrix of the mean-adjusted ratings.
+	if a user rated an item more than once, only the first rating is used.
+	:param user_codes: users codes (the matrix rows) of the ratings
+	:param item_codes: items indexes (the matrix columns) of the ratings
+	:param adjusted_ratings: the mean-adjusted ratings
+	:param shape: number of users and number of items
+	:return: the csr ratings matrix
+	"""
+	_, first = np.unique(user_codes.astype(np.int64) * shape[1] + item_codes, return_index=True)
+	return sparse.csr_matrix((adjusted_ratings[first].astype(np.float64), (user_codes[first], item_codes[first])),
+							 shape=shape)
+
+
+def _pair_values(matrix, rows, cols):
+	"""
+	get the values of the given pairs in a sparse matrix, 0 for pairs that aren't stored.
+	"""
+	matrix = sparse.csr_matrix(matrix)
+	matrix.sum_duplicates()
+	keys = np.repeat(np.arange(matrix.shape[0], dtype=np.int64), np.diff(matrix.indptr)) * matrix.shape[1] \
+		   + matrix.indices
+	pair_keys = rows.astype(np.int64) * matrix.shape[1] + cols
+	if len(keys) == 0:
+		return np.zeros(len(pair_keys))
+	positions = np.minimum(np.searchsorted(keys, pair_keys), len(keys) - 1)
+	return np.where(keys[positions] == pair_keys, matrix.data[positions], 0)
+
+
+def rated_and_squared(ratings_matrix):
+	"""
+	:param ratings_matrix: sparse users x items csc matrix of the mean-adjusted ratings
+	:return: the csc matrices of 1 for each rating and of the squared adjusted ratings. they share the indices and
+		indptr arrays of ratings_matrix, only their data is new.
+	"""
+	rated = sparse.csc_matrix((np.ones_like(ratings_matrix.data), ratings_matrix.indices, ratings_matrix.indptr),
+							  shape=ratings_matrix.shape, copy=False)
+	squared = sparse.csc_matrix((np.square(ratings_matrix.data), ratings_matrix.indices, ratings_matrix.indptr),
+								shape=ratings_matrix.shape, copy=False)
+	return rated, squared
+
+
+def item_similarities(ratings_matrix, items, min_common_users=1, rated=None, squared=None):
+	"""
+	calculate the adjusted cosine similarities of the given items, as item_1, with all the items. only the users who
+	rated one of the given items affect the result, so the matrix may hold only these users' ratings.
+	:param ratings_matrix: sparse users x items matrix of the mean-adjusted ratings
+	:param items: sorted array of items indexes
+	:param min_common_users: minimal number of users who rated both items of a pair
+	:param rated: the matrices of rated_and_squared(ratings_matrix), e.g. in shared memory. calculated if None
+	:param squared: see rated
+	:return: arrays of item_1 column, item_2 column and weight, sorted by item_1 and then item_2
+	"""
+	ratings_matrix = sparse.csc_matrix(ratings_matrix)
+	if rated is None or squared is None:
+		rated, squared = rated_and_squared(ratings_matrix)
+	shard, rated_shard, squared_shard = ratings_matrix[:, items], rated[:, items], squared[:, items]
+
+	# the products are taken as (matrix.T @ shard).T: the transpose of a csc matrix is a csr matrix without a copy, so
+	# only the shard is converted, while shard.T @ matrix would convert a copy of the whole matrix to csr
+	# the pairs rated by enough common users, without pairs of an item with itself
+	co_rated = (rated.T @ rated_shard).T.tocsr()
+	co_rated.sort_indices()
+	co_rated = co_rated.tocoo()
+	kept = (items[co_rated.row] != co_rated.col) & (co_rated.data >= max(min_common_users, 1))
+	rows, item_2 = co_rated.row[kept], co_rated.col[kept]
+
+	# sum of adjusted_1 * adjusted_2, and of squared adjusted_1 and adjusted_2, over the users who rated both items
+	numerator = _pair_values((ratings_matrix.T @ shard).T, rows, item_2)
+	denominator = np.sqrt(_pair_values((rated.T @ squared_shard).T, rows, item_2)) \
+				  * np.sqrt(_pair_values((squared.T @ rated_shard).T, rows, item_2))
+	denominator[denominator == 0] = ZERO_DENOMINATOR
+
+	# the weights are in [-1, 1] up to rounding errors
+	return items[rows], item_2, np.clip(numerator / denominator, -1, 1)
+
+
+def _shared_item_range_similarities(shared_arrays, shape, start, end, min_common_users):
+	"""
+	calculate the similarities of the items start to end - 1, as item_1, with all the items, from csc matrices whose
+	arrays are in shared memory, so the worker doesn't copy them.
+	:param shared_arrays: tuple of (shared memory name, dtype, length) of the data of the ratings matrix, of its
+		rated_and_squared matrices, and of their common indices and indptr arrays
+	"""
+	blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in shared_arrays]
+	try:
+		arrays = [np.ndarray(length, dtype=dtype, buffer=block.buf)
+				  for block, (_, dtype, length) in zip(blocks, shared_arrays)]
+		data, rated_data, squared_data, indices, indptr = arrays
+		ratings_matrix, rated, squared = [sparse.csc_matrix((values, indices, indptr), shape=shape, copy=False)
+										  for values in (data, rated_data, squared_data)]
+		similarities = item_similarities(ratings_matrix, np.arange(start, end), min_common_users, rated, squared)
+		del arrays, data, rated_data, squared_data, indices, indptr, ratings_matrix, rated, squared
+		return similarities
+	finally:
+		for block in blocks:
+			block.close()
+
+
+def adjusted_cosine_similarities(ratings_matrix, min_common_users=1, n_jobs=1):
+	"""
+	calculate the adjusted cosine similarity of each two items that were rated by at least min_common_users common
+	users. the numerator and both norms of a pair are summed over the users who rated both items.
+	:param ratings_matrix: sparse users x items matrix of the mean-adjusted ratings
+	:param min_common_users: minimal number of users who rated both items of a pair
+	:param n_jobs: number of processes. if more than 1, the items are split into ranges that are calculated in a
+		process pool, with the ratings matrix in shared memory
+	:return: arrays of item_1 column, item_2 column and weight, sorted by item_1 and then item_2
+	"""
+	ratings_matrix = sparse.csc_matrix(ratings_matrix)
+	n_items = ratings_matrix.shape[1]
+	if n_jobs <= 1 or n_items == 0:
+		return item_similarities(ratings_matrix, np.arange(n_items), min_common_users)
+
+	# a few ranges per process, so a slow range doesn't hold up the rest
+	bounds = np.linspace(0, n_items, min(4 * n_jobs, n_items) + 1).astype(np.int64)
+	# the rated and squared forms are calculated once here and shared too, instead of by each process
+	rated, squared = rated_and_squared(ratings_matrix)
+	blocks, shared_arrays = [], []
+	try:
+		for values in (ratings_matrix.data, rated.data, squared.data, ratings_matrix.indices, ratings_matrix.indptr):
+			block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+			blocks.append(block)
+			np.ndarray(len(values), dtype=values.dtype, buffer=block.buf)[:] = values
+			shared_arrays.append((block.name, values.dtype.str, len(values)))
+		with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+			shards = list(executor.map(_shared_item_range_similarities, repeat(tuple(shared_arrays)),
+									   repeat(ratings_matrix.shape), bounds[:-1], bounds[1:],
+									   repeat(min_common_users)))
+	finally:
+		for block in blocks:
+			block.close()
+			block.unlink()
+
+	return tuple(np.concatenate(arrays) for arrays in zip(*shards))
+
+
+class SimilarityMatrix:
+	"""
+	item x item similarity weights kept in a NumPy array, indexed by the items' integer indexes.
+	items that weren't rated by a common user have weight 0, which doesn't affect the predictions.
+	"""
+	def __init__(self, n_items, dtype=np.float64, symmetric=False, values=None):
+		"""
+		:param n_items: number of items
+		:param dtype: dtype of the weights, e.g. np.float32 to halve the memory
+		:param symmetric: if True, only the upper triangle of the (symmetric) matrix is stored
+		:param values: if given, the stored weights array to use (e.g. mapped from a file), instead of zeros
+		"""
+		self.n_items = n_items
+		self.dtype = np.dtype(dtype)
+		self.symmetric = symmetric
+		if values is not None:
+			self.values = values
+		elif symmetric:
+			# upper triangle including the diagonal, row by row (the order of np.triu_indices)
+			self.values = np.zeros(n_items * (n_items + 1) // 2, dtype=self.dtype)
+		else:
+			self.values = np.zeros((n_items, n_items), dtype=self.dtype)
+
+	@classmethod
+	def from_pairs(cls, n_items, item_1, item_2, weights, dtype=np.float64, symmetric=False):
+		"""
+		create a similarity matrix from the given pairs of items indexes and their weights.
+		"""
+		similarity_matrix = cls(n_items, dtype, symmetric)
+		similarity_matrix.set_weights(item_1, item_2, weights)
+		return similarity_matrix
+
+	@classmethod
+	def from_dense(cls, weights, dtype=np.float64, symmetric=False):
+		"""
+		create a similarity matrix from a full item x item array of weights.
+		"""
+		similarity_matrix = cls(weights.shape[0], dtype, symmetric)
+		if symmetric:
+			similarity_matrix.values[:] = weights[np.triu_indices(weights.shape[0])]
+		else:
+			similarity_matrix.values[:] = weights
+		return similarity_matrix
+
+	@classmethod
+	def from_arrays(cls, n_items, arrays, symmetric=False):
+		"""
+		create a similarity matrix that uses the given stored arrays, as returned by to_arrays, without copying them.
+		"""
+		return cls(n_items, arrays['values'].dtype, symmetric, values=arrays['values'])
+
+	def to_arrays(self):
+		"""
+		:return: dict of the arrays that store the weights
+		"""
+		return {'values': self.values}
+
+	def _packed_index(self, item_1, item_2):
+		"""
+		position of the weight of the given items in the stored upper triangle.
+		"""
+		row, col = np.minimum(item_1, item_2), np.maximum(item_1, item_2)
+		return row * self.n_items - row * (row - 1) // 2 + col - row
+
+	def set_weights(self, item_1, item_2, weights):
+		"""
+		set the weights of the given pairs of items indexes.
+		"""
+		if self.symmetric:
+			self.values[self._packed_index(item_1, item_2)] = weights
+		else:
+			self.values[item_1, item_2] = weights
+
+	def weight(self, item_1, item_2):
+		"""
+		get the weights between the given items indexes (ints or arrays).
+		"""
+		if self.symmetric:
+			return self.values[self._packed_index(item_1, item_2)]
+		return self.values[item_1, item_2]
+
+	def to_dense(self):
+		"""
+		:return: the full item x item array of weights
+		"""
+		if not self.symmetric:
+			return self.values.copy()
+		dense = np.zeros((self.n_items, self.n_items), dtype=self.dtype)
+		dense[np.triu_indices(self.n_items)] = self.values
+		return dense + np.triu(dense, 1).T
+
+	def resized(self, n_items):
+		"""
+		:return: a copy of the matrix for n_items items, new items have no similarities
+		"""
+		dense = np.zeros((n_items, n_items), dtype=self.dtype)
+		dense[:self.n_items, :self.n_items] = self.to_dense()
+		return SimilarityMatrix.from_dense(dense, self.dtype, self.symmetric)
+
+	def weighted_sums(self, items, values):
+		"""
+		for each item, sum the given values of the given items weighted by their weights with the item, and sum the
+		absolute weights of the given items with the item.
+		:param items: array of items indexes
+		:param values: array of a value of each of the given items
+		:return: array of the weighted sums and array of the sums of absolute weights, by the items indexes
+		"""
+		weights = self.columns(items)
+		return weights @ values, np.abs(weights).sum(axis=1, dtype=np.float64)
+
+	def weight_counts(self, items):
+		"""
+		:param items: array of items indexes
+		:return: array of the number of the given items with a nonzero weight with each item, by the items indexes
+		"""
+		return np.count_nonzero(self.columns(items), axis=1)
+
+	def columns(self, items):
+		"""
+		get the weights of all items with each of the given items.
+		:param items: array of items indexes
+		:return: array of shape (n_items, len(items))
+		"""
+		if self.symmetric:
+			return self.values[self._packed_index(np.arange(self.n_items)[:, None], items[None, :])]
+		return self.values[:, items]
+
+	def set_rows(self, items, item_1, item_2, weights):
+		"""
+		replace all the weights of the given items, and the same weights of the other items with them, by the given
+		pairs. the pairs of the given items that aren't given get weight 0.
+		:param items: array of items indexes
+		:param item_1: array of items indexes, each one of the given items
+		:param item_2: array of items indexes
+		:param weights: array of the weight of each pair
+		"""
+		if self.symmetric:
+			self.set_weights(items[:, None], np.arange(self.n_items)[None, :], 0)
+		else:
+			self.values[items, :] = 0
+			self.values[:, items] = 0
+			self.values[item_2, item_1] = weights
+		self.set_weights(item_1, item_2, weights)
+
+
+class NeighborSimilarityMatrix:
+	"""
+	similarity weights of each item with only its num_of_neighbors strongest (by absolute weight) neighbors, kept as
+	csr arrays: the neighbors of item i are indices[indptr[i]:indptr[i + 1]], sorted, with their weights in weights.
+	the weight of item i with a neighbor j is used to predict i, so the neighborhoods aren't symmetric.
+	"""
+	def __init__(self, n_items, num_of_neighbors, indptr, indices, weights):
+		self.n_items = n_items
+		self.num_of_neighbors = num_of_neighbors
+		self._set_arrays(indptr, indices, weights)
+
+	def _set_arrays(self, indptr, indices, weights):
+		self.indptr = indptr
+		self.indices = indices
+		self.weights = weights
+		# the item of each stored weight, and keys (item * n_items + neighbor) of the weights, in ascending order
+		self._rows = np.repeat(np.arange(self.n_items), np.diff(indptr))
+		self._keys = self._rows * self.n_items + indices
+
+	@property
+	def dtype(self):
+		return self.weights.dtype
+
+	@classmethod
+	def from_pairs(cls, n_items, item_1, item_2, weights, num_of_neighbors, dtype=np.float64):
+		"""
+		create the matrix from the given pairs of items indexes and their weights, keeping the num_of_neighbors
+		strongest weights of each item_1. pairs with weight 0 are dropped.
+		"""
+		item_1, item_2 = np.asarray(item_1, dtype=np.int64), np.asarray(item_2, dtype=np.int64)
+		weights = np.asarray(weights)
+		nonzero = weights != 0
+		item_1, item_2, weights = item_1[nonzero], item_2[nonzero], weights[nonzero]
+
+		# rank the pairs of each item_1 from the strongest weight, and keep the first num_of_neighbors. weights that
+		# are equal up to rounding errors are ranked by item_2, so the neighbors don't depend on the rounding
+		order = np.lexsort((item_2, -np.round(np.abs(weights), 12), item_1))
+		item_1, item_2, weights = item_1[order], item_2[order], weights[order]
+		rank = np.arange(len(item_1)) - np.searchsorted(item_1, item_1, side='left')
+		keep = rank < num_of_neighbors
+		item_1, item_2, weights = item_1[keep], item_2[keep], weights[keep]
+
+		order = np.lexsort((item_2, item_1))
+		indptr = np.zeros(n_items + 1, dtype=np.int64)
+		indptr[1:] = np.cumsum(np.bincount(item_1, minlength=n_items))
+		return cls(n_items, num_of_neighbors, indptr, item_2[order].astype(np.int32),
+				   weights[order].astype(dtype))
+
+	@classmethod
+	def from_arrays(cls, n_items, arrays, num_of_neighbors):
+		"""
+		create the matrix that uses the given csr arrays, as returned by to_arrays, without copying them.
+		"""
+		return cls(n_items, num_of_neighbors, arrays['indptr'], arrays['indices'], arrays['weights'])
+
+	def to_arrays(self):
+		"""
+		:return: dict of the csr arrays that store the weights
+		"""
+		return {'indptr': self.indptr, 'indices': self.indices, 'weights': self.weights}
+
+	def to_pairs(self):
+		"""
+		:return: arrays of item_1, item_2 and weight of all the kept weights
+		"""
+		return self._rows, self.indices.astype(np.int64), self.weights
+
+	def weight(self, item_1, item_2):
+		"""
+		get the weights between the given items indexes (ints or arrays), 0 if item_2 isn't a neighbor of item_1.
+		"""
+		keys = np.asarray(item_1) * self.n_items + np.asarray(item_2)
+		if len(self._keys) == 0:
+			return np.zeros(np.shape(keys), dtype=self.dtype)
+		positions = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+		return np.where(self._keys[positions] == keys, self.weights[positions], 0).astype(self.dtype)
+
+	def weighted_sums(self, items, values):
+		"""
+		for each item, sum the given values of the given items weighted by their weights with the item, and sum the
+		absolute weights of the given items with the item. only the items neighbors are visited.
+		:param items: array of items indexes
+		:param values: array of a value of each of the given items
+		:return: array of the weighted sums and array of the sums of absolute weights, by the items indexes
+		"""
+		item_values = np.zeros(self.n_items)
+		item_values[items] = values
+		is_given = np.zeros(self.n_items)
+		is_given[items] = 1
+		return np.bincount(self._rows, weights=self.weights * item_values[self.indices], minlength=self.n_items), \
+			   np.bincount(self._rows, weights=np.abs(self.weights) * is_given[self.indices], minlength=self.n_items)
+
+	def weight_counts(self, items):
+		"""
+		:param items: array of items indexes
+		:return: array of the number of the given items that are neighbors of each item, by the items indexes
+		"""
+		is_given = np.zeros(self.n_items, dtype=bool)
+		is_given[items] = True
+		return np.bincount(self._rows[is_given[self.indices]], minlength=self.n_items)
+
+	def to_dense(self):
+		"""
+		:return: the full item x item array of weights
+		"""
+		dense = np.zeros((self.n_items, self.n_items), dtype=self.dtype)
+		dense[self._rows, self.indices] = self.weights
+		return dense
+
+	def resized(self, n_items):
+		"""
+		:return: a copy of the matrix for n_items items, new items have no neighbors
+		"""
+		indptr = np.append(self.indptr, np.full(n_items - self.n_items, self.indptr[-1]))
+		return NeighborSimilarityMatrix(n_items, self.num_of_neighbors, indptr, self.indices.copy(),
+										self.weights.copy())
+
+	def set_rows(self, items, item_1, item_2, weights):
+		"""
+		replace the neighbors of the given items by the strongest of the given pairs.
+		:param items: array of items indexes
+		:param item_1: array of items indexes, each one of the given items
+		:param item_2: array of items indexes
+		:param weights: array of the weight of each pair, all the nonzero weights of the given items
+		"""
+		updated = NeighborSimilarityMatrix.from_pairs(self.n_items, item_1, item_2, weights, self.num_of_neighbors,
+													  self.dtype)
+		is_updated = np.zeros(self.n_items, dtype=bool)
+		is_updated[items] = True
+		indptr = np.zeros(self.n_items + 1, dtype=np.int64)
+		indptr[1:] = np.cumsum(np.where(is_updated, np.diff(updated.indptr), np.diff(self.indptr)))
+
+		# move the weights of the other items by the change in length of the rows before them, and put the new rows
+		# of the given items in between, without ranking the weights of the other items again
+		indices = np.empty(indptr[-1], dtype=self.indices.dtype)
+		weights = np.empty(indptr[-1], dtype=self.dtype)
+		for matrix, rows in ((self, ~is_updated), (updated, is_updated)):
+			stored = rows[matrix._rows]
+			stored_rows = matrix._rows[stored]
+			positions = np.flatnonzero(stored) - matrix.indptr[stored_rows] + indptr[stored_rows]
+			indices[positions] = matrix.indices[stored]
+			weights[positions] = matrix.weights[stored]
+		self._set_arrays(indptr, indices, weights)
@@ -1,7 +1,11 @@
 from .baseline_model import BaselineModel
+from .id_index import IdIndex
 from .kernel_matrix_factorization import KernelMF
+from .mips_index import MIPSIndex
 from .recommender_base import RecommenderBase
 
 __all__ = ["BaselineModel",
+    "IdIndex",
     "KernelMF",
+    "MIPSIndex",
     "RecommenderBase",]
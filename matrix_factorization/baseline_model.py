@@ -2,7 +2,7 @@ import numba as nb
 import numpy as np
 import pandas as pd
 
-from .recommender_base import RecommenderBase
+from .recommender_base import RecommenderBase, print_epoch, stop_early
 
 from typing import Tuple
 
@@ -25,6 +25,10 @@ class BaselineModel(RecommenderBase):
         min_rating {int} -- Smallest rating possible (default: {0})
         max_rating {int} -- Largest rating possible (default: {5})
         verbose {str} -- Verbosity when fitting. 0 to not print anything, 1 to print fitting model (default: {1})
+        dtype {str} -- Floating point type of the bias parameters, 'float64' or 'float32' (default: {'float64'})
+        validation_fraction {float} -- Fraction of the ratings held out of training to measure the validation rmse of each epoch. 0 for no validation (default: {0})
+        tol {float} -- Early stopping tolerance. Training stops when the validation rmse, or the training rmse without validation, didn't decrease by more than tol for patience epochs. None to always run n_epochs (default: {None})
+        patience {int} -- Number of epochs without improvement before stopping early (default: {5})
 
     Attributes:
         n_users {int} -- Number of users
@@ -32,9 +36,12 @@ class BaselineModel(RecommenderBase):
         global_mean {float} -- Global mean of all ratings
         user_biases {numpy array} -- User bias vector of shape (n_users, 1)
         item_biases {numpy array} -- Item bias vector of shape (n_items, i)
-        user_id_map {dict} -- Mapping of user ids to assigned integer ids
-        item_id_map {dict} -- Mapping of item ids to assigned integer ids
-        train_rmse {list} -- Training rmse values
+        user_index {IdIndex} -- Index of user ids to assigned integer ids
+        item_index {IdIndex} -- Index of item ids to assigned integer ids
+        user_id_map {MappingProxyType} -- Read-only mapping of user ids to assigned integer ids
+        item_id_map {MappingProxyType} -- Read-only mapping of item ids to assigned integer ids
+        train_rmse {list} -- Training rmse of each epoch, accumulated from the error of each rating before its update for SGD
+        val_rmse {list} -- Validation rmse of each epoch, empty without validation
         predictions_possible {list} -- Boolean vector of whether both user and item were known for prediction. Only available after calling predict
     """
 
@@ -47,19 +54,45 @@ class BaselineModel(RecommenderBase):
         min_rating: int = 0,
         max_rating: int = 5,
         verbose=1,
+        dtype: str = "float64",
+        validation_fraction: float = 0,
+        tol: float = None,
+        patience: int = 5,
     ):
         # Check inputs
         if method not in ("sgd", "als"):
             raise ValueError('Method param must be either "sgd" or "als"')
 
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError("Dtype must be either float32 or float64")
+
+        if not 0 <= validation_fraction < 1:
+            raise ValueError("Validation fraction must be in the range [0, 1)")
+
+        if patience < 1:
+            raise ValueError("Patience must be at least 1")
+
         super().__init__(min_rating=min_rating, max_rating=max_rating, verbose=verbose)
 
         self.method = method
         self.n_epochs = n_epochs
         self.reg = reg
         self.lr = lr
+        self.dtype = dtype
+        self.validation_fraction = validation_fraction
+        self.tol = tol
+        self.patience = patience
         return
 
+    def _early_stopping_options(self) -> dict:
+        """
+        Early stopping options of the solvers, where a tolerance of -inf never stops
+        """
+        return {
+            "tol": -np.inf if self.tol is None else self.tol,
+            "patience": self.patience,
+        }
+
     def fit(self, X: pd.DataFrame, y: pd.Series):
         """ 
         Fits simple mean and bias model to given user item ratings
@@ -70,15 +103,23 @@ class BaselineModel(RecommenderBase):
         """
         X = self._preprocess_data(X=X, y=y, type="fit")
         self.global_mean = X["rating"].mean()
+        data = self._training_data(
+            X, validation_fraction=self.validation_fraction, dtype=self.dtype
+        )
 
         # Initialize parameters
-        self.user_biases = np.zeros(self.n_users)
-        self.item_biases = np.zeros(self.n_items)
+        self.user_biases = np.zeros(self.n_users, dtype=self.dtype)
+        self.item_biases = np.zeros(self.n_items, dtype=self.dtype)
 
         # Run parameter estimation
         if self.method == "sgd":
-            self.user_biases, self.item_biases, self.train_rmse = _sgd(
-                X=X.to_numpy(),
+            (
+                self.user_biases,
+                self.item_biases,
+                self.train_rmse,
+                self.val_rmse,
+            ) = _sgd(
+                **data,
                 global_mean=self.global_mean,
                 user_biases=self.user_biases,
                 item_biases=self.item_biases,
@@ -86,17 +127,24 @@ class BaselineModel(RecommenderBase):
                 lr=self.lr,
                 reg=self.reg,
                 verbose=self.verbose,
+                **self._early_stopping_options(),
             )
 
         elif self.method == "als":
-            self.user_biases, self.item_biases, self.train_rmse = _als(
-                X=X.to_numpy(),
+            (
+                self.user_biases,
+                self.item_biases,
+                self.train_rmse,
+                self.val_rmse,
+            ) = _als(
+                **data,
                 global_mean=self.global_mean,
                 user_biases=self.user_biases,
                 item_biases=self.item_biases,
                 n_epochs=self.n_epochs,
                 reg=self.reg,
                 verbose=self.verbose,
+                **self._early_stopping_options(),
             )
 
         return self
@@ -120,7 +168,8 @@ class BaselineModel(RecommenderBase):
 
         # Get predictions
         predictions, predictions_possible = _predict(
-            X=X.to_numpy(),
+            user_ids=X["user_id"].to_numpy(dtype=np.int32),
+            item_ids=X["item_id"].to_numpy(dtype=np.int32),
             global_mean=self.global_mean,
             min_rating=self.min_rating,
             max_rating=self.max_rating,
@@ -129,9 +178,26 @@ class BaselineModel(RecommenderBase):
             bound_ratings=bound_ratings,
         )
 
-        self.predictions_possible = predictions_possible
+        self.predictions_possible = predictions_possible.tolist()
+
+        return predictions.tolist()
 
-        return predictions
+    def _predict_users_items(self, users: list, items: np.ndarray = None) -> np.ndarray:
+        """
+        Predict the unbounded ratings of all items for each of the given users at once. Unknown users get zero bias, as in
+        predict.
+
+        Arguments:
+            users {list} -- User_ids to predict ratings for (not assigned user_ids from self.user_id_map)
+            items {np.ndarray} -- Assigned item ids to predict ratings for instead of all items (default: {None})
+
+        Returns:
+            item_ratings [np.ndarray] -- Rating predictions of shape (len(users), n_items) ordered by the assigned item ids
+        """
+        user_indexes = self.user_index.get_indexer(users)
+        user_biases = np.where(user_indexes != -1, self.user_biases[user_indexes], 0)
+        item_biases = self.item_biases if items is None else self.item_biases[items]
+        return self.global_mean + user_biases[:, None] + item_biases[None, :]
 
     def update_users(
         self,
@@ -145,7 +211,8 @@ class BaselineModel(RecommenderBase):
         Update user biases vector with new/updated user-item ratings information using SGD. Only the user parameters corresponding for the
         new/updated users will be updated and item parameters will be left alone. 
         
-        Note: If updating old users then pass all user-item ratings for old users and not just modified ratings
+        Note: If updating old users then pass all user-item ratings for old users and not just modified ratings. The validation_fraction,
+        tol and patience of the model apply to the update as in fit.
 
         Args:
             X (pd.DataFrame): Dataframe containing columns user_id, item_id 
@@ -157,16 +224,19 @@ class BaselineModel(RecommenderBase):
         X, known_users, new_users = self._preprocess_data(X=X, y=y, type="update")
 
         # Re-initialize user bias for old users
-        for user in known_users:
-            user_index = self.user_id_map[user]
-            self.user_biases[user_index] = 0
+        self.user_biases[self.user_index.get_indexer(known_users)] = 0
 
         # Add user bias param for new users
-        self.user_biases = np.append(self.user_biases, np.zeros(len(new_users)))
+        self._append_rows("user_biases", np.zeros(len(new_users)))
 
         # Estimate new bias parameter
-        self.user_biases, _, self.train_rmse = _sgd(
-            X=X.to_numpy(),
+        data = self._training_data(
+            X,
+            validation_fraction=self.validation_fraction,
+            dtype=self.user_biases.dtype,
+        )
+        self.user_biases, _, self.train_rmse, self.val_rmse = _sgd(
+            **data,
             global_mean=self.global_mean,
             user_biases=self.user_biases,
             item_biases=self.item_biases,
@@ -175,6 +245,7 @@ class BaselineModel(RecommenderBase):
             reg=self.reg,
             verbose=verbose,
             update_item_params=False,
+            **self._early_stopping_options(),
         )
 
         return
@@ -182,13 +253,20 @@ class BaselineModel(RecommenderBase):
 
 @nb.njit()
 def _calculate_rmse(
-    X: np.ndarray, global_mean: float, user_biases: np.ndarray, item_biases: np.ndarray
+    user_ids: np.ndarray,
+    item_ids: np.ndarray,
+    ratings: np.ndarray,
+    global_mean: float,
+    user_biases: np.ndarray,
+    item_biases: np.ndarray,
 ):
     """
     Calculates root mean squared error for given data and model parameters
 
     Args:
-        X (np.ndarray): Matrix with columns user, item and rating
+        user_ids (np.ndarray): User id of each rating
+        item_ids (np.ndarray): Item id of each rating
+        ratings (np.ndarray): Ratings
         global_mean (float): Global mean rating
         user_biases (np.ndarray): User biases vector of shape (n_users, 1)
         item_biases (np.ndarray): Item biases vector of shape (n_items, 1)
@@ -196,25 +274,31 @@ def _calculate_rmse(
     Returns:
         rmse [float]: Root mean squared error
     """
-    n_ratings = X.shape[0]
-    errors = np.zeros(n_ratings)
+    n_ratings = ratings.shape[0]
+    squared_error_sum = 0.0
 
     # Iterate through all user-item ratings
     for i in range(n_ratings):
-        user_id, item_id, rating = int(X[i, 0]), int(X[i, 1]), X[i, 2]
+        user_id, item_id, rating = user_ids[i], item_ids[i], ratings[i]
 
         # Calculate prediction and error
         pred = global_mean + user_biases[user_id] + item_biases[item_id]
-        errors[i] = rating - pred
+        error = rating - pred
+        squared_error_sum += error * error
 
-    rmse = np.sqrt(np.square(errors).mean())
+    rmse = np.sqrt(squared_error_sum / max(n_ratings, 1))
 
     return rmse
 
 
 @nb.njit()
 def _sgd(
-    X: np.ndarray,
+    user_ids: np.ndarray,
+    item_ids: np.ndarray,
+    ratings: np.ndarray,
+    val_user_ids: np.ndarray,
+    val_item_ids: np.ndarray,
+    val_ratings: np.ndarray,
     global_mean: float,
     user_biases: np.ndarray,
     item_biases: np.ndarray,
@@ -222,14 +306,22 @@ def _sgd(
     lr: float,
     reg: float,
     verbose: int,
+    tol: float,
+    patience: int,
     update_user_params: bool = True,
     update_item_params: bool = True,
-) -> Tuple[np.ndarray, np.ndarray, list]:
+) -> Tuple[np.ndarray, np.ndarray, list, list]:
     """
-    Performs Stochastic Gradient Descent to estimate the user_biases and item_biases
+    Performs Stochastic Gradient Descent to estimate the user_biases and item_biases. The training rmse of each epoch is summed from
+    the errors of the ratings during their updates, without a second pass over the ratings.
 
     Arguments:
-        X {numpy array} -- User-item rating matrix
+        user_ids {numpy array} -- User id of each rating
+        item_ids {numpy array} -- Item id of each rating
+        ratings {numpy array} -- Ratings
+        val_user_ids {numpy array} -- User id of each validation rating, empty for no validation
+        val_item_ids {numpy array} -- Item id of each validation rating
+        val_ratings {numpy array} -- Validation ratings
         global_mean {float} -- Global mean of all ratings
         user_biases {numpy array} -- User biases vector of shape (n_users, 1)
         item_biases {numpy array} -- Item biases vector of shape (n_items, 1)
@@ -237,6 +329,8 @@ def _sgd(
         lr {float} -- Learning rate alpha
         reg {float} -- Regularization parameter lambda for Frobenius norm
         verbose {int} -- Verbosity when fitting. 0 for nothing and 1 for printing epochs
+        tol {float} -- Early stopping tolerance of stop_early, -inf to never stop
+        patience {int} -- Number of epochs without improvement to stop after
         update_user_params {bool} -- Whether to update user bias parameters or not. Default is True.
         update_item_params {bool} -- Whether to update item bias parameters or not. Default is True.
 
@@ -244,20 +338,27 @@ def _sgd(
         user_biases [np.ndarray] -- Updated user_biases vector
         item_biases [np.ndarray] -- Updated item_bases vector
         train_rmse -- Training rmse values
+        val_rmse -- Validation rmse values, empty without validation ratings
     """
     train_rmse = []
+    val_rmse = []
+    has_validation = val_ratings.shape[0] > 0
+
+    n_ratings = ratings.shape[0]
 
     for epoch in range(n_epochs):
-        # Shuffle data before each epoch
-        np.random.shuffle(X)
+        # Shuffle the order of the ratings before each epoch, without moving them
+        order = np.random.permutation(n_ratings)
+        squared_error_sum = 0.0
 
         # Iterate through all user-item ratings
-        for i in range(X.shape[0]):
-            user_id, item_id, rating = int(X[i, 0]), int(X[i, 1]), X[i, 2]
+        for row in order:
+            user_id, item_id, rating = user_ids[row], item_ids[row], ratings[row]
 
             # Compute error
             rating_pred = global_mean + user_biases[user_id] + item_biases[item_id]
             error = rating - rating_pred
+            squared_error_sum += error * error
 
             # Update parameters
             if update_user_params:
@@ -266,30 +367,49 @@ def _sgd(
                 item_biases[item_id] += lr * (error - reg * item_biases[item_id])
 
         # Calculate error and print
-        rmse = _calculate_rmse(
-            X=X,
-            global_mean=global_mean,
-            user_biases=user_biases,
-            item_biases=item_biases,
-        )
+        rmse = np.sqrt(squared_error_sum / max(n_ratings, 1))
         train_rmse.append(rmse)
 
+        # Calculate validation error
+        if has_validation:
+            val_rmse.append(
+                _calculate_rmse(
+                    user_ids=val_user_ids,
+                    item_ids=val_item_ids,
+                    ratings=val_ratings,
+                    global_mean=global_mean,
+                    user_biases=user_biases,
+                    item_biases=item_biases,
+                )
+            )
+
         if verbose == 1:
-            print("Epoch ", epoch + 1, "/", n_epochs, " -  train_rmse:", rmse)
+            print_epoch(epoch, n_epochs, rmse, val_rmse)
 
-    return user_biases, item_biases, train_rmse
+        # Stop once the validation rmse, or the training rmse without validation, stops improving
+        if stop_early(val_rmse if has_validation else train_rmse, tol, patience):
+            break
+
+    return user_biases, item_biases, train_rmse, val_rmse
 
 
 @nb.njit()
 def _als(
-    X: np.ndarray,
+    user_ids: np.ndarray,
+    item_ids: np.ndarray,
+    ratings: np.ndarray,
+    val_user_ids: np.ndarray,
+    val_item_ids: np.ndarray,
+    val_ratings: np.ndarray,
     global_mean: float,
     user_biases: np.ndarray,
     item_biases: np.ndarray,
     n_epochs: int,
     reg: float,
     verbose: int,
-) -> Tuple[np.ndarray, np.ndarray, list]:
+    tol: float,
+    patience: int,
+) -> Tuple[np.ndarray, np.ndarray, list, list]:
     """
     Performs Alternating Least Squares to estimate the user_biases and item_biases. For every epoch, the item biases are held constant while
     solving directly for the user biases parameters using a closed form equation. Then the user biases parameters is held constant and the same
@@ -297,86 +417,117 @@ def _als(
     which is also similar to the implementation in Surprise.
 
     Arguments:
-        X {numpy array} -- User-item rating matrix
+        user_ids {numpy array} -- User id of each rating
+        item_ids {numpy array} -- Item id of each rating
+        ratings {numpy array} -- Ratings
+        val_user_ids {numpy array} -- User id of each validation rating, empty for no validation
+        val_item_ids {numpy array} -- Item id of each validation rating
+        val_ratings {numpy array} -- Validation ratings
         global_mean {float} -- Global mean of all ratings
         user_biases {numpy array} -- User biases vector of shape (n_users, 1)
         item_biases {numpy array} -- Item biases vector of shape (n_items, 1)
         n_epochs {int} -- Number of epochs to run
         reg {float} -- Regularization parameter lambda for Frobenius norm
         verbose {int} -- Verbosity when fitting. 0 for nothing and 1 for printing epochs
+        tol {float} -- Early stopping tolerance of stop_early, -inf to never stop
+        patience {int} -- Number of epochs without improvement to stop after
 
     Returns:
         user_biases [np.ndarray] -- Updated user_biases vector
         item_biases [np.ndarray] -- Updated item_bases vector
         train_rmse -- Training rmse values
+        val_rmse -- Validation rmse values, empty without validation ratings
     """
     n_users = user_biases.shape[0]
     n_items = item_biases.shape[0]
     train_rmse = []
+    val_rmse = []
+    has_validation = val_ratings.shape[0] > 0
 
     # Get counts of all users and items
     user_counts = np.zeros(n_users)
     item_counts = np.zeros(n_items)
-    for i in range(X.shape[0]):
-        user_id, item_id = int(X[i, 0]), int(X[i, 1])
+    for i in range(ratings.shape[0]):
+        user_id, item_id = user_ids[i], item_ids[i]
         user_counts[user_id] += 1
         item_counts[item_id] += 1
 
     # For each epoch optimize User biases, and then Item biases
     for epoch in range(n_epochs):
 
-        # Update user bias parameters
-        user_biases = np.zeros(n_users)
+        # Update user bias parameters, summing in float64 whatever the dtype of the biases
+        user_sums = np.zeros(n_users)
 
         # Iterate through all user-item ratings
-        for i in range(X.shape[0]):
-            user_id, item_id, rating = int(X[i, 0]), int(X[i, 1]), X[i, 2]
-            user_biases[user_id] += rating - global_mean - item_biases[item_id]
+        for i in range(ratings.shape[0]):
+            user_id, item_id, rating = user_ids[i], item_ids[i], ratings[i]
+            user_sums[user_id] += rating - global_mean - item_biases[item_id]
 
         # Set user bias estimation
-        user_biases = user_biases / (reg + user_counts)
+        user_biases[:] = user_sums / (reg + user_counts)
 
         # Update item bias parameters
-        item_biases = np.zeros(n_items)
+        item_sums = np.zeros(n_items)
 
         # Iterate through all user-item ratings
-        for i in range(X.shape[0]):
-            user_id, item_id, rating = int(X[i, 0]), int(X[i, 1]), X[i, 2]
-            item_biases[item_id] += rating - global_mean - user_biases[user_id]
+        for i in range(ratings.shape[0]):
+            user_id, item_id, rating = user_ids[i], item_ids[i], ratings[i]
+            item_sums[item_id] += rating - global_mean - user_biases[user_id]
 
         # Set item bias estimation
-        item_biases = item_biases / (reg + item_counts)
+        item_biases[:] = item_sums / (reg + item_counts)
 
         # Calculate error and print
         rmse = _calculate_rmse(
-            X=X,
+            user_ids=user_ids,
+            item_ids=item_ids,
+            ratings=ratings,
             global_mean=global_mean,
             user_biases=user_biases,
             item_biases=item_biases,
         )
         train_rmse.append(rmse)
 
+        # Calculate validation error
+        if has_validation:
+            val_rmse.append(
+                _calculate_rmse(
+                    user_ids=val_user_ids,
+                    item_ids=val_item_ids,
+                    ratings=val_ratings,
+                    global_mean=global_mean,
+                    user_biases=user_biases,
+                    item_biases=item_biases,
+                )
+            )
+
         if verbose == 1:
-            print("Epoch ", epoch + 1, "/", n_epochs, " -  train_rmse:", rmse)
+            print_epoch(epoch, n_epochs, rmse, val_rmse)
+
+        # Stop once the validation rmse, or the training rmse without validation, stops improving
+        if stop_early(val_rmse if has_validation else train_rmse, tol, patience):
+            break
 
-    return user_biases, item_biases, train_rmse
+    return user_biases, item_biases, train_rmse, val_rmse
 
 
 @nb.njit()
 def _predict(
-    X: np.ndarray,
+    user_ids: np.ndarray,
+    item_ids: np.ndarray,
     global_mean: float,
     min_rating: int,
     max_rating: int,
     user_biases: np.ndarray,
     item_biases: np.ndarray,
     bound_ratings: bool,
-) -> Tuple[list, list]:
+) -> Tuple[np.ndarray, np.ndarray]:
     """
     Calculate predicted ratings for each user-item pair.
 
     Arguments:
-        X {np.ndarray} -- Matrix with columns representing (user_id, item_id)
+        user_ids {np.ndarray} -- Assigned user_ids of the pairs, -1 for unknown users
+        item_ids {np.ndarray} -- Assigned item_ids of the pairs, -1 for unknown items
         global_mean {float} -- Global mean of all ratings
         min_rating {int} -- Lowest rating possible
         max_rating {int} -- Highest rating possible
@@ -388,12 +539,12 @@ def _predict(
         predictions [np.ndarray] -- Vector containing rating predictions of all user, items in same order as input X
         predictions_possible [np.ndarray] -- Vector of whether both given user and item were contained in the data that the model was fitted on
     """
+    n_pairs = user_ids.shape[0]
+    predictions = np.empty(n_pairs)
+    predictions_possible = np.empty(n_pairs, dtype=np.bool_)
 
-    predictions = []
-    predictions_possible = []
-
-    for i in range(X.shape[0]):
-        user_id, item_id = int(X[i, 0]), int(X[i, 1])
+    for i in range(n_pairs):
+        user_id, item_id = user_ids[i], item_ids[i]
         user_known = user_id != -1
         item_known = item_id != -1
 
@@ -411,7 +562,7 @@ def _predict(
             elif rating_pred < min_rating:
                 rating_pred = min_rating
 
-        predictions.append(rating_pred)
-        predictions_possible.append(user_known and item_known)
+        predictions[i] = rating_pred
+        predictions_possible[i] = user_known and item_known
 
     return predictions, predictions_possible
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from typing import Iterable
+
+
+class IdIndex:
+    """
+    Mapping of user or item ids to contiguous assigned integer ids, in the order the ids were added. A hash table gives O(1)
+    membership tests, single lookups and appends of new ids, and batches of ids are looked up at once with get_indexer. Large
+    batches go through a pandas Index of the ids, which is built on first use and kept until new ids are appended, as is the
+    array returned by to_numpy.
+
+    Arguments:
+        ids {iterable} -- Initial unique ids, assigned 0 to len(ids) - 1 (default: {()})
+
+    Attributes:
+        codes {dict} -- Mapping of ids to assigned integer ids
+    """
+
+    def __init__(self, ids: Iterable = ()):
+        self.codes = {}
+        self._ids = []
+        self._index = None
+        self._array = None
+        self.append(ids)
+        return
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, id) -> bool:
+        return id in self.codes
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def append(self, ids: Iterable) -> np.ndarray:
+        """
+        Assign the next integer ids to the given ids that are not already known
+
+        Arguments:
+            ids {iterable} -- Ids to add
+
+        Returns:
+            codes [np.ndarray] -- Assigned integer ids of the newly added ids
+        """
+        start = len(self._ids)
+        for id in ids:
+            if id not in self.codes:
+                self.codes[id] = len(self._ids)
+                self._ids.append(id)
+
+        if len(self._ids) > start:
+            self._index = None
+            self._array = None
+        return np.arange(start, len(self._ids), dtype=np.int64)
+
+    def get_indexer(self, ids: Iterable) -> np.ndarray:
+        """
+        Assigned integer ids of the given ids, -1 for unknown ids
+
+        Arguments:
+            ids {iterable} -- Ids to look up
+
+        Returns:
+            codes [np.ndarray] -- Assigned integer id of each given id
+        """
+        ids = ids if isinstance(ids, (np.ndarray, pd.Series, pd.Index)) else list(ids)
+
+        # Building the pandas Index costs O(len(self)), which small batches don't make up for
+        if self._index is None and 8 * len(ids) < len(self._ids):
+            return np.fromiter(
+                (self.codes.get(id, -1) for id in ids), dtype=np.int64, count=len(ids)
+            )
+
+        if self._index is None:
+            self._index = pd.Index(self._ids)
+        return self._index.get_indexer(ids).astype(np.int64, copy=False)
+
+    def to_numpy(self) -> np.ndarray:
+        """
+        Read-only array of the ids ordered by their assigned integer ids
+        """
+        if self._array is None:
+            self._array = np.array(self._ids, dtype=object)
+            self._array.flags.writeable = False
+        return self._array
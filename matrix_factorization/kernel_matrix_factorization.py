@@ -1,3 +1,4 @@
+import functools
 import math
 import numba as nb
 import numpy as np
@@ -7,13 +8,15 @@ from .kernels import (
     kernel_linear,
     kernel_sigmoid,
     kernel_rbf,
-    kernel_linear_sgd_update,
-    kernel_sigmoid_sgd_update,
-    kernel_rbf_sgd_update,
+    kernel_linear_gradient,
+    kernel_sigmoid_gradient,
+    kernel_rbf_gradient,
+    apply_gradient,
 )
-from .recommender_base import RecommenderBase
+from .mips_index import MIPSIndex
+from .recommender_base import RecommenderBase, print_epoch, stop_early
 
-from typing import Tuple, Union
+from typing import Any, Callable, NamedTuple, Tuple, Union
 
 
 class KernelMF(RecommenderBase):
@@ -34,6 +37,13 @@ class KernelMF(RecommenderBase):
         min_rating {int} -- Smallest rating possible (default: {0})
         max_rating {int} -- Largest rating possible (default: {5})
         verbose {str} -- Verbosity when fitting. Values possible are 0 to not print anything, 1 to print fitting model (default: {1})
+        n_jobs {int} -- Number of threads for Hogwild parallel SGD, where the shuffled ratings are split between threads that update the parameters without locks, or for the ALS solves. -1 for all available threads (default: {1})
+        dtype {str} -- Floating point type of the parameters and training ratings, 'float64' or 'float32'. float32 halves the model memory and doubles the SIMD width of the kernels (default: {'float64'})
+        method {str} -- Method to estimate parameters. Can be one of 'sgd' or 'als'. 'als' is only possible with the linear kernel and runs n_epochs alternating least squares iterations (default: {'sgd'})
+        validation_fraction {float} -- Fraction of the ratings held out of training to measure the validation rmse of each epoch. 0 for no validation (default: {0})
+        tol {float} -- Early stopping tolerance. Training stops when the validation rmse, or the training rmse without validation, didn't decrease by more than tol for patience epochs. None to always run n_epochs (default: {None})
+        patience {int} -- Number of epochs without improvement before stopping early (default: {5})
+        shuffle_block_size {int} -- SGD epochs visit the ratings in a new random order. None for a uniform shuffle, or a block size for a blocked shuffle of the ratings ordered by user, where blocks of shuffle_block_size ratings are visited in random order and shuffled within. Consecutive updates then share users, which keeps their parameters in cache (default: {None})
 
     Attributes:
         n_users {int} -- Number of users
@@ -43,10 +53,15 @@ class KernelMF(RecommenderBase):
         item_biases {numpy array} -- Item bias vector of shape (n_items, i)
         user_features {numpy array} -- Decomposed P matrix of user features of shape (n_users, n_factors)
         item_features {numpy array} -- Decomposed Q matrix of item features of shape (n_items, n_factors)
-        user_id_map {dict} -- Mapping of user ids to assigned integer ids
-        item_id_map {dict} -- Mapping of item ids to assigned integer ids
-        train_rmse -- Training rmse values
+        user_index {IdIndex} -- Index of user ids to assigned integer ids
+        item_index {IdIndex} -- Index of item ids to assigned integer ids
+        user_id_map {MappingProxyType} -- Read-only mapping of user ids to assigned integer ids
+        item_id_map {MappingProxyType} -- Read-only mapping of item ids to assigned integer ids
+        train_rmse -- Training rmse of each epoch, accumulated from the error of each rating before its update for SGD
+        val_rmse {list} -- Validation rmse of each epoch, empty without validation
         predictions_possible {list} -- Boolean vector of whether both user and item were known for prediction. Only available after calling predict
+        ann_index {MIPSIndex} -- Approximate index of the item features used by recommend(approximate=True). Only available after calling build_ann_index
+        ann_recall {float} -- Recall@10 of the approximate index against exact scoring on a sample of users. Only available after calling build_ann_index
     """
 
     def __init__(
@@ -62,10 +77,35 @@ class KernelMF(RecommenderBase):
         min_rating: int = 0,
         max_rating: int = 5,
         verbose: int = 1,
+        n_jobs: int = 1,
+        method: str = "sgd",
+        dtype: str = "float64",
+        validation_fraction: float = 0,
+        tol: float = None,
+        patience: int = 5,
+        shuffle_block_size: int = None,
     ):
         if kernel not in ("linear", "sigmoid", "rbf"):
             raise ValueError("Kernel must be one of linear, sigmoid, or rbf")
 
+        if method not in ("sgd", "als"):
+            raise ValueError('Method param must be either "sgd" or "als"')
+
+        if method == "als" and kernel != "linear":
+            raise ValueError('Method "als" is only possible with the linear kernel')
+
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError("Dtype must be either float32 or float64")
+
+        if not 0 <= validation_fraction < 1:
+            raise ValueError("Validation fraction must be in the range [0, 1)")
+
+        if patience < 1:
+            raise ValueError("Patience must be at least 1")
+
+        if shuffle_block_size is not None and shuffle_block_size < 1:
+            raise ValueError("Shuffle block size must be at least 1")
+
         super().__init__(min_rating=min_rating, max_rating=max_rating, verbose=verbose)
 
         self.n_factors = n_factors
@@ -76,8 +116,49 @@ class KernelMF(RecommenderBase):
         self.lr = lr
         self.init_mean = init_mean
         self.init_sd = init_sd
+        self.n_jobs = n_jobs
+        self.method = method
+        self.dtype = dtype
+        self.validation_fraction = validation_fraction
+        self.tol = tol
+        self.patience = patience
+        self.shuffle_block_size = shuffle_block_size
         return
 
+    def _n_threads(self) -> int:
+        """
+        Number of threads from n_jobs, bounded by the threads numba can run
+        """
+        if self.n_jobs == -1:
+            return nb.config.NUMBA_NUM_THREADS
+        return max(min(self.n_jobs, nb.config.NUMBA_NUM_THREADS), 1)
+
+    def _early_stopping_options(self) -> dict:
+        """
+        Early stopping options of the solvers, where a tolerance of -inf never stops
+        """
+        return {
+            "tol": -np.inf if self.tol is None else self.tol,
+            "patience": self.patience,
+        }
+
+    def _sgd_solver(self) -> Tuple[Callable, dict]:
+        """
+        SGD function to run with its specific options
+        """
+        loops = kernel_loops(self.kernel)
+        return (
+            _sgd,
+            {
+                "n_threads": self._n_threads(),
+                # A block size of 0 is a uniform shuffle
+                "shuffle_block_size": self.shuffle_block_size or 0,
+                "calculate_rmse": loops.calculate_rmse,
+                "sgd_update_ratings": loops.sgd_update_ratings,
+                "sgd_update_ratings_hogwild": loops.sgd_update_ratings_hogwild,
+            },
+        )
+
     def fit(self, X: pd.DataFrame, y: pd.Series):
         """ 
         Decompose user-item rating matrix into thin matrices P and Q along with user and item bias vectors
@@ -88,42 +169,87 @@ class KernelMF(RecommenderBase):
         """
         X = self._preprocess_data(X=X, y=y, type="fit")
         self.global_mean = X["rating"].mean()
+        data = self._training_data(
+            X,
+            validation_fraction=self.validation_fraction,
+            dtype=self.dtype,
+            sort_users=self.shuffle_block_size is not None,
+        )
+        # Free the preprocessed dataframe, the typed arrays replace it during training
+        del X
 
         # Initialize vector bias parameters
-        self.user_biases = np.zeros(self.n_users)
-        self.item_biases = np.zeros(self.n_items)
+        self.user_biases = np.zeros(self.n_users, dtype=self.dtype)
+        self.item_biases = np.zeros(self.n_items, dtype=self.dtype)
 
         # Initialize latent factor parameters of matrices P and Q
         self.user_features = np.random.normal(
             self.init_mean, self.init_sd, (self.n_users, self.n_factors)
-        )
+        ).astype(self.dtype)
         self.item_features = np.random.normal(
             self.init_mean, self.init_sd, (self.n_items, self.n_factors)
-        )
+        ).astype(self.dtype)
 
         # Perform stochastic gradient descent
-        (
-            self.user_features,
-            self.item_features,
-            self.user_biases,
-            self.item_biases,
-            self.train_rmse,
-        ) = _sgd(
-            X=X.to_numpy(),
-            global_mean=self.global_mean,
-            user_biases=self.user_biases,
-            item_biases=self.item_biases,
-            user_features=self.user_features,
-            item_features=self.item_features,
-            n_epochs=self.n_epochs,
-            kernel=self.kernel,
-            gamma=self.gamma,
-            lr=self.lr,
-            reg=self.reg,
-            min_rating=self.min_rating,
-            max_rating=self.max_rating,
-            verbose=self.verbose,
-        )
+        if self.method == "sgd":
+            sgd, sgd_options = self._sgd_solver()
+            (
+                self.user_features,
+                self.item_features,
+                self.user_biases,
+                self.item_biases,
+                self.train_rmse,
+                self.val_rmse,
+            ) = sgd(
+                **data,
+                global_mean=self.global_mean,
+                user_biases=self.user_biases,
+                item_biases=self.item_biases,
+                user_features=self.user_features,
+                item_features=self.item_features,
+                n_epochs=self.n_epochs,
+                gamma=self.gamma,
+                lr=self.lr,
+                reg=self.reg,
+                min_rating=self.min_rating,
+                max_rating=self.max_rating,
+                verbose=self.verbose,
+                **self._early_stopping_options(),
+                **sgd_options,
+            )
+
+        # Perform alternating least squares, with the solves of the users and items in parallel
+        elif self.method == "als":
+            n_threads = nb.get_num_threads()
+            nb.set_num_threads(self._n_threads())
+            try:
+                (
+                    self.user_features,
+                    self.item_features,
+                    self.user_biases,
+                    self.item_biases,
+                    self.train_rmse,
+                    self.val_rmse,
+                ) = _als(
+                    **data,
+                    global_mean=self.global_mean,
+                    user_biases=self.user_biases,
+                    item_biases=self.item_biases,
+                    user_features=self.user_features,
+                    item_features=self.item_features,
+                    n_epochs=self.n_epochs,
+                    reg=self.reg,
+                    verbose=self.verbose,
+                    calculate_rmse=kernel_loops("linear").calculate_rmse,
+                    **self._early_stopping_options(),
+                )
+            finally:
+                nb.set_num_threads(n_threads)
+
+        # The item features changed so an existing approximate index is rebuilt with the same settings
+        if getattr(self, "ann_index", None) is not None:
+            self.ann_index.fit(self._ann_vectors())
+            self.ann_recall = self.ann_index_recall()
 
         return self
 
@@ -145,8 +271,9 @@ class KernelMF(RecommenderBase):
         X = self._preprocess_data(X=X, type="predict")
 
         # Get predictions
-        predictions, predictions_possible = _predict(
-            X=X.to_numpy(),
+        predictions, predictions_possible = kernel_loops(self.kernel).predict(
+            user_ids=X["user_id"].to_numpy(dtype=np.int32),
+            item_ids=X["item_id"].to_numpy(dtype=np.int32),
             global_mean=self.global_mean,
             user_biases=self.user_biases,
             item_biases=self.item_biases,
@@ -154,13 +281,213 @@ class KernelMF(RecommenderBase):
             item_features=self.item_features,
             min_rating=self.min_rating,
             max_rating=self.max_rating,
-            kernel=self.kernel,
             gamma=self.gamma,
             bound_ratings=bound_ratings,
         )
 
-        self.predictions_possible = predictions_possible
-        return predictions
+        self.predictions_possible = predictions_possible.tolist()
+        return predictions.tolist()
+
+    def _user_parameters(self, users: list) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Biases and features of the given users, with zero bias and features for unknown users as in predict
+        """
+        user_indexes = self.user_index.get_indexer(users)
+        is_known = user_indexes != -1
+        user_biases = np.where(is_known, self.user_biases[user_indexes], 0)
+        user_features = np.where(
+            is_known[:, None], self.user_features[user_indexes, :], 0
+        )
+        return user_biases, user_features
+
+    def _predict_users_items(self, users: list, items: np.ndarray = None) -> np.ndarray:
+        """
+        Predict the unbounded ratings of all items for each of the given users with a single product of the users features
+        and the item features. Unknown users get zero bias and features, as in predict.
+
+        Arguments:
+            users {list} -- User_ids to predict ratings for (not assigned user_ids from self.user_id_map)
+            items {np.ndarray} -- Assigned item ids to predict ratings for instead of all items (default: {None})
+
+        Returns:
+            item_ratings [np.ndarray] -- Rating predictions of shape (len(users), n_items) ordered by the assigned item ids
+        """
+        user_biases, user_features = self._user_parameters(users)
+        item_biases = self.item_biases if items is None else self.item_biases[items]
+        item_features = (
+            self.item_features if items is None else self.item_features[items, :]
+        )
+
+        if self.kernel == "rbf":
+            # Squared distances as |p|^2 + |q|^2 - 2 p.q, to use a matrix product
+            squared_distances = (
+                np.square(user_features).sum(axis=1)[:, None]
+                + np.square(item_features).sum(axis=1)[None, :]
+                - 2 * user_features @ item_features.T
+            )
+            return self.min_rating + (self.max_rating - self.min_rating) * np.exp(
+                -self.gamma * np.maximum(squared_distances, 0)
+            )
+
+        linear_sum = (
+            self.global_mean
+            + user_biases[:, None]
+            + item_biases[None, :]
+            + user_features @ item_features.T
+        )
+        if self.kernel == "sigmoid":
+            return self.min_rating + (self.max_rating - self.min_rating) / (
+                1 + np.exp(-linear_sum)
+            )
+        return linear_sum
+
+    def _ann_vectors(self) -> np.ndarray:
+        """
+        Item vectors of the approximate index. The linear and sigmoid kernels are monotonic in p.q + item bias, which is the
+        inner product of [q, item bias] with [p, 1], while the rbf kernel is monotonic in the distance between p and q.
+        """
+        if self.kernel == "rbf":
+            return self.item_features
+        return np.concatenate((self.item_features, self.item_biases[:, None]), axis=1)
+
+    def _ann_query(self, user: Any) -> np.ndarray:
+        """
+        Query vector of the approximate index for a given user_id
+        """
+        _, user_features = self._user_parameters([user])
+        if self.kernel == "rbf":
+            return user_features[0]
+        return np.append(user_features[0], 1)
+
+    def build_ann_index(
+        self,
+        n_lists: int = None,
+        n_probe: int = 16,
+        n_iter: int = 10,
+        random_state: int = None,
+    ):
+        """
+        Build an approximate index of the item features for recommend(approximate=True), which only scores the items in the
+        n_probe index lists closest to the user instead of the whole catalog. The recall@10 of the index against exact
+        scoring is measured on a sample of users and kept in ann_recall. The index is rebuilt on every later fit. Scoring every
+        item is already fast for catalogs of a few thousand items, the index pays off for tens of thousands of items and more.
+
+        Arguments:
+            n_lists {int} -- Number of lists the items are clustered into. If None then sqrt(n_items) is used (default: {None})
+            n_probe {int} -- Number of lists searched for each user. Larger values give a higher recall and slower searches (default: {16})
+            n_iter {int} -- Number of k-means iterations of the clustering (default: {10})
+            random_state {int} -- Seed of the clustering (default: {None})
+        """
+        self.ann_index = MIPSIndex(
+            n_lists=n_lists,
+            n_probe=n_probe,
+            n_iter=n_iter,
+            metric="euclidean" if self.kernel == "rbf" else "inner_product",
+            random_state=random_state,
+        )
+        self.ann_index.fit(self._ann_vectors())
+        self.ann_recall = self.ann_index_recall()
+        if self.verbose == 1:
+            print("Approximate index recall@10: ", self.ann_recall)
+
+        return self
+
+    def ann_index_recall(
+        self, users: list = None, amount: int = 10, n_users: int = 100
+    ) -> float:
+        """
+        Recall@amount of the approximate index: the fraction of the exact top amount items of each user that the index finds
+
+        Arguments:
+            users {list} -- User_ids to measure the recall on. If None then a random sample of n_users known users is used (default: {None})
+            amount {int} -- Number of top items compared (default: {10})
+            n_users {int} -- Number of users sampled when users is None (default: {100})
+
+        Returns:
+            recall [float] -- Mean recall over the users
+        """
+        if users is None:
+            known_users = self.user_index.to_numpy()
+            sample = np.random.choice(
+                len(known_users), min(n_users, len(known_users)), replace=False
+            )
+            users = known_users[sample].tolist()
+        if len(users) == 0 or self.n_items == 0:
+            return 1.0
+
+        amount = min(amount, self.n_items)
+        item_ratings = self._predict_users_items(users)
+        exact = np.argpartition(-item_ratings, amount - 1, axis=1)[:, :amount]
+        recalls = [
+            np.isin(
+                self.ann_index.search(self._ann_query(user), amount), exact[row]
+            ).mean()
+            for row, user in enumerate(users)
+        ]
+        return float(np.mean(recalls))
+
+    def recommend(
+        self,
+        user: Any,
+        amount: int = 10,
+        items_known: list = None,
+        include_user: bool = True,
+        bound_ratings: bool = True,
+        approximate: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Returns a DataFrame of recommendations of items for a given user sorted from highest to lowest.
+
+        Arguments:
+            user {any} -- User_id to get recommendations for (not assigned user_id from self.user_id_map)
+            amount {int} -- Number of items to recommend (default: {10})
+            items_known {list} -- List of items already known by user and to not be considered in recommendations (default: {None})
+            include_user {bool} -- Whether to include the user_id in the output DataFrame or not (default: {True})
+            bound_ratings {bool} -- Whether to bound ratings in range [min_rating, max_rating] (default: {True})
+            approximate {bool} -- Whether to search the top items with the index of build_ann_index instead of scoring all items (default: {False})
+
+        Returns:
+            recommendations [pd.DataFrame] -- Recommendations DataFrame for user with columns user_id (optional), item_id, rating sorted from highest to lowest rating
+        """
+        if not approximate:
+            return super().recommend(
+                user, amount, items_known, include_user, bound_ratings
+            )
+
+        return self._format_recommendations(
+            self._approximate_top_items(user, amount, items_known),
+            include_user,
+            bound_ratings,
+        )
+
+    def _approximate_top_items(
+        self, user: Any, amount: int, items_known: list = None
+    ) -> pd.DataFrame:
+        """
+        Select the top rated items for a given user with the approximate index, in the format of _top_items
+
+        Arguments:
+            user {any} -- User_id to get recommendations for
+            amount {int} -- Number of items to keep
+            items_known {list} -- List of items already known by user and to not be considered (default: {None})
+
+        Returns:
+            recommendations [pd.DataFrame] -- DataFrame with columns user_id, item_id, rating_pred sorted from highest to lowest rating
+        """
+        if getattr(self, "ann_index", None) is None:
+            raise ValueError("No approximate index, call build_ann_index first")
+
+        known = self._known_item_indexes(items_known)
+        items = self.ann_index.search(self._ann_query(user), amount, exclude=known)
+        return pd.DataFrame(
+            {
+                "user_id": user,
+                "item_id": self._item_ids()[items],
+                "rating_pred": self._predict_users_items([user], items)[0],
+            },
+            # Position of each item among the items not known, as in _top_items
+            index=items - np.searchsorted(known, items),
+        )
 
     def update_users(
         self,
@@ -169,12 +496,14 @@ class KernelMF(RecommenderBase):
         lr: float = 0.01,
         n_epochs: int = 20,
         verbose: int = 0,
+        method: str = "sgd",
     ):
         """
-        Update P user features matrix with new/updated user-item ratings information using SGD. Only the user parameters corresponding for the
-        new/updated users will be updated and item parameters will be left alone.
+        Update P user features matrix with new/updated user-item ratings information using SGD, or in closed form for the linear kernel.
+        Only the user parameters corresponding for the new/updated users will be updated and item parameters will be left alone.
 
-        Note: If updating old users then pass all user-item ratings for old users and not just modified ratings
+        Note: If updating old users then pass all user-item ratings for old users and not just modified ratings. The validation_fraction,
+        tol and patience of the model apply to SGD updates as in fit.
 
         Args:
             X (pd.DataFrame): Dataframe containing columns user_id, item_id 
@@ -182,49 +511,62 @@ class KernelMF(RecommenderBase):
             lr (float, optional): Learning rate alpha for gradient optimization step
             n_epochs (int, optional): Number of epochs to run SGD. Defaults to 20.
             verbose (int, optional): Verbosity when updating, 0 for nothing and 1 for training messages. Defaults to 0.
+            method (str, optional): 'sgd' to run SGD epochs, or 'solve' to fold the users in by solving their features and bias exactly
+                given the fixed item parameters, a small ridge regression per user as in an ALS step. 'solve' is only exact for the
+                linear kernel, so the sigmoid and rbf kernels fall back to SGD. Defaults to 'sgd'.
         """
+        if method not in ("sgd", "solve"):
+            raise ValueError('Method param must be either "sgd" or "solve"')
+
         X, known_users, new_users = self._preprocess_data(X=X, y=y, type="update")
         n_new_users = len(new_users)
 
         # Re-initialize params for old users
-        for user in known_users:
-            user_index = self.user_id_map[user]
-
-            # Initialize bias
-            self.user_biases[user_index] = 0
-
-            # Initialize latent factors vector
-            self.user_features[user_index, :] = np.random.normal(
-                self.init_mean, self.init_sd, (1, self.n_factors)
-            )
+        user_indexes = self.user_index.get_indexer(known_users)
+        self.user_biases[user_indexes] = 0
+        self.user_features[user_indexes, :] = np.random.normal(
+            self.init_mean, self.init_sd, (len(user_indexes), self.n_factors)
+        )
 
         # Add bias parameters for new users
-        self.user_biases = np.append(self.user_biases, np.zeros(n_new_users))
+        self._append_rows("user_biases", np.zeros(n_new_users))
 
         # Add latent factor parameters for new users by adding rows to P matrix
-        new_user_features = np.random.normal(
-            self.init_mean, self.init_sd, (n_new_users, self.n_factors)
-        )
-        self.user_features = np.concatenate(
-            (self.user_features, new_user_features), axis=0
+        self._append_rows(
+            "user_features",
+            np.random.normal(
+                self.init_mean, self.init_sd, (n_new_users, self.n_factors)
+            ),
         )
 
+        # Solve the new parameters of all updated users at once
+        if method == "solve" and self.kernel == "linear":
+            self._fold_in_users(self._training_data(X, dtype=self.user_features.dtype))
+            return
+
         # Estimate new parameters
+        data = self._training_data(
+            X,
+            validation_fraction=self.validation_fraction,
+            dtype=self.user_features.dtype,
+            sort_users=self.shuffle_block_size is not None,
+        )
+        sgd, sgd_options = self._sgd_solver()
         (
             self.user_features,
             self.item_features,
             self.user_biases,
             self.item_biases,
             self.train_rmse,
-        ) = _sgd(
-            X=X.to_numpy(),
+            self.val_rmse,
+        ) = sgd(
+            **data,
             global_mean=self.global_mean,
             user_biases=self.user_biases,
             item_biases=self.item_biases,
             user_features=self.user_features,
             item_features=self.item_features,
             n_epochs=n_epochs,
-            kernel=self.kernel,
             gamma=self.gamma,
             lr=lr,
             reg=self.reg,
@@ -232,130 +574,635 @@ class KernelMF(RecommenderBase):
             max_rating=self.max_rating,
             verbose=verbose,
             update_item_params=False,
+            **self._early_stopping_options(),
+            **sgd_options,
         )
 
         return
 
+    def _fold_in_users(self, data: dict):
+        """
+        Set the features and bias of the users of the given ratings to the exact minimizers of the regularized squared error of their
+        ratings, given the fixed item parameters. Each user is an independent ridge regression solved with _als_solve, in parallel over
+        the users, so no SGD epochs are needed.
+
+        Arguments:
+            data {dict} -- Rating arrays of the users from _training_data, without validation ratings
+        """
+        users, local_user_ids = np.unique(data["user_ids"], return_inverse=True)
+        indptr, rows = _index_ratings(local_user_ids.astype(np.int32), len(users))
+        user_biases = np.empty(len(users), dtype=self.user_biases.dtype)
+        user_features = np.empty(
+            (len(users), self.n_factors), dtype=self.user_features.dtype
+        )
+
+        n_threads = nb.get_num_threads()
+        nb.set_num_threads(self._n_threads())
+        try:
+            _als_solve(
+                indptr,
+                rows,
+                data["item_ids"],
+                data["ratings"] - self.global_mean,
+                self.item_biases,
+                self.item_features,
+                user_biases,
+                user_features,
+                self.reg,
+            )
+        finally:
+            nb.set_num_threads(n_threads)
+
+        self.user_biases[users] = user_biases
+        self.user_features[users] = user_features
+
+        # The linear kernel ignores the rating range and gamma of calculate_rmse
+        self.train_rmse = [
+            kernel_loops("linear").calculate_rmse(
+                data["user_ids"],
+                data["item_ids"],
+                data["ratings"],
+                self.global_mean,
+                self.user_biases,
+                self.item_biases,
+                self.user_features,
+                self.item_features,
+                0.0,
+                0.0,
+                0.0,
+            )
+        ]
+        self.val_rmse = []
+        return
+
+
+@nb.njit()
+def _linear_rating(
+    global_mean: float,
+    user_bias: float,
+    item_bias: float,
+    user_feature_vec: np.ndarray,
+    item_feature_vec: np.ndarray,
+    gamma: float,
+    a: float,
+    c: float,
+) -> float:
+    """
+    Rating of the linear kernel, with the signature of KERNEL_FUNCTIONS
+    """
+    return kernel_linear(
+        global_mean, user_bias, item_bias, user_feature_vec, item_feature_vec
+    )
+
+
+@nb.njit()
+def _sigmoid_rating(
+    global_mean: float,
+    user_bias: float,
+    item_bias: float,
+    user_feature_vec: np.ndarray,
+    item_feature_vec: np.ndarray,
+    gamma: float,
+    a: float,
+    c: float,
+) -> float:
+    """
+    Rating of the sigmoid kernel, with the signature of KERNEL_FUNCTIONS
+    """
+    return kernel_sigmoid(
+        global_mean, user_bias, item_bias, user_feature_vec, item_feature_vec, a, c
+    )
+
+
+@nb.njit()
+def _rbf_rating(
+    global_mean: float,
+    user_bias: float,
+    item_bias: float,
+    user_feature_vec: np.ndarray,
+    item_feature_vec: np.ndarray,
+    gamma: float,
+    a: float,
+    c: float,
+) -> float:
+    """
+    Rating of the rbf kernel, with the signature of KERNEL_FUNCTIONS
+    """
+    return kernel_rbf(user_feature_vec, item_feature_vec, gamma, a, c)
+
 
 @nb.njit()
-def _calculate_rmse(
-    X: np.ndarray,
+def _linear_gradient(
+    user_id: int,
+    item_id: int,
+    rating: float,
     global_mean: float,
     user_biases: np.ndarray,
     item_biases: np.ndarray,
     user_features: np.ndarray,
     item_features: np.ndarray,
-    min_rating: float,
-    max_rating: float,
-    kernel: str,
+    reg: float,
     gamma: float,
-):
+    a: float,
+    c: float,
+    user_gradient: np.ndarray,
+    item_gradient: np.ndarray,
+) -> float:
+    """
+    Gradients of the linear kernel into user_gradient and item_gradient, returning the error, with the signature of KERNEL_FUNCTIONS
+    """
+    return kernel_linear_gradient(
+        user_id,
+        item_id,
+        rating,
+        global_mean,
+        user_biases,
+        item_biases,
+        user_features,
+        item_features,
+        reg,
+        user_gradient,
+        item_gradient,
+    )
+
+
+@nb.njit()
+def _sigmoid_gradient(
+    user_id: int,
+    item_id: int,
+    rating: float,
+    global_mean: float,
+    user_biases: np.ndarray,
+    item_biases: np.ndarray,
+    user_features: np.ndarray,
+    item_features: np.ndarray,
+    reg: float,
+    gamma: float,
+    a: float,
+    c: float,
+    user_gradient: np.ndarray,
+    item_gradient: np.ndarray,
+) -> float:
     """
-    Calculates root mean squared error for given data and model parameters
-
-    Args:
-        X (np.ndarray): Matrix with columns user, item and rating
-        global_mean (float): Global mean rating
-        user_biases (np.ndarray): User biases vector of shape (n_users, 1)
-        item_biases (np.ndarray): Item biases vector of shape (n_items, 1)
-        user_features (np.ndarray): User features matrix P of size (n_users, n_factors)
-        item_features (np.ndarray): Item features matrix Q of size (n_items, n_factors)
-        min_rating (float): Minimum possible rating
-        max_rating (float): Maximum possible rating
-        kernel (str): Kernel type. Possible options are "linear", "sigmoid" or "rbf" kernel
-        gamma (float): Kernel coefficient only for "rbf" kernel
+    Gradients of the sigmoid kernel into user_gradient and item_gradient, returning the error, with the signature of KERNEL_FUNCTIONS
+    """
+    return kernel_sigmoid_gradient(
+        user_id,
+        item_id,
+        rating,
+        global_mean,
+        user_biases,
+        item_biases,
+        user_features,
+        item_features,
+        reg,
+        a,
+        c,
+        user_gradient,
+        item_gradient,
+    )
+
+
+@nb.njit()
+def _rbf_gradient(
+    user_id: int,
+    item_id: int,
+    rating: float,
+    global_mean: float,
+    user_biases: np.ndarray,
+    item_biases: np.ndarray,
+    user_features: np.ndarray,
+    item_features: np.ndarray,
+    reg: float,
+    gamma: float,
+    a: float,
+    c: float,
+    user_gradient: np.ndarray,
+    item_gradient: np.ndarray,
+) -> float:
+    """
+    Gradients of the rbf kernel into user_gradient and item_gradient, returning the error, with the signature of KERNEL_FUNCTIONS
+    """
+    return kernel_rbf_gradient(
+        user_id,
+        item_id,
+        rating,
+        user_features,
+        item_features,
+        reg,
+        gamma,
+        a,
+        c,
+        user_gradient,
+        item_gradient,
+    )
+
+
+# Rating and gradient functions of each kernel, with the same signatures
+KERNEL_FUNCTIONS = {
+    "linear": (_linear_rating, _linear_gradient),
+    "sigmoid": (_sigmoid_rating, _sigmoid_gradient),
+    "rbf": (_rbf_rating, _rbf_gradient),
+}
+
+
+class KernelLoops(NamedTuple):
+    calculate_rmse: Callable
+    sgd_update_ratings: Callable
+    sgd_update_ratings_hogwild: Callable
+    predict: Callable
+
+
+@functools.lru_cache(maxsize=None)
+def kernel_loops(kernel: str) -> KernelLoops:
+    """
+    Compiled per rating loops specialized to a kernel. The kernel functions are constants of the loops, so numba calls them
+    directly instead of comparing the kernel for every rating or calling them through a function argument. The loops are
+    selected once per call and passed to _sgd and _als, which call them once per epoch.
+
+    Arguments:
+        kernel {str} -- Kernel function. Options are 'linear', 'sigmoid', and 'rbf'
 
     Returns:
-        rmse [float]: Root mean squared error
+        kernel_loops [KernelLoops] -- Loops of the kernel
     """
-    n_ratings = X.shape[0]
-    errors = np.zeros(n_ratings)
-
-    # Iterate through all user-item ratings and calculate error
-    for i in range(n_ratings):
-        user_id, item_id, rating = int(X[i, 0]), int(X[i, 1]), X[i, 2]
-        user_bias = user_biases[user_id]
-        item_bias = item_biases[item_id]
-        user_feature_vec = user_features[user_id, :]
-        item_feature_vec = item_features[item_id, :]
-
-        # Calculate predicted rating for given kernel
-        if kernel == "linear":
-            rating_pred = kernel_linear(
-                global_mean=global_mean,
-                user_bias=user_bias,
-                item_bias=item_bias,
-                user_feature_vec=user_feature_vec,
-                item_feature_vec=item_feature_vec,
+    rating_function, gradient_function = KERNEL_FUNCTIONS[kernel]
+
+    @nb.njit()
+    def calculate_rmse(
+        user_ids: np.ndarray,
+        item_ids: np.ndarray,
+        ratings: np.ndarray,
+        global_mean: float,
+        user_biases: np.ndarray,
+        item_biases: np.ndarray,
+        user_features: np.ndarray,
+        item_features: np.ndarray,
+        min_rating: float,
+        max_rating: float,
+        gamma: float,
+    ):
+        """
+        Calculates root mean squared error for given data and model parameters
+
+        Args:
+            user_ids (np.ndarray): User id of each rating
+            item_ids (np.ndarray): Item id of each rating
+            ratings (np.ndarray): Ratings
+            global_mean (float): Global mean rating
+            user_biases (np.ndarray): User biases vector of shape (n_users, 1)
+            item_biases (np.ndarray): Item biases vector of shape (n_items, 1)
+            user_features (np.ndarray): User features matrix P of size (n_users, n_factors)
+            item_features (np.ndarray): Item features matrix Q of size (n_items, n_factors)
+            min_rating (float): Minimum possible rating
+            max_rating (float): Maximum possible rating
+            gamma (float): Kernel coefficient only for "rbf" kernel
+
+        Returns:
+            rmse [float]: Root mean squared error
+        """
+        n_ratings = ratings.shape[0]
+        squared_error_sum = 0.0
+
+        # Iterate through all user-item ratings and sum the squared errors
+        for i in range(n_ratings):
+            user_id, item_id = user_ids[i], item_ids[i]
+            rating_pred = rating_function(
+                global_mean,
+                user_biases[user_id],
+                item_biases[item_id],
+                user_features[user_id, :],
+                item_features[item_id, :],
+                gamma,
+                min_rating,
+                max_rating - min_rating,
+            )
+
+            # Calculate error
+            error = ratings[i] - rating_pred
+            squared_error_sum += error * error
+
+        rmse = np.sqrt(squared_error_sum / max(n_ratings, 1))
+
+        return rmse
+
+    @nb.njit()
+    def sgd_update_ratings(
+        user_ids: np.ndarray,
+        item_ids: np.ndarray,
+        ratings: np.ndarray,
+        order: np.ndarray,
+        start: int,
+        end: int,
+        global_mean: float,
+        user_biases: np.ndarray,
+        item_biases: np.ndarray,
+        user_features: np.ndarray,
+        item_features: np.ndarray,
+        gamma: float,
+        lr: float,
+        reg: float,
+        min_rating: float,
+        max_rating: float,
+        update_user_params: bool,
+        update_item_params: bool,
+    ):
+        """
+        Performs the stochastic gradient descent updates of the ratings order[start:end], in place, summing the squared error of
+        each rating before its update. This gives the training loss of the epoch without a second pass over the ratings.
+
+        Arguments:
+            user_ids {numpy array} -- User id of each rating
+            item_ids {numpy array} -- Item id of each rating
+            ratings {numpy array} -- Ratings
+            order {numpy array} -- Indexes of the ratings in the order to update with, from _shuffled_order
+            start {int} -- First position in order to update with
+            end {int} -- End of the positions in order to update with (exclusive)
+            global_mean {float} -- Global mean of all ratings
+            user_biases {numpy array} -- User biases vector of shape (n_users, 1)
+            item_biases {numpy array} -- Item biases vector of shape (n_items, 1)
+            user_features {numpy array} -- Matrix P of user features of shape (n_users, n_factors)
+            item_features {numpy array} -- Matrix Q of item features of shape (n_items, n_factors)
+            gamma {float} -- Kernel coefficient for 'rbf'. Ignored by other kernels.
+            lr {float} -- Learning rate alpha
+            reg {float} -- Regularization parameter lambda for Frobenius norm
+            min_rating {float} -- Minimum possible rating
+            max_fating {float} -- Maximum possible rating
+            update_user_params {bool} -- Whether to update user parameters or not
+            update_item_params {bool} -- Whether to update item  parameters or not
+
+        Returns:
+            squared_error_sum [float] -- Sum of the squared errors of the ratings before their updates
+        """
+        n_factors = user_features.shape[1]
+        user_gradient = np.empty(n_factors + 1)
+        item_gradient = np.empty(n_factors + 1)
+        squared_error_sum = 0.0
+        for i in range(start, end):
+            row = order[i]
+            user_id, item_id = user_ids[row], item_ids[row]
+            error = gradient_function(
+                user_id,
+                item_id,
+                ratings[row],
+                global_mean,
+                user_biases,
+                item_biases,
+                user_features,
+                item_features,
+                reg,
+                gamma,
+                min_rating,
+                max_rating - min_rating,
+                user_gradient,
+                item_gradient,
+            )
+            squared_error_sum += error * error
+
+            if update_user_params:
+                apply_gradient(user_id, user_biases, user_features, user_gradient, lr)
+
+            if update_item_params:
+                apply_gradient(item_id, item_biases, item_features, item_gradient, lr)
+
+        return squared_error_sum
+
+    @nb.njit(parallel=True)
+    def sgd_update_ratings_hogwild(
+        user_ids: np.ndarray,
+        item_ids: np.ndarray,
+        ratings: np.ndarray,
+        order: np.ndarray,
+        n_threads: int,
+        global_mean: float,
+        user_biases: np.ndarray,
+        item_biases: np.ndarray,
+        user_features: np.ndarray,
+        item_features: np.ndarray,
+        gamma: float,
+        lr: float,
+        reg: float,
+        min_rating: float,
+        max_rating: float,
+        update_user_params: bool,
+        update_item_params: bool,
+    ):
+        """
+        Performs the stochastic gradient descent updates of all ratings Hogwild style: the shuffled order is split into
+        n_threads contiguous partitions that are updated in parallel without locks. Ratings are sparse so two threads rarely
+        update the same user or item at once, and an occasional overwritten update doesn't hurt convergence.
+        See Niu et al. "Hogwild!: A Lock-Free Approach to Parallelizing Stochastic Gradient Descent".
+
+        Arguments and returns are the same as sgd_update_ratings, with n_threads the number of partitions instead of start and end
+        """
+        n_ratings = ratings.shape[0]
+        partition_size = (n_ratings + n_threads - 1) // n_threads
+        squared_error_sums = np.zeros(n_threads)
+
+        for thread in nb.prange(n_threads):
+            squared_error_sums[thread] = sgd_update_ratings(
+                user_ids,
+                item_ids,
+                ratings,
+                order,
+                thread * partition_size,
+                min((thread + 1) * partition_size, n_ratings),
+                global_mean,
+                user_biases,
+                item_biases,
+                user_features,
+                item_features,
+                gamma,
+                lr,
+                reg,
+                min_rating,
+                max_rating,
+                update_user_params,
+                update_item_params,
             )
 
-        elif kernel == "sigmoid":
-            rating_pred = kernel_sigmoid(
-                global_mean=global_mean,
-                user_bias=user_bias,
-                item_bias=item_bias,
-                user_feature_vec=user_feature_vec,
-                item_feature_vec=item_feature_vec,
-                a=min_rating,
-                c=max_rating - min_rating,
+        return squared_error_sums.sum()
+
+    @nb.njit()
+    def predict(
+        user_ids: np.ndarray,
+        item_ids: np.ndarray,
+        global_mean: float,
+        user_biases: np.ndarray,
+        item_biases: np.ndarray,
+        user_features: np.ndarray,
+        item_features: np.ndarray,
+        min_rating: int,
+        max_rating: int,
+        gamma: float,
+        bound_ratings: bool,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calculate predicted ratings for each user-item pair.
+
+        Arguments:
+            user_ids {np.ndarray} -- User id of each pair, -1 for unknown users
+            item_ids {np.ndarray} -- Item id of each pair, -1 for unknown items
+            global_mean {float} -- Global mean of all ratings
+            user_biases {np.ndarray} -- User biases vector of length n_users
+            item_biases {np.ndarray} -- Item biases vector of length n_items
+            user_features {np.ndarray} -- User features matrix P of shape (n_users, n_factors)
+            item_features {np.ndarray} -- Item features matrix Q of shape (n_items, n_factors)
+            min_rating {int} -- Lowest rating possible
+            max_rating {int} -- Highest rating possible
+            gamma {float} -- Kernel coefficient for 'rbf' only
+            bound_ratings (bool): Whether to bound ratings in range [min_rating, max_rating] (default: True)
+
+        Returns:
+            predictions [np.ndarray] -- Vector containing rating predictions of all user, items in same order as input X
+            predictions_possible [np.ndarray] -- Vector of whether both given user and item were contained in the data that the model was fitted on
+        """
+        n_pairs = user_ids.shape[0]
+        predictions = np.empty(n_pairs)
+        predictions_possible = np.empty(n_pairs, dtype=np.bool_)
+        zero_feature_vec = np.zeros(user_features.shape[1], dtype=user_features.dtype)
+
+        for i in range(n_pairs):
+            user_id, item_id = user_ids[i], item_ids[i]
+            user_known = user_id != -1
+            item_known = item_id != -1
+
+            # Default values if user or item are not known
+            user_bias = user_biases[user_id] if user_known else 0.0
+            item_bias = item_biases[item_id] if item_known else 0.0
+            user_feature_vec = (
+                user_features[user_id, :] if user_known else zero_feature_vec
+            )
+            item_feature_vec = (
+                item_features[item_id, :] if item_known else zero_feature_vec
             )
 
-        elif kernel == "rbf":
-            rating_pred = kernel_rbf(
-                user_feature_vec=user_feature_vec,
-                item_feature_vec=item_feature_vec,
-                gamma=gamma,
-                a=min_rating,
-                c=max_rating - min_rating,
+            # Calculate predicted rating given kernel
+            rating_pred = rating_function(
+                global_mean,
+                user_bias,
+                item_bias,
+                user_feature_vec,
+                item_feature_vec,
+                gamma,
+                min_rating,
+                max_rating - min_rating,
             )
 
-        # Calculate error
-        errors[i] = rating - rating_pred
+            # Bound ratings to min and max rating range
+            if bound_ratings:
+                if rating_pred > max_rating:
+                    rating_pred = max_rating
+                elif rating_pred < min_rating:
+                    rating_pred = min_rating
+
+            predictions[i] = rating_pred
+            predictions_possible[i] = user_known and item_known
+
+        return predictions, predictions_possible
+
+    return KernelLoops(
+        calculate_rmse,
+        sgd_update_ratings,
+        sgd_update_ratings_hogwild,
+        predict,
+    )
+
+
+@nb.njit()
+def _shuffled_order(n_ratings: int, block_size: int) -> np.ndarray:
+    """
+    Random order to visit the ratings in for an epoch, as indexes so the ratings themselves are never moved. A block_size of
+    0 gives a uniform random permutation. Otherwise the ratings are split into blocks of block_size consecutive ratings, and
+    the blocks are visited in a random order with a random order within each block. With the ratings ordered by user, the
+    updates of a block then share a few users whose parameters stay in cache.
+
+    Arguments:
+        n_ratings {int} -- Number of ratings
+        block_size {int} -- Number of ratings of each block, 0 for a uniform shuffle
 
-    rmse = np.sqrt(np.square(errors).mean())
+    Returns:
+        order [np.ndarray] -- Permutation of the indexes of the ratings
+    """
+    if block_size == 0:
+        return np.random.permutation(n_ratings)
+
+    n_blocks = (n_ratings + block_size - 1) // block_size
+    order = np.empty(n_ratings, dtype=np.int64)
+    position = 0
+    for block in np.random.permutation(n_blocks):
+        start = block * block_size
+        end = min(start + block_size, n_ratings)
+        order[position : position + end - start] = start + np.random.permutation(
+            end - start
+        )
+        position += end - start
 
-    return rmse
+    return order
 
 
 @nb.njit()
 def _sgd(
-    X: np.ndarray,
+    user_ids: np.ndarray,
+    item_ids: np.ndarray,
+    ratings: np.ndarray,
+    val_user_ids: np.ndarray,
+    val_item_ids: np.ndarray,
+    val_ratings: np.ndarray,
     global_mean: float,
     user_biases: np.ndarray,
     item_biases: np.ndarray,
     user_features: np.ndarray,
     item_features: np.ndarray,
     n_epochs: int,
-    kernel: str,
     gamma: float,
     lr: float,
     reg: float,
     min_rating: float,
     max_rating: float,
     verbose: int,
+    tol: float,
+    patience: int,
+    calculate_rmse: Callable,
+    sgd_update_ratings: Callable,
+    sgd_update_ratings_hogwild: Callable,
     update_user_params: bool = True,
     update_item_params: bool = True,
-) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, list]:
+    n_threads: int = 1,
+    shuffle_block_size: int = 0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, list, list]:
     """
-    Performs stochastic gradient descent to estimate parameters.
+    Performs stochastic gradient descent to estimate parameters. The training rmse of each epoch is summed from the errors of the
+    ratings during their updates, so it is measured with the parameters changing over the epoch and needs no extra pass.
 
     Arguments:
-        X {numpy array} -- User-item ranking matrix
+        user_ids {numpy array} -- User id of each rating
+        item_ids {numpy array} -- Item id of each rating
+        ratings {numpy array} -- Ratings, of the dtype of the parameters
+        val_user_ids {numpy array} -- User id of each validation rating, empty for no validation
+        val_item_ids {numpy array} -- Item id of each validation rating
+        val_ratings {numpy array} -- Validation ratings
         global_mean {float} -- Global mean of all ratings
         user_biases {numpy array} -- User biases vector of shape (n_users, 1)
         item_biases {numpy array} -- Item biases vector of shape (n_items, 1)
         user_features {numpy array} -- Start matrix P of user features of shape (n_users, n_factors)
         item_features {numpy array} -- Start matrix Q of item features of shape (n_items, n_factors)
         n_epochs {int} -- Number of epochs to run
-        kernel {str} -- Kernel function to use between user and item features. Options are 'linear', 'logistic', and 'rbf'. 
         gamma {float} -- Kernel coefficient for 'rbf'. Ignored by other kernels. 
         lr {float} -- Learning rate alpha
         reg {float} -- Regularization parameter lambda for Frobenius norm
         min_rating {float} -- Minimum possible rating
         max_fating {float} -- Maximum possible rating
         verbose {int} -- Verbosity when fitting. 0 for nothing and 1 for printing epochs
+        tol {float} -- Early stopping tolerance of stop_early, -inf to never stop
+        patience {int} -- Number of epochs without improvement to stop after
+        calculate_rmse {Callable} -- RMSE loop of the kernel from kernel_loops, for the validation ratings
+        sgd_update_ratings {Callable} -- SGD update loop of the kernel from kernel_loops
+        sgd_update_ratings_hogwild {Callable} -- Parallel SGD update loop of the kernel from kernel_loops
         update_user_params {bool} -- Whether to update user parameters or not. Default is True.
         update_item_params {bool} -- Whether to update item  parameters or not. Default is True.
+        n_threads {int} -- Number of threads of Hogwild parallel updates, 1 for the serial updates. Default is 1.
+        shuffle_block_size {int} -- Block size of the blocked shuffle of _shuffled_order, 0 for a uniform shuffle. Default is 0.
 
     Returns:
         user_features [np.ndarray] -- Updated user_features matrix P
@@ -363,179 +1210,299 @@ def _sgd(
         user_biases [np.ndarray] -- Updated user_biases vector
         item_biases [np.ndarray] -- Updated item_bases vector
         train_rmse [list] -- Training rmse values
+        val_rmse [list] -- Validation rmse values, empty without validation ratings
     """
+    n_ratings = ratings.shape[0]
     train_rmse = []
+    val_rmse = []
+    has_validation = val_ratings.shape[0] > 0
 
     for epoch in range(n_epochs):
-        # Shuffle dataset before each epoch
-        np.random.shuffle(X)
-
-        # Iterate through all user-item ratings
-        for i in range(X.shape[0]):
-            user_id, item_id, rating = int(X[i, 0]), int(X[i, 1]), X[i, 2]
-
-            if kernel == "linear":
-                kernel_linear_sgd_update(
-                    user_id=user_id,
-                    item_id=item_id,
-                    rating=rating,
-                    global_mean=global_mean,
-                    user_biases=user_biases,
-                    item_biases=item_biases,
-                    user_features=user_features,
-                    item_features=item_features,
-                    lr=lr,
-                    reg=reg,
-                    update_user_params=update_user_params,
-                    update_item_params=update_item_params,
-                )
-
-            elif kernel == "sigmoid":
-                kernel_sigmoid_sgd_update(
-                    user_id=user_id,
-                    item_id=item_id,
-                    rating=rating,
-                    global_mean=global_mean,
-                    user_biases=user_biases,
-                    item_biases=item_biases,
-                    user_features=user_features,
-                    item_features=item_features,
-                    lr=lr,
-                    reg=reg,
-                    a=min_rating,
-                    c=max_rating - min_rating,
-                    update_user_params=update_user_params,
-                    update_item_params=update_item_params,
-                )
-
-            elif kernel == "rbf":
-                kernel_rbf_sgd_update(
-                    user_id=user_id,
-                    item_id=item_id,
-                    rating=rating,
-                    user_features=user_features,
-                    item_features=item_features,
-                    lr=lr,
-                    reg=reg,
-                    gamma=gamma,
-                    a=min_rating,
-                    c=max_rating - min_rating,
-                    update_user_params=update_user_params,
-                    update_item_params=update_item_params,
-                )
+        # Shuffle the order of the ratings before each epoch
+        order = _shuffled_order(n_ratings, shuffle_block_size)
+
+        # Iterate through all user-item ratings, summing their squared errors
+        if n_threads > 1:
+            squared_error_sum = sgd_update_ratings_hogwild(
+                user_ids,
+                item_ids,
+                ratings,
+                order,
+                n_threads,
+                global_mean,
+                user_biases,
+                item_biases,
+                user_features,
+                item_features,
+                gamma,
+                lr,
+                reg,
+                min_rating,
+                max_rating,
+                update_user_params,
+                update_item_params,
+            )
+        else:
+            squared_error_sum = sgd_update_ratings(
+                user_ids,
+                item_ids,
+                ratings,
+                order,
+                0,
+                n_ratings,
+                global_mean,
+                user_biases,
+                item_biases,
+                user_features,
+                item_features,
+                gamma,
+                lr,
+                reg,
+                min_rating,
+                max_rating,
+                update_user_params,
+                update_item_params,
+            )
 
         # Calculate error and print
-        rmse = _calculate_rmse(
-            X=X,
-            global_mean=global_mean,
-            user_biases=user_biases,
-            item_biases=item_biases,
-            user_features=user_features,
-            item_features=item_features,
-            min_rating=min_rating,
-            max_rating=max_rating,
-            kernel=kernel,
-            gamma=gamma,
-        )
+        rmse = np.sqrt(squared_error_sum / max(n_ratings, 1))
         train_rmse.append(rmse)
 
+        # Calculate validation error
+        if has_validation:
+            val_rmse.append(
+                calculate_rmse(
+                    val_user_ids,
+                    val_item_ids,
+                    val_ratings,
+                    global_mean,
+                    user_biases,
+                    item_biases,
+                    user_features,
+                    item_features,
+                    min_rating,
+                    max_rating,
+                    gamma,
+                )
+            )
+
         if verbose == 1:
-            print("Epoch ", epoch + 1, "/", n_epochs, " -  train_rmse:", rmse)
+            print_epoch(epoch, n_epochs, rmse, val_rmse)
 
-    return user_features, item_features, user_biases, item_biases, train_rmse
+        # Stop once the validation rmse, or the training rmse without validation, stops improving
+        if stop_early(val_rmse if has_validation else train_rmse, tol, patience):
+            break
+
+    return user_features, item_features, user_biases, item_biases, train_rmse, val_rmse
 
 
 @nb.njit()
-def _predict(
-    X: np.ndarray,
+def _index_ratings(ids: np.ndarray, n_ids: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Index of the ratings of each user or item, in CSR form
+
+    Arguments:
+        ids {numpy array} -- User or item id of each rating
+        n_ids {int} -- Number of users or items
+
+    Returns:
+        indptr [np.ndarray] -- Ratings of id i are rows[indptr[i]:indptr[i + 1]]
+        rows [np.ndarray] -- Rows of the ratings ordered by id
+    """
+    indptr = np.zeros(n_ids + 1, dtype=np.int64)
+    for i in range(ids.shape[0]):
+        indptr[ids[i] + 1] += 1
+    indptr = np.cumsum(indptr)
+    rows = np.argsort(ids, kind="mergesort")
+    return indptr, rows
+
+
+@nb.njit(parallel=True)
+def _als_solve(
+    indptr: np.ndarray,
+    rows: np.ndarray,
+    other_ids: np.ndarray,
+    targets: np.ndarray,
+    other_biases: np.ndarray,
+    other_features: np.ndarray,
+    biases: np.ndarray,
+    features: np.ndarray,
+    reg: float,
+):
+    """
+    Solves in place the features and bias of each user (or item) given the fixed features and biases of the items (users)
+    it rated. With x_j = [q_j, 1] for each rated item j, [p, bias] is the solution of the regularized normal equations
+    (sum_j x_j x_j^T + reg * I) [p, bias] = sum_j (rating_j - global_mean - bias_j) x_j, one small system per user.
+
+    Arguments:
+        indptr {numpy array} -- Ratings index from _index_ratings of the users (items) being solved
+        rows {numpy array} -- Rows of the ratings from _index_ratings
+        other_ids {numpy array} -- Item (user) id of each rating
+        targets {numpy array} -- Rating minus the global mean of each rating
+        other_biases {numpy array} -- Fixed item (user) biases
+        other_features {numpy array} -- Fixed item (user) features
+        biases {numpy array} -- User (item) biases to solve
+        features {numpy array} -- User (item) features to solve
+        reg {float} -- Regularization parameter lambda for Frobenius norm
+    """
+    n_factors = features.shape[1]
+
+    for i in nb.prange(features.shape[0]):
+        A = reg * np.eye(n_factors + 1)
+        b = np.zeros(n_factors + 1)
+
+        for j in range(indptr[i], indptr[i + 1]):
+            row = rows[j]
+            other_id = other_ids[row]
+            target = targets[row] - other_biases[other_id]
+
+            # Add x x^T and target * x with x = [other features, 1]
+            for f in range(n_factors):
+                x_f = other_features[other_id, f]
+                for g in range(f + 1):
+                    A[f, g] += x_f * other_features[other_id, g]
+                A[n_factors, f] += x_f
+                b[f] += target * x_f
+            A[n_factors, n_factors] += 1
+            b[n_factors] += target
+
+        # Fill the upper triangle from the lower one
+        for f in range(n_factors + 1):
+            for g in range(f):
+                A[g, f] = A[f, g]
+
+        solution = np.linalg.solve(A, b)
+        features[i, :] = solution[:n_factors]
+        biases[i] = solution[n_factors]
+
+    return
+
+
+@nb.njit()
+def _als(
+    user_ids: np.ndarray,
+    item_ids: np.ndarray,
+    ratings: np.ndarray,
+    val_user_ids: np.ndarray,
+    val_item_ids: np.ndarray,
+    val_ratings: np.ndarray,
     global_mean: float,
     user_biases: np.ndarray,
     item_biases: np.ndarray,
     user_features: np.ndarray,
     item_features: np.ndarray,
-    min_rating: int,
-    max_rating: int,
-    kernel: str,
-    gamma: float,
-    bound_ratings: bool,
-) -> Tuple[list, list]:
-    """ 
-    Calculate predicted ratings for each user-item pair.
+    n_epochs: int,
+    reg: float,
+    verbose: int,
+    calculate_rmse: Callable,
+    tol: float,
+    patience: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, list, list]:
+    """
+    Performs Alternating Least Squares to estimate the parameters of the linear kernel. For every epoch, the item parameters are held
+    constant while solving directly for the features and bias of every user in closed form, then the user parameters are held constant
+    and the same is done for the items. Each solve is independent so the users (and then the items) are solved in parallel.
 
     Arguments:
-        X {np.ndarray} -- Matrix with columns representing (user_id, item_id)
+        user_ids {numpy array} -- User id of each rating
+        item_ids {numpy array} -- Item id of each rating
+        ratings {numpy array} -- Ratings
+        val_user_ids {numpy array} -- User id of each validation rating, empty for no validation
+        val_item_ids {numpy array} -- Item id of each validation rating
+        val_ratings {numpy array} -- Validation ratings
         global_mean {float} -- Global mean of all ratings
-        user_biases {np.ndarray} -- User biases vector of length n_users
-        item_biases {np.ndarray} -- Item biases vector of length n_items
-        user_features {np.ndarray} -- User features matrix P of shape (n_users, n_factors)
-        item_features {np.ndarray} -- Item features matrix Q of shape (n_items, n_factors)
-        min_rating {int} -- Lowest rating possible
-        max_rating {int} -- Highest rating possible
-        kernel {str} -- Kernel function. Options are 'linear', 'sigmoid', and 'rbf'
-        gamma {float} -- Kernel coefficient for 'rbf' only
-        bound_ratings (bool): Whether to bound ratings in range [min_rating, max_rating] (default: True)
+        user_biases {numpy array} -- User biases vector of shape (n_users, 1)
+        item_biases {numpy array} -- Item biases vector of shape (n_items, 1)
+        user_features {numpy array} -- Start matrix P of user features of shape (n_users, n_factors)
+        item_features {numpy array} -- Start matrix Q of item features of shape (n_items, n_factors)
+        n_epochs {int} -- Number of epochs to run
+        reg {float} -- Regularization parameter lambda for Frobenius norm
+        verbose {int} -- Verbosity when fitting. 0 for nothing and 1 for printing epochs
+        calculate_rmse {Callable} -- RMSE loop of the linear kernel from kernel_loops
+        tol {float} -- Early stopping tolerance of stop_early, -inf to never stop
+        patience {int} -- Number of epochs without improvement to stop after
 
     Returns:
-        predictions [np.ndarray] -- Vector containing rating predictions of all user, items in same order as input X
-        predictions_possible [np.ndarray] -- Vector of whether both given user and item were contained in the data that the model was fitted on
+        user_features [np.ndarray] -- Updated user_features matrix P
+        item_features [np.ndarray] -- Updated item_features matrix Q
+        user_biases [np.ndarray] -- Updated user_biases vector
+        item_biases [np.ndarray] -- Updated item_bases vector
+        train_rmse [list] -- Training rmse values
+        val_rmse [list] -- Validation rmse values, empty without validation ratings
     """
-    n_factors = user_features.shape[1]
-    predictions = []
-    predictions_possible = []
-
-    for i in range(X.shape[0]):
-        user_id, item_id = int(X[i, 0]), int(X[i, 1])
-        user_known = user_id != -1
-        item_known = item_id != -1
-
-        # Default values if user or item are not known
-        user_bias = user_biases[user_id] if user_known else 0
-        item_bias = item_biases[item_id] if item_known else 0
-        user_feature_vec = (
-            user_features[user_id, :] if user_known else np.zeros(n_factors)
+    targets = ratings - global_mean
+    user_indptr, user_rows = _index_ratings(user_ids, user_biases.shape[0])
+    item_indptr, item_rows = _index_ratings(item_ids, item_biases.shape[0])
+    # The linear kernel ignores the rating range and gamma of calculate_rmse
+    min_rating, max_rating, gamma = 0.0, 0.0, 0.0
+    train_rmse = []
+    val_rmse = []
+    has_validation = val_ratings.shape[0] > 0
+
+    # For each epoch optimize User parameters, and then Item parameters
+    for epoch in range(n_epochs):
+        _als_solve(
+            user_indptr,
+            user_rows,
+            item_ids,
+            targets,
+            item_biases,
+            item_features,
+            user_biases,
+            user_features,
+            reg,
         )
-        item_feature_vec = (
-            item_features[item_id, :] if item_known else np.zeros(n_factors)
+        _als_solve(
+            item_indptr,
+            item_rows,
+            user_ids,
+            targets,
+            user_biases,
+            user_features,
+            item_biases,
+            item_features,
+            reg,
         )
 
-        # Calculate predicted rating given kernel
-        if kernel == "linear":
-            rating_pred = kernel_linear(
-                global_mean=global_mean,
-                user_bias=user_bias,
-                item_bias=item_bias,
-                user_feature_vec=user_feature_vec,
-                item_feature_vec=item_feature_vec,
-            )
-
-        elif kernel == "sigmoid":
-            rating_pred = kernel_sigmoid(
-                global_mean=global_mean,
-                user_bias=user_bias,
-                item_bias=item_bias,
-                user_feature_vec=user_feature_vec,
-                item_feature_vec=item_feature_vec,
-                a=min_rating,
-                c=max_rating - min_rating,
-            )
+        # Calculate error and print
+        rmse = calculate_rmse(
+            user_ids,
+            item_ids,
+            ratings,
+            global_mean,
+            user_biases,
+            item_biases,
+            user_features,
+            item_features,
+            min_rating,
+            max_rating,
+            gamma,
+        )
+        train_rmse.append(rmse)
 
-        elif kernel == "rbf":
-            rating_pred = kernel_rbf(
-                user_feature_vec=user_feature_vec,
-                item_feature_vec=item_feature_vec,
-                gamma=gamma,
-                a=min_rating,
-                c=max_rating - min_rating,
+        # Calculate validation error
+        if has_validation:
+            val_rmse.append(
+                calculate_rmse(
+                    val_user_ids,
+                    val_item_ids,
+                    val_ratings,
+                    global_mean,
+                    user_biases,
+                    item_biases,
+                    user_features,
+                    item_features,
+                    min_rating,
+                    max_rating,
+                    gamma,
+                )
             )
 
-        # Bound ratings to min and max rating range
-        if bound_ratings:
-            if rating_pred > max_rating:
-                rating_pred = max_rating
-            elif rating_pred < min_rating:
-                rating_pred = min_rating
+        if verbose == 1:
+            print_epoch(epoch, n_epochs, rmse, val_rmse)
 
-        predictions.append(rating_pred)
-        predictions_possible.append(user_known and item_known)
+        # Stop once the validation rmse, or the training rmse without validation, stops improving
+        if stop_early(val_rmse if has_validation else train_rmse, tol, patience):
+            break
 
-    return predictions, predictions_possible
+    return user_features, item_features, user_biases, item_biases, train_rmse, val_rmse
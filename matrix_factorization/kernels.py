@@ -18,6 +18,47 @@ def sigmoid(x: float) -> float:
     return result
 
 
+@nb.njit(fastmath={"reassoc", "contract"})
+def dot(x: np.ndarray, y: np.ndarray) -> float:
+    """
+    Calculates the dot product of two feature vectors. A plain loop that numba can vectorize, which is much faster than np.dot
+    for short vectors. The fastmath flags only allow reassociating the sum and contracting multiply-adds into fused ones, so
+    the result can differ from a sequential sum in the last bits but NaN, infinity and signed zero handling are kept. The
+    sum has the dtype of the features, so float32 features are summed with twice as many SIMD lanes.
+
+    Args:
+        x (np.ndarray): First vector
+        y (np.ndarray): Second vector
+
+    Returns:
+        [float]: Dot product of x and y
+    """
+    result = x.dtype.type(0)
+    for f in range(x.shape[0]):
+        result += x[f] * y[f]
+    return result
+
+
+@nb.njit(fastmath={"reassoc", "contract"})
+def squared_distance(x: np.ndarray, y: np.ndarray) -> float:
+    """
+    Calculates the squared euclidean distance between two feature vectors, without the temporary arrays of
+    np.sum(np.square(x - y)). Vectorized with the same fastmath flags as dot.
+
+    Args:
+        x (np.ndarray): First vector
+        y (np.ndarray): Second vector
+
+    Returns:
+        [float]: Squared distance between x and y
+    """
+    result = x.dtype.type(0)
+    for f in range(x.shape[0]):
+        difference = x[f] - y[f]
+        result += difference * difference
+    return result
+
+
 @nb.njit()
 def kernel_linear(
     global_mean: float,
@@ -40,7 +81,7 @@ def kernel_linear(
         [float]: Linear kernel result
     """
     result = (
-        global_mean + item_bias + user_bias + np.dot(user_feature_vec, item_feature_vec)
+        global_mean + item_bias + user_bias + dot(user_feature_vec, item_feature_vec)
     )
     return result
 
@@ -71,7 +112,7 @@ def kernel_sigmoid(
         [float]: Sigmoid kernel result
     """
     linear_sum = (
-        global_mean + user_bias + item_bias + np.dot(user_feature_vec, item_feature_vec)
+        global_mean + user_bias + item_bias + dot(user_feature_vec, item_feature_vec)
     )
     sigmoid_result = sigmoid(linear_sum)
     result = a + c * sigmoid_result
@@ -99,14 +140,14 @@ def kernel_rbf(
     Returns:
         [float]: RBF kernel result 
     """
-    power = -gamma * np.sum(np.square(user_feature_vec - item_feature_vec))
+    power = -gamma * squared_distance(user_feature_vec, item_feature_vec)
     exp_result = math.exp(power)
     result = a + c * exp_result
     return result
 
 
 @nb.njit()
-def kernel_linear_sgd_update(
+def kernel_linear_gradient(
     user_id: int,
     item_id: int,
     rating: float,
@@ -115,16 +156,13 @@ def kernel_linear_sgd_update(
     item_biases: np.ndarray,
     user_features: np.ndarray,
     item_features: np.ndarray,
-    lr: float,
     reg: float,
-    update_user_params: bool = True,
-    update_item_params: bool = True,
+    user_gradient: np.ndarray,
+    item_gradient: np.ndarray,
 ):
     """
-    Performs a single update using stochastic gradient descent for a linear kernel given a user and item. 
-    Similar to https://github.com/gbolmier/funk-svd and https://github.com/NicolasHug/Surprise we iterate over each factor manually for a given 
-    user/item instead of indexing by a row such as user_feature[user] since it has shown to be much faster. We have also tested with representing
-    user_features and item_features as 1D arrays but that also is much slower. Using parallel turned on in numba gives much worse performance as well.
+    Computes the gradients of the regularized squared error of a rating for a linear kernel, without updating the parameters.
+    The gradient of the user features and user bias is written to user_gradient, the same for the item to item_gradient.
 
     Args:
         user_id (int): User id 
@@ -135,10 +173,12 @@ def kernel_linear_sgd_update(
         item_biases {numpy array} -- Item biases vector of shape (n_items, 1)
         user_features {numpy array} -- Matrix P of user features of shape (n_users, n_factors)
         item_features {numpy array} -- Matrix Q of item features of shape (n_items, n_factors)
-        lr (float): Learning rate alpha
         reg {float} -- Regularization parameter lambda for Frobenius norm
-        update_user_params {bool} -- Whether to update user parameters or not. Default is True.
-        update_item_params {bool} -- Whether to update item parameters or not. Default is True.
+        user_gradient {numpy array} -- Output vector of length n_factors + 1, the user features gradient followed by the user bias gradient
+        item_gradient {numpy array} -- Output vector of length n_factors + 1, the item features gradient followed by the item bias gradient
+
+    Returns:
+        [float]: Error of the predicted rating
     """
     n_factors = user_features.shape[1]
     user_bias = user_biases[user_id]
@@ -149,39 +189,28 @@ def kernel_linear_sgd_update(
         global_mean
         + item_bias
         + user_bias
-        + np.dot(user_features[user_id, :], item_features[item_id, :])
+        + dot(user_features[user_id, :], item_features[item_id, :])
     )
 
     # Compute error
     error = rating_pred - rating
 
-    # Update bias parameters
-    if update_user_params:
-        user_biases[user_id] -= lr * (error + reg * user_bias)
-
-    if update_item_params:
-        item_biases[item_id] -= lr * (error + reg * item_bias)
+    # Bias gradients
+    user_gradient[n_factors] = error + reg * user_bias
+    item_gradient[n_factors] = error + reg * item_bias
 
-    # Update user and item features
+    # User and item feature gradients
     for f in range(n_factors):
         user_feature_f = user_features[user_id, f]
         item_feature_f = item_features[item_id, f]
+        user_gradient[f] = error * item_feature_f + reg * user_feature_f
+        item_gradient[f] = error * user_feature_f + reg * item_feature_f
 
-        if update_user_params:
-            user_features[user_id, f] -= lr * (
-                error * item_feature_f + reg * user_feature_f
-            )
-
-        if update_item_params:
-            item_features[item_id, f] -= lr * (
-                error * user_feature_f + reg * item_feature_f
-            )
-
-    return
+    return error
 
 
 @nb.njit()
-def kernel_sigmoid_sgd_update(
+def kernel_sigmoid_gradient(
     user_id: int,
     item_id: int,
     rating: float,
@@ -190,15 +219,15 @@ def kernel_sigmoid_sgd_update(
     item_biases: np.ndarray,
     user_features: np.ndarray,
     item_features: np.ndarray,
-    lr: float,
     reg: float,
     a: float,
     c: float,
-    update_user_params: bool = True,
-    update_item_params: bool = True,
+    user_gradient: np.ndarray,
+    item_gradient: np.ndarray,
 ):
     """
-    Performs a single update using stochastic gradient descent for a sigmoid kernel given a user and item. 
+    Computes the gradients of the regularized squared error of a rating for a sigmoid kernel, without updating the parameters.
+    The gradient of the user features and user bias is written to user_gradient, the same for the item to item_gradient.
 
     Args:
         user_id (int): User id 
@@ -209,12 +238,14 @@ def kernel_sigmoid_sgd_update(
         item_biases {numpy array} -- Item biases vector of shape (n_items, 1)
         user_features {numpy array} -- Matrix P of user features of shape (n_users, n_factors)
         item_features {numpy array} -- Matrix Q of item features of shape (n_items, n_factors)
-        lr (float): Learning rate alpha
         reg {float} -- Regularization parameter lambda for Frobenius norm
         a (float): Rescaling parameter for a + c * K(u, i)
         c (float): Rescaling parameter for a + c * K(u, i)
-        update_user_params {bool} -- Whether to update user parameters or not. Default is True.
-        update_item_params {bool} -- Whether to update item parameters or not. Default is True.
+        user_gradient {numpy array} -- Output vector of length n_factors + 1, the user features gradient followed by the user bias gradient
+        item_gradient {numpy array} -- Output vector of length n_factors + 1, the item features gradient followed by the item bias gradient
+
+    Returns:
+        [float]: Error of the predicted rating
     """
     n_factors = user_features.shape[1]
     user_bias = user_biases[user_id]
@@ -224,7 +255,7 @@ def kernel_sigmoid_sgd_update(
 
     # Compute predicted rating
     linear_sum = (
-        global_mean + user_bias + item_bias + np.dot(user_feature_vec, item_feature_vec)
+        global_mean + user_bias + item_bias + dot(user_feature_vec, item_feature_vec)
     )
     sigmoid_result = sigmoid(linear_sum)
     rating_pred = a + c * sigmoid_result
@@ -235,50 +266,42 @@ def kernel_sigmoid_sgd_update(
     # Common term shared between all partial derivatives
     deriv_base = (sigmoid_result ** 2) * math.exp(-linear_sum)
 
-    # Update bias parameters
-    if update_user_params:
-        opt_deriv = error * deriv_base + reg * user_bias
-        user_biases[user_id] -= lr * opt_deriv
+    # Bias gradients
+    user_gradient[n_factors] = error * deriv_base + reg * user_bias
+    item_gradient[n_factors] = error * deriv_base + reg * item_bias
 
-    if update_item_params:
-        opt_deriv = error * deriv_base + reg * item_bias
-        item_biases[item_id] -= lr * opt_deriv
-
-    # Update user and item features
+    # User and item feature gradients
     for i in range(n_factors):
         user_feature_f = user_features[user_id, i]
         item_feature_f = item_features[item_id, i]
 
-        if update_user_params:
-            user_feature_deriv = item_feature_f * deriv_base
-            opt_deriv = error * user_feature_deriv + reg * user_feature_f
-            user_features[user_id, i] -= lr * opt_deriv
+        user_feature_deriv = item_feature_f * deriv_base
+        user_gradient[i] = error * user_feature_deriv + reg * user_feature_f
 
-        if update_item_params:
-            item_feature_deriv = user_feature_f * deriv_base
-            opt_deriv = error * item_feature_deriv + reg * item_feature_f
-            item_features[item_id, i] -= lr * opt_deriv
+        item_feature_deriv = user_feature_f * deriv_base
+        item_gradient[i] = error * item_feature_deriv + reg * item_feature_f
 
-    return
+    return error
 
 
 @nb.njit()
-def kernel_rbf_sgd_update(
+def kernel_rbf_gradient(
     user_id: int,
     item_id: int,
     rating: float,
     user_features: np.ndarray,
     item_features: np.ndarray,
-    lr: float,
     reg: float,
     gamma: float,
     a: float,
     c: float,
-    update_user_params: bool = True,
-    update_item_params: bool = True,
+    user_gradient: np.ndarray,
+    item_gradient: np.ndarray,
 ):
     """
-    Performs a single update using stochastic gradient descent for a sigmoid kernel given a user and item. 
+    Computes the gradients of the regularized squared error of a rating for a rbf kernel, without updating the parameters.
+    The gradient of the user features is written to user_gradient, the same for the item to item_gradient. The rbf kernel
+    doesn't use the biases, so their gradients are 0.
 
     Args:
         user_id (int): User id 
@@ -286,20 +309,22 @@ def kernel_rbf_sgd_update(
         rating (float): Rating for user and item
         user_features {numpy array} -- Matrix P of user features of shape (n_users, n_factors)
         item_features {numpy array} -- Matrix Q of item features of shape (n_items, n_factors)
-        lr (float): Learning rate alpha
         reg {float} -- Regularization parameter lambda for Frobenius norm
         gamma (float): Kernel coefficient
         a (float): Rescaling parameter for a + c * K(u, i)
         c (float): Rescaling parameter for a + c * K(u, i)
-        update_user_params {bool} -- Whether to update user parameters or not. Default is True.
-        update_item_params {bool} -- Whether to update item parameters or not. Default is True.
+        user_gradient {numpy array} -- Output vector of length n_factors + 1, the user features gradient followed by the user bias gradient
+        item_gradient {numpy array} -- Output vector of length n_factors + 1, the item features gradient followed by the item bias gradient
+
+    Returns:
+        [float]: Error of the predicted rating
     """
     n_factors = user_features.shape[1]
     user_feature_vec = user_features[user_id, :]
     item_feature_vec = item_features[item_id, :]
 
     # Compute predicted rating
-    power = -gamma * np.sum(np.square(user_feature_vec - item_feature_vec))
+    power = -gamma * squared_distance(user_feature_vec, item_feature_vec)
     exp_result = math.exp(power)
     rating_pred = a + c * exp_result
 
@@ -309,19 +334,39 @@ def kernel_rbf_sgd_update(
     # Common term shared between partial derivatives
     deriv_base = 2 * exp_result * gamma
 
-    # Update user and item features params
+    user_gradient[n_factors] = 0.0
+    item_gradient[n_factors] = 0.0
+
+    # User and item feature gradients
     for i in range(n_factors):
         user_feature_f = user_features[user_id, i]
         item_feature_f = item_features[item_id, i]
 
-        if update_user_params:
-            user_feature_deriv = deriv_base * (item_feature_f - user_feature_f)
-            opt_deriv = error * user_feature_deriv + reg * user_feature_f
-            user_features[user_id, i] -= lr * opt_deriv
+        user_feature_deriv = deriv_base * (item_feature_f - user_feature_f)
+        user_gradient[i] = error * user_feature_deriv + reg * user_feature_f
+
+        item_feature_deriv = deriv_base * (user_feature_f - item_feature_f)
+        item_gradient[i] = error * item_feature_deriv + reg * item_feature_f
+
+    return error
 
-        if update_item_params:
-            item_feature_deriv = deriv_base * (user_feature_f - item_feature_f)
-            opt_deriv = error * item_feature_deriv + reg * item_feature_f
-            item_features[item_id, i] -= lr * opt_deriv
 
+@nb.njit()
+def apply_gradient(
+    id: int, biases: np.ndarray, features: np.ndarray, gradient: np.ndarray, lr: float
+):
+    """
+    Takes a gradient descent step of the bias and features of a user or item, with a gradient from one of the kernel gradient functions
+
+    Args:
+        id (int): User or item id
+        biases {numpy array} -- User or item biases vector
+        features {numpy array} -- Matrix P or Q of user or item features
+        gradient {numpy array} -- Vector of length n_factors + 1, the features gradient followed by the bias gradient
+        lr (float): Learning rate alpha
+    """
+    n_factors = features.shape[1]
+    biases[id] -= lr * gradient[n_factors]
+    for f in range(n_factors):
+        features[id, f] -= lr * gradient[f]
     return
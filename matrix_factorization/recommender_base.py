@@ -1,9 +1,13 @@
+import numba as nb
 import numpy as np
 import pandas as pd
+import types
 from sklearn.base import BaseEstimator, RegressorMixin
 
+from .id_index import IdIndex
+
 from abc import ABCMeta, abstractmethod
-from typing import Any, Tuple, Union
+from typing import Any, KeysView, Mapping, Tuple, Union
 
 
 class RecommenderBase(BaseEstimator, RegressorMixin, metaclass=ABCMeta):
@@ -20,10 +24,12 @@ class RecommenderBase(BaseEstimator, RegressorMixin, metaclass=ABCMeta):
         n_users {int} -- Number of users
         n_items {int} -- Number of items
         global_mean {float} -- Global mean of all ratings
-        user_id_map {dict} -- Mapping of user ids to assigned integer ids
-        item_id_map {dict} -- Mapping of item ids to assigned integer ids
-        known_users {set} -- Set of known user_ids
-        known_items {set} -- Set of known item_ids
+        user_index {IdIndex} -- Index of user ids to assigned integer ids
+        item_index {IdIndex} -- Index of item ids to assigned integer ids
+        user_id_map {MappingProxyType} -- Read-only mapping of user ids to assigned integer ids
+        item_id_map {MappingProxyType} -- Read-only mapping of item ids to assigned integer ids
+        known_users {KeysView} -- Set-like view of the known user_ids
+        known_items {KeysView} -- Set-like view of the known item_ids
     """
 
     @abstractmethod
@@ -34,18 +40,34 @@ class RecommenderBase(BaseEstimator, RegressorMixin, metaclass=ABCMeta):
         return
 
     @property
-    def known_users(self):
+    def user_id_map(self) -> Mapping:
+        """
+        Read-only mapping of user ids to assigned integer ids. It is a view of user_index, so it follows later updates
+        without a copy, and ids can only be added through user_index.
+        """
+        return types.MappingProxyType(self.user_index.codes)
+
+    @property
+    def item_id_map(self) -> Mapping:
         """
-        List of known user_ids
+        Read-only mapping of item ids to assigned integer ids. It is a view of item_index, so it follows later updates
+        without a copy, and ids can only be added through item_index.
         """
-        return set(self.user_id_map.keys())
+        return types.MappingProxyType(self.item_index.codes)
 
     @property
-    def known_items(self):
+    def known_users(self) -> KeysView:
         """
-        List of known item_ids
+        Set-like view of the known user_ids, with O(1) membership tests and no copy of the ids
         """
-        return set(self.item_id_map.keys())
+        return self.user_index.codes.keys()
+
+    @property
+    def known_items(self) -> KeysView:
+        """
+        Set-like view of the known item_ids, with O(1) membership tests and no copy of the ids
+        """
+        return self.item_index.codes.keys()
 
     def contains_user(self, user_id: Any) -> bool:
         """
@@ -57,7 +79,7 @@ class RecommenderBase(BaseEstimator, RegressorMixin, metaclass=ABCMeta):
         Returns:
             bool: If user_id is known
         """
-        return user_id in self.known_users
+        return user_id in self.user_index
 
     def contains_item(self, item_id: Any) -> bool:
         """
@@ -69,7 +91,7 @@ class RecommenderBase(BaseEstimator, RegressorMixin, metaclass=ABCMeta):
         Returns:
             bool: If item_id is known
         """
-        return item_id in self.known_items
+        return item_id in self.item_index
 
     def _preprocess_data(
         self, X: pd.DataFrame, y: pd.Series = None, type: str = "fit"
@@ -97,51 +119,110 @@ class RecommenderBase(BaseEstimator, RegressorMixin, metaclass=ABCMeta):
             if X.duplicated(subset=["user_id", "item_id"]).sum() != 0:
                 raise ValueError("Duplicate user-item ratings in matrix")
 
-            # Shuffle rows
-            X = X.sample(frac=1, replace=False)
-
         if type == "fit":
             # Create mapping of user_id and item_id to assigned integer ids
-            user_ids = X["user_id"].unique()
-            item_ids = X["item_id"].unique()
-            self.user_id_map = {user_id: i for (i, user_id) in enumerate(user_ids)}
-            self.item_id_map = {item_id: i for (i, item_id) in enumerate(item_ids)}
-            self.n_users = len(user_ids)
-            self.n_items = len(item_ids)
+            self.user_index = IdIndex(X["user_id"].unique())
+            self.item_index = IdIndex(X["item_id"].unique())
+            self.n_users = len(self.user_index)
+            self.n_items = len(self.item_index)
 
         elif type == "update":
             # Keep only item ratings for which the item is already known
-            items = self.item_id_map.keys()
-            X = X.query("item_id in @items").copy()
+            X = X[self.item_index.get_indexer(X["item_id"]) != -1].copy()
 
             # Add information on new users
-            new_users, known_users = [], []
             users = X["user_id"].unique()
-            new_user_id = max(self.user_id_map.values()) + 1
-
-            for user in users:
-                if user in self.user_id_map.keys():
-                    known_users.append(user)
-                    continue
+            is_known = self.user_index.get_indexer(users) != -1
+            known_users = users[is_known].tolist()
+            new_users = users[~is_known].tolist()
+            self.user_index.append(new_users)
 
-                # Add to user id mapping
-                new_users.append(user)
-                self.user_id_map[user] = new_user_id
-                new_user_id += 1
-
-        # Remap user id and item id to assigned integer ids
-        X.loc[:, "user_id"] = X["user_id"].map(self.user_id_map)
-        X.loc[:, "item_id"] = X["item_id"].map(self.item_id_map)
-
-        if type == "predict":
-            # Replace missing mappings with -1
-            X.fillna(-1, inplace=True)
+        # Remap user id and item id to assigned integer ids, -1 for unknown ids
+        X["user_id"] = self.user_index.get_indexer(X["user_id"])
+        X["item_id"] = self.item_index.get_indexer(X["item_id"])
 
         if type == "update":
             return X, known_users, new_users
         else:
             return X
 
+    @staticmethod
+    def _training_data(
+        X: pd.DataFrame,
+        validation_fraction: float = 0,
+        dtype: str = "float64",
+        sort_users: bool = False,
+    ) -> dict:
+        """
+        Separate typed arrays of the preprocessed ratings for the solvers, int32 user and item ids and ratings of the dtype of the
+        parameters, instead of a float64 matrix mixing ids and ratings. A random validation_fraction of the ratings is held out
+        in the validation arrays to measure the validation rmse for early stopping.
+
+        Arguments:
+            X {pd.DataFrame} -- Preprocessed dataframe with columns user_id, item_id and rating
+            validation_fraction {float} -- Fraction of the ratings to hold out (default: {0})
+            dtype {str} -- Floating point type of the ratings (default: {'float64'})
+            sort_users {bool} -- Whether to order the training ratings by user, for blocked shuffles (default: {False})
+
+        Returns:
+            data [dict] -- Arrays user_ids, item_ids, ratings, val_user_ids, val_item_ids and val_ratings. The validation arrays are empty if validation_fraction is 0
+        """
+        user_ids = X["user_id"].to_numpy(dtype=np.int32)
+        item_ids = X["item_id"].to_numpy(dtype=np.int32)
+        ratings = X["rating"].to_numpy(dtype=dtype)
+
+        is_validation = np.zeros(len(ratings), dtype=bool)
+        n_validation = int(round(len(ratings) * validation_fraction))
+        if n_validation > 0:
+            is_validation[
+                np.random.choice(len(ratings), n_validation, replace=False)
+            ] = True
+        train = np.flatnonzero(~is_validation)
+        validation = np.flatnonzero(is_validation)
+
+        if sort_users:
+            train = train[np.argsort(user_ids[train], kind="stable")]
+
+        return {
+            "user_ids": user_ids[train],
+            "item_ids": item_ids[train],
+            "ratings": ratings[train],
+            "val_user_ids": user_ids[validation],
+            "val_item_ids": item_ids[validation],
+            "val_ratings": ratings[validation],
+        }
+
+    def _append_rows(self, name: str, rows: np.ndarray):
+        """
+        Append rows to the parameter array attribute name, e.g. the user biases or features of new users. The attribute is a view of
+        the first rows of a larger buffer whose capacity doubles when it runs out, so adding users costs O(new users) amortized
+        instead of copying the whole parameter table on every update. The view stays contiguous for the numba solvers.
+
+        Arguments:
+            name {str} -- Name of the parameter array attribute
+            rows {np.ndarray} -- Rows to append, cast to the dtype of the parameters
+        """
+        params = getattr(self, name)
+        buffer = getattr(self, "_" + name + "_buffer", None)
+        n_rows = params.shape[0]
+        size = n_rows + len(rows)
+
+        # Reallocate if the buffer is full or no longer backs the params, as after fit
+        if (
+            buffer is None
+            or buffer.shape[0] < size
+            or buffer.dtype != params.dtype
+            or buffer.shape[1:] != params.shape[1:]
+            or buffer.ctypes.data != params.ctypes.data
+        ):
+            capacity = max(size, 2 * n_rows)
+            buffer = np.empty((capacity,) + params.shape[1:], dtype=params.dtype)
+            buffer[:n_rows] = params
+            setattr(self, "_" + name + "_buffer", buffer)
+
+        buffer[n_rows:size] = rows
+        setattr(self, name, buffer[:size])
+
     @abstractmethod
     def fit(self, X: pd.DataFrame, y: pd.Series):
         """
@@ -167,6 +248,83 @@ class RecommenderBase(BaseEstimator, RegressorMixin, metaclass=ABCMeta):
         """
         return []
 
+    def _predict_users_items(
+        self, users: list, items: np.ndarray = None
+    ) -> Union[np.ndarray, None]:
+        """
+        Predict the unbounded ratings of all items for each of the given users at once. Models that can score the whole catalog
+        with matrix products override this to let recommend and recommend_batch skip the per-row predict path.
+
+        Args:
+            users (list): User_ids to predict ratings for (not assigned user_ids from self.user_id_map)
+            items (np.ndarray, optional): Assigned item ids to predict ratings for instead of all items. Defaults to None.
+
+        Returns:
+            np.ndarray or None: Rating predictions of shape (len(users), n_items) with the items ordered by their assigned item
+                ids, None if not supported
+        """
+        return None
+
+    def _predict_all_items(self, user: Any) -> Union[np.ndarray, None]:
+        """
+        Predict the unbounded ratings of all items for a given user at once.
+
+        Args:
+            user (any): User_id to predict ratings for (not assigned user_id from self.user_id_map)
+
+        Returns:
+            np.ndarray or None: Rating predictions of all items ordered by their assigned item ids, None if not supported
+        """
+        item_ratings = self._predict_users_items([user])
+        return None if item_ratings is None else item_ratings[0]
+
+    def _top_items(
+        self, user: Any, item_ratings: np.ndarray, amount: int, items_known: list = None
+    ) -> pd.DataFrame:
+        """
+        Select the top rated items for a given user from the predicted ratings of all items, with a partial sort.
+
+        Args:
+            user (any): User_id the ratings were predicted for
+            item_ratings (np.ndarray): Rating predictions of all items ordered by their assigned item ids
+            amount (int): Number of items to keep
+            items_known (list, optional): List of items already known by user and to not be considered. Defaults to None.
+
+        Returns:
+            pd.DataFrame: DataFrame with columns user_id, item_id, rating_pred sorted from highest to lowest rating, indexed by
+                the position of each item among the items considered (as in the per-row recommend path)
+        """
+        candidates = np.delete(np.arange(len(item_ratings)), self._known_item_indexes(items_known))
+
+        candidate_ratings = item_ratings[candidates]
+        amount = max(min(amount, len(candidates)), 0)
+        top = np.argpartition(-candidate_ratings, amount - 1)[:amount] if amount > 0 else np.empty(0, dtype=int)
+        top = top[np.argsort(-candidate_ratings[top], kind="stable")]
+
+        return pd.DataFrame(
+            {
+                "user_id": user,
+                "item_id": self._item_ids()[candidates[top]],
+                "rating_pred": candidate_ratings[top],
+            },
+            index=top,
+        )
+
+    def _item_ids(self) -> np.ndarray:
+        """
+        Array of the item_ids ordered by their assigned item ids
+        """
+        return self.item_index.to_numpy()
+
+    def _known_item_indexes(self, items_known: list = None) -> np.ndarray:
+        """
+        Sorted assigned item ids of the given known items, ignoring items the model doesn't know
+        """
+        if items_known is None:
+            return np.empty(0, dtype=np.int64)
+        item_indexes = self.item_index.get_indexer(list(items_known))
+        return np.unique(item_indexes[item_indexes != -1])
+
     def recommend(
         self,
         user: Any,
@@ -187,23 +345,35 @@ class RecommenderBase(BaseEstimator, RegressorMixin, metaclass=ABCMeta):
         Returns:
             pd.DataFrame: Recommendations DataFrame for user with columns user_id (optional), item_id, rating sorted from highest to lowest rating 
         """
-        items = list(self.item_id_map.keys())
+        item_ratings = self._predict_all_items(user)
+        if item_ratings is not None:
+            items_recommend = self._top_items(user, item_ratings, amount, items_known)
+        else:
+            items = list(self.item_index)
 
-        # If items_known is provided then filter by items that the user does not know
-        if items_known is not None:
-            items_known = list(items_known)
-            items = [item for item in items if item not in items_known]
+            # If items_known is provided then filter by items that the user does not know
+            if items_known is not None:
+                items_known = list(items_known)
+                items = [item for item in items if item not in items_known]
 
-        # Get rating predictions for given user and all unknown items
-        items_recommend = pd.DataFrame({"user_id": user, "item_id": items})
-        items_recommend["rating_pred"] = self.predict(
-            X=items_recommend, bound_ratings=False
-        )
+            # Get rating predictions for given user and all unknown items
+            items_recommend = pd.DataFrame({"user_id": user, "item_id": items})
+            items_recommend["rating_pred"] = self.predict(
+                X=items_recommend, bound_ratings=False
+            )
 
-        # Sort and keep top n items
-        items_recommend.sort_values(by="rating_pred", ascending=False, inplace=True)
-        items_recommend = items_recommend.head(amount)
+            # Sort and keep top n items
+            items_recommend.sort_values(by="rating_pred", ascending=False, inplace=True)
+            items_recommend = items_recommend.head(amount)
 
+        return self._format_recommendations(items_recommend, include_user, bound_ratings)
+
+    def _format_recommendations(
+        self, items_recommend: pd.DataFrame, include_user: bool, bound_ratings: bool
+    ) -> pd.DataFrame:
+        """
+        Bound the ratings of the selected recommendations and drop the user_id column if not included, as recommend returns them
+        """
         # Bound ratings
         if bound_ratings:
             items_recommend["rating_pred"] = items_recommend["rating_pred"].clip(
@@ -215,3 +385,126 @@ class RecommenderBase(BaseEstimator, RegressorMixin, metaclass=ABCMeta):
 
         return items_recommend
 
+    def recommend_batch(
+        self,
+        users: list,
+        amount: int = 10,
+        items_known: dict = None,
+        bound_ratings: bool = True,
+        memory_budget: int = 2 ** 28,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the recommendations of items for each of the given users, sorted from highest to lowest rating. The users are
+        scored in blocks against all items with matrix products, with the blocks sized to keep the rating predictions within
+        memory_budget bytes.
+
+        Args:
+            users (list): User_ids to get recommendations for (not assigned user_ids from self.user_id_map)
+            amount (int): Number of items to recommend to each user. Defaults to 10.
+            items_known (dict, optional): Mapping of user_id to a list of items already known by the user and to not be
+                considered in the user's recommendations. Defaults to None.
+            bound_ratings (bool): Whether to bound ratings in range [min_rating, max_rating] (default: True)
+            memory_budget (int): Approximate number of bytes to use for the rating predictions of a block of users (default: 256MB)
+
+        Returns:
+            item_ids [np.ndarray] -- Array of shape (len(users), amount) of the recommended item_ids of each user. Users with less
+                than amount items to recommend are padded with None
+            ratings [np.ndarray] -- Array of shape (len(users), amount) of the rating predictions, padded with NaN
+        """
+        users = list(users)
+        items_known = {} if items_known is None else items_known
+        item_ids = self._item_ids()
+        amount = max(min(amount, len(item_ids)), 0)
+        recommended_items = np.full((len(users), amount), None, dtype=object)
+        recommended_ratings = np.full((len(users), amount), np.nan)
+        if amount == 0 or len(users) == 0:
+            return recommended_items, recommended_ratings
+
+        # The predictions, the partition indices and the sorting temporaries take about three arrays of a block
+        block_size = max(1, memory_budget // (3 * 8 * len(item_ids)))
+        for start in range(0, len(users), block_size):
+            block_users = users[start : start + block_size]
+            item_ratings = self._predict_users_items(block_users)
+            if item_ratings is None:
+                item_ratings = np.array(
+                    [
+                        self.predict(
+                            pd.DataFrame({"user_id": user, "item_id": item_ids}),
+                            bound_ratings=False,
+                        )
+                        for user in block_users
+                    ]
+                )
+
+            # Mask the items known by each user
+            for row, user in enumerate(block_users):
+                item_ratings[row, self._known_item_indexes(items_known.get(user))] = -np.inf
+
+            # Partial sort of each row for the top amount items, then sort them
+            top = np.argpartition(-item_ratings, amount - 1, axis=1)[:, :amount]
+            top_ratings = np.take_along_axis(item_ratings, top, axis=1)
+            order = np.argsort(-top_ratings, axis=1, kind="stable")
+            top, top_ratings = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_ratings, order, axis=1)
+
+            is_item = top_ratings != -np.inf
+            block_items = np.where(is_item, item_ids[top], None)
+            block_ratings = np.where(is_item, top_ratings, np.nan)
+            if bound_ratings:
+                block_ratings = np.clip(block_ratings, self.min_rating, self.max_rating)
+            recommended_items[start : start + len(block_users)] = block_items
+            recommended_ratings[start : start + len(block_users)] = block_ratings
+
+        return recommended_items, recommended_ratings
+
+
+@nb.njit()
+def stop_early(losses: list, tol: float, patience: int) -> bool:
+    """
+    Whether training should stop because none of the last patience epoch losses improved by more than tol on the best loss
+    before them
+
+    Arguments:
+        losses {list} -- Loss of each epoch so far
+        tol {float} -- Smallest decrease of the loss that counts as an improvement. -inf never stops, which the models pass when their tol is None
+        patience {int} -- Number of epochs without improvement to stop after
+
+    Returns:
+        stop [bool] -- Whether to stop training
+    """
+    n_losses = len(losses)
+    if n_losses <= patience:
+        return False
+
+    best_loss = losses[0]
+    for epoch in range(1, n_losses - patience):
+        best_loss = min(best_loss, losses[epoch])
+    for epoch in range(n_losses - patience, n_losses):
+        if losses[epoch] < best_loss - tol:
+            return False
+    return True
+
+
+@nb.njit()
+def print_epoch(epoch: int, n_epochs: int, train_rmse: float, val_rmse: list):
+    """
+    Prints the training rmse of an epoch, followed by its validation rmse when there are validation ratings
+
+    Arguments:
+        epoch {int} -- Index of the epoch, starting at 0
+        n_epochs {int} -- Number of epochs to train for
+        train_rmse {float} -- Training rmse of the epoch
+        val_rmse {list} -- Validation rmse of each epoch so far, empty without validation
+    """
+    if len(val_rmse) > 0:
+        print(
+            "Epoch ",
+            epoch + 1,
+            "/",
+            n_epochs,
+            " -  train_rmse:",
+            train_rmse,
+            " -  val_rmse:",
+            val_rmse[-1],
+        )
+    else:
+        print("Epoch ", epoch + 1, "/", n_epochs, " -  train_rmse:", train_rmse)
@@ -0,0 +1,287 @@
+import pandas as pd
+import numpy as np
+
+# adjusted rating used instead of 0, to avoid a 0 similarity denominator
+ZERO_ADJUSTED_RATING = 1e-8
+
+
+def grow(values, size, fill):
+	"""
+	make room for size values in a buffer, doubling its capacity when it is full.
+	:param values: the buffer
+	:param size: number of values the buffer needs room for
+	:param fill: value of the added entries
+	:return: the buffer, or a new buffer with the same first values if it was too small
+	"""
+	if size <= len(values):
+		return values
+	resized_values = np.full(max(size, 2 * len(values)), fill, dtype=values.dtype)
+	resized_values[:len(values)] = values
+	return resized_values
+
+
+def intern_ids(ids, vocabulary, index):
+	"""
+	give each of the given ids that isn't in the index the next free code, and get the codes of all of them, in
+	O(number of given ids) whatever the number of known ids.
+	:param ids: array of ids
+	:param vocabulary: buffer of the ids by their codes, of which the first len(index) are used
+	:param index: dict of id to code, updated in place
+	:return: the vocabulary buffer, and array of the codes of the given ids
+	"""
+	inverse, unique_ids = pd.factorize(ids)
+	n_ids = len(index)
+	new_ids = sorted(value for value in unique_ids if value not in index)
+	for value in new_ids:
+		index[value] = len(index)
+	vocabulary = grow(vocabulary, len(index), None)
+	vocabulary[n_ids:len(index)] = new_ids
+	unique_codes = np.fromiter((index[value] for value in unique_ids), dtype=np.int32, count=len(unique_ids))
+	return vocabulary, unique_codes[inverse]
+
+
+def add_to_index(index, keys, members, rows):
+	"""
+	add the given ratings to a ratings index, e.g. of each user's items, for the members their keys don't have yet.
+	:param index: list by key of (sorted members, rows of the first ratings), updated in place
+	:param keys: keys of the ratings, e.g. users codes (all smaller than len(index))
+	:param members: members of the ratings, e.g. items indexes
+	:param rows: rows of the ratings
+	"""
+	order = np.lexsort((rows, members, keys))
+	keys, members, rows = keys[order], members[order], rows[order]
+	first = np.ones(len(rows), dtype=bool)
+	first[1:] = (keys[1:] != keys[:-1]) | (members[1:] != members[:-1])
+	keys, members, rows = keys[first], members[first], rows[first]
+
+	unique_keys, starts = np.unique(keys, return_index=True)
+	for key, start, end in zip(unique_keys, starts, np.append(starts[1:], len(keys))):
+		key_members, key_rows = members[start:end], rows[start:end]
+		previous_members, previous_rows = index[key]
+		if len(previous_members) > 0:
+			is_new = ~np.isin(key_members, previous_members)
+			key_members = np.concatenate([previous_members, key_members[is_new]])
+			key_rows = np.concatenate([previous_rows, key_rows[is_new]])
+			order = np.argsort(key_members)
+			key_members, key_rows = key_members[order], key_rows[order]
+		index[key] = (key_members, key_rows)
+
+
+class RatingsData:
+	"""
+	keeps all the ratings in columns that new ratings are appended to, with the running sum and count of each item's
+	ratings for its mean rating. users and items are interned into dense integer codes, with the userIds and itemIds
+	kept as vocabularies by code. the columns, the vocabularies and the per item arrays are buffers that grow
+	geometrically, so adding ratings costs O(number of added ratings) amortized. the adjusted ratings (rating - item's mean rating) are recalculated lazily, only for
+	the items whose mean rating changed.
+	"""
+	def __init__(self, ratings):
+		"""
+		:param ratings: DataFrame with the columns userId, itemId and rating
+		"""
+		self.size = 0
+		self.user_codes = np.empty(0, dtype=np.int32)
+		self.item_codes = np.empty(0, dtype=np.int32)
+		self.ratings = np.empty(0, dtype=np.int8)
+		self.adjusted_ratings = np.empty(0, dtype=np.float64)
+
+		self._user_ids = np.empty(0, dtype=object)
+		self.user_index = dict()
+		# the first rating of each item by each user, by user code: (sorted indexes of the items, rows of the ratings)
+		self.user_ratings = []
+		# the same ratings by item index: (sorted codes of the users, rows of the ratings)
+		self.item_ratings = []
+
+		self._item_ids = np.empty(0, dtype=object)
+		self.item_index = dict()
+		self._item_rating_sums = np.empty(0, dtype=np.float64)
+		self._item_rating_counts = np.empty(0, dtype=np.int64)
+		self._item_means = np.empty(0, dtype=np.float64)
+
+		# the adjusted ratings of rows from adjusted_size on, and of the stale items, need to be recalculated
+		self.adjusted_size = 0
+		self._stale_items = np.empty(0, dtype=bool)
+
+		self.append(ratings['userId'].to_numpy(), ratings['itemId'].to_numpy(), ratings['rating'].to_numpy())
+
+	@property
+	def n_users(self):
+		return len(self.user_index)
+
+	@property
+	def n_items(self):
+		return len(self.item_index)
+
+	@property
+	def user_ids(self):
+		"""
+		userIds by their codes
+		"""
+		return self._user_ids[:self.n_users]
+
+	@property
+	def item_ids(self):
+		"""
+		itemIds by their indexes
+		"""
+		return self._item_ids[:self.n_items]
+
+	@property
+	def item_rating_sums(self):
+		return self._item_rating_sums[:self.n_items]
+
+	@property
+	def item_rating_counts(self):
+		return self._item_rating_counts[:self.n_items]
+
+	@property
+	def item_means(self):
+		"""
+		mean rating of each item by its index, nan for items without ratings
+		"""
+		return self._item_means[:self.n_items]
+
+	@property
+	def stale_items(self):
+		"""
+		whether the mean rating of each item changed since its adjusted ratings were calculated
+		"""
+		return self._stale_items[:self.n_items]
+
+	def index_items(self, item_ids):
+		"""
+		give each of the given items that isn't indexed yet the next free index.
+		:param item_ids: itemIds to index
+		:return: array of the indexes of the given items
+		"""
+		self._item_ids, item_codes = intern_ids(item_ids, self._item_ids, self.item_index)
+		self._item_rating_sums = grow(self._item_rating_sums, self.n_items, 0)
+		self._item_rating_counts = grow(self._item_rating_counts, self.n_items, 0)
+		self._item_means = grow(self._item_means, self.n_items, np.nan)
+		self._stale_items = grow(self._stale_items, self.n_items, False)
+		return item_codes
+
+	def index_ratings(self, user_codes, item_codes, rows):
+		"""
+		add the given ratings to the users and the items ratings indexes, for the items their users didn't rate before.
+		:param user_codes: users codes of the ratings
+		:param item_codes: items indexes of the ratings
+		:param rows: rows of the ratings
+		"""
+		self.user_ratings.extend((np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64))
+								 for _ in range(self.n_users - len(self.user_ratings)))
+		self.item_ratings.extend((np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64))
+								 for _ in range(self.n_items - len(self.item_ratings)))
+		add_to_index(self.user_ratings, user_codes, item_codes, rows)
+		add_to_index(self.item_ratings, item_codes, user_codes, rows)
+
+	def _reserve(self, size):
+		"""
+		make room for size ratings, doubling the columns capacity when they are full.
+		"""
+		for column in ('user_codes', 'item_codes', 'ratings', 'adjusted_ratings'):
+			setattr(self, column, grow(getattr(self, column), size, 0))
+
+	def append(self, user_ids, item_ids, ratings):
+		"""
+		add the given ratings, and update the mean ratings of their items in O(number of ratings).
+		:param user_ids: userIds of the ratings
+		:param item_ids: itemIds of the ratings
+		:param ratings: the ratings values, integers in the int8 range
+		:return: indexes of the items whose mean rating changed
+		"""
+		ratings = np.asarray(ratings)
+		# ratings are stored as int8, which would silently truncate fractions and wrap large values
+		limits = np.iinfo(np.int8)
+		if not np.all((ratings == np.round(ratings)) & (ratings >= limits.min) & (ratings <= limits.max)):
+			raise ValueError('ratings must be integers between %d and %d' % (limits.min, limits.max))
+		ratings = ratings.astype(np.int8)
+		self._user_ids, user_codes = intern_ids(np.asarray(user_ids, dtype=object), self._user_ids, self.user_index)
+		item_codes = self.index_items(np.asarray(item_ids, dtype=object))
+
+		end = self.size + len(ratings)
+		self._reserve(end)
+		self.user_codes[self.size:end] = user_codes
+		self.item_codes[self.size:end] = item_codes
+		self.ratings[self.size:end] = ratings
+		self.index_ratings(user_codes, item_codes, np.arange(self.size, end))
+		self.size = end
+
+		# update the mean ratings of the rated items from their running sums and counts
+		np.add.at(self.item_rating_sums, item_codes, ratings)
+		np.add.at(self.item_rating_counts, item_codes, 1)
+		rated_items = np.unique(item_codes)
+		means = self.item_rating_sums[rated_items] / self.item_rating_counts[rated_items]
+		changed_items = rated_items[means != self.item_means[rated_items]]
+		self.item_means[changed_items] = self.item_rating_sums[changed_items] / self.item_rating_counts[changed_items]
+		self.stale_items[changed_items] = True
+		return changed_items
+
+	def get_adjusted_ratings(self):
+		"""
+		:return: the adjusted ratings of all the ratings, by the ratings order
+		"""
+		stale_rows = np.flatnonzero(self.stale_items[self.item_codes[:self.adjusted_size]])
+		rows = np.concatenate([stale_rows, np.arange(self.adjusted_size, self.size)])
+		if len(rows) > 0:
+			adjusted_ratings = self.ratings[rows] - self.item_means[self.item_codes[rows]]
+			# replace 0 adjusted rating values to 1*e-8 in order to avoid 0 denominator
+			adjusted_ratings[adjusted_ratings == 0] = ZERO_ADJUSTED_RATING
+			self.adjusted_ratings[rows] = adjusted_ratings
+			self.stale_items[:] = False
+			self.adjusted_size = self.size
+		return self.adjusted_ratings[:self.size]
+
+	def to_frame(self):
+		"""
+		:return: DataFrame of all the ratings, with the columns userId, itemId, rating, rating_mean and rating_adjusted
+		"""
+		item_codes = self.item_codes[:self.size]
+		return pd.DataFrame({'userId': self.user_ids[self.user_codes[:self.size]], 'itemId': self.item_ids[item_codes],
+							 'rating': self.ratings[:self.size], 'rating_mean': self.item_means[item_codes],
+							 'rating_adjusted': self.get_adjusted_ratings()})
+
+	def _user_ratings(self, user_code):
+		"""
+		:return: the users ratings index entry of the given user code, empty if the user has no ratings (None)
+		"""
+		if user_code is None:
+			return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+		return self.user_ratings[user_code]
+
+	def get_user_ratings(self, user_code, exclude_from=None):
+		"""
+		get the given user's first rating of each item the user rated, in O(number of the user's items).
+		:param user_code: code of the user, None for a user without ratings
+		:param exclude_from: if given, ignore the ratings from this position on
+		:return: array of the rated items indexes, and array of their ratings
+		"""
+		items, rows = self._user_ratings(user_code)
+		if exclude_from is not None:
+			before = rows < exclude_from
+			items, rows = items[before], rows[before]
+		return items, self.ratings[rows]
+
+	def get_item_ratings(self, item):
+		"""
+		get the first rating of the given item by each user who rated it, in O(number of the item's users).
+		:param item: index of the item
+		:return: array of the codes of the users who rated the item, and array of their ratings
+		"""
+		users, rows = self.item_ratings[item]
+		return users, self.ratings[rows]
+
+	def get_users_adjusted_ratings(self, user_codes):
+		"""
+		get the adjusted first rating of each item rated by the given users, in O(number of these users' items).
+		:param user_codes: array of users codes
+		:return: array of the position in user_codes of the user of each rating, array of the rated items indexes,
+			and array of the adjusted ratings
+		"""
+		entries = [self.user_ratings[user_code] for user_code in user_codes]
+		items = np.concatenate([np.empty(0, dtype=np.int32)] + [items for items, _ in entries])
+		rows = np.concatenate([np.empty(0, dtype=np.int64)] + [rows for _, rows in entries])
+		positions = np.repeat(np.arange(len(entries)), [len(items) for items, _ in entries])
+		adjusted_ratings = self.ratings[rows] - self.item_means[items]
+		adjusted_ratings[adjusted_ratings == 0] = ZERO_ADJUSTED_RATING
+		return positions, items, adjusted_ratings
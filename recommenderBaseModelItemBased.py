@@ -1,101 +1,184 @@
 import pandas as pd
 import numpy as np
 import math
-import pickle
+from ratingsData import RatingsData
+from itemSimilarity import build_ratings_matrix, adjusted_cosine_similarities, item_similarities, SimilarityMatrix, \
+	NeighborSimilarityMatrix
+from similarityMatrixFile import ratings_file_hash, write_similarity_file, read_similarity_header, \
+	map_similarity_arrays
 
 ITEMS_NUM = 60
-SIMILARITY_MATRIX_PATH = 'w_matrix.pkl'
+SIMILARITY_MATRIX_PATH = 'w_matrix.sim'
 
 
 class RecommenderBaseModel:
 	"""
 	Implements the ML model for the recommender
 	"""
-	def __init__(self, data_filename, load_existing_sim_matrix):
-		self.ratings = pd.read_csv(data_filename, encoding='"ISO-8859-1"')
-		self.process_ratings_data()
+	def __init__(self, data_filename, load_existing_sim_matrix, similarity_dtype=np.float64,
+				 symmetric_similarities=False, incremental_similarities=True, num_of_neighbors=None,
+				 min_common_users=1, n_jobs=1):
+		"""
+		:param data_filename: csv file of the ratings, with the columns userId, itemId and rating
+		:param load_existing_sim_matrix: if True, load the existing similarity matrix file, if it was built from the
+			same ratings file with the same settings (otherwise it's calculated again). if False, calculates it.
+		:param similarity_dtype: dtype of the stored similarity weights, np.float32 halves their memory
+		:param symmetric_similarities: if True, only one half of the (symmetric) similarity matrix is stored
+		:param incremental_similarities: if True, update the similarities of the items affected by new ratings,
+			recalculated from the ratings of the users who rated these items only
+		:param num_of_neighbors: if given, keep only the similarities of each item with its num_of_neighbors most
+			similar items (by absolute similarity), and predict each item only from these neighbors
+		:param min_common_users: minimal number of users who rated both items to keep their similarity
+		:param n_jobs: number of processes that build the similarity matrix, by items ranges
+		"""
+		self.similarity_dtype = similarity_dtype
+		self.symmetric_similarities = symmetric_similarities
+		self.incremental_similarities = incremental_similarities
+		self.num_of_neighbors = num_of_neighbors
+		self.min_common_users = min_common_users
+		self.n_jobs = n_jobs
+		self.similarity_matrix = None
+		# the current user's weighted deviations, sums of absolute weights and numbers of weights of all items
+		self.user_scores = None
+
+		self.ratings_data = RatingsData(pd.read_csv(data_filename, encoding='"ISO-8859-1"'))
+		# identifies the ratings the similarities are built from, None once there are ratings that aren't in the file
+		self.ratings_hash = ratings_file_hash(data_filename)
+		self.item_numbers = np.empty(0, dtype=np.int64)
+		self.index_item_numbers()
 		self.init_similarity_matrix(load_existing_sim_matrix)
 
 		self.items = list(range(1, ITEMS_NUM+1))
 		self.users = dict()
 		self.cur_user = ""
 
-	def process_ratings_data(self):
+	@property
+	def item_ids(self):
+		"""
+		itemIds by their indexes
+		"""
+		return self.ratings_data.item_ids
+
+	@property
+	def item_index(self):
+		"""
+		mapping of itemIds to their indexes
+		"""
+		return self.ratings_data.item_index
+
+	@property
+	def item_means(self):
 		"""
-		process all the current ratings data to recommend to the user
+		mean rating of each item by its index
 		"""
-		self.rating_mean = self.ratings.groupby(['itemId'], as_index = False, sort = False).mean().rename(columns = {'rating': 'rating_mean'})[['itemId','rating_mean']]
-		self.adjusted_ratings = pd.merge(self.ratings,self.rating_mean,on = 'itemId', how = 'left', sort = False)
-		self.adjusted_ratings['rating_adjusted'] = self.adjusted_ratings['rating']-self.adjusted_ratings['rating_mean']
-		# replace 0 adjusted rating values to 1*e-8 in order to avoid 0 denominator
-		self.adjusted_ratings.loc[self.adjusted_ratings['rating_adjusted'] == 0, 'rating_adjusted'] = 1e-8
+		return self.ratings_data.item_means
+
+	@property
+	def cur_user_code(self):
+		"""
+		code of the current user in the ratings data, None if the user has no ratings
+		"""
+		return self.ratings_data.user_index.get(self.cur_user)
+
+	@property
+	def adjusted_ratings(self):
+		"""
+		DataFrame of all the ratings with their adjusted ratings
+		"""
+		return self.ratings_data.to_frame()
 
 	def init_similarity_matrix(self, load_existing_sim_matrix):
 		"""
 		initialize and save in the model the matrix of the similarities between each two items.
-		:param load_existing_sim_matrix: if True, load an existing matrix. if False, calculates it.
-		"""
-		# define weight matrix
-		self.similarity_matrix = pd.DataFrame(columns=['item_1', 'item_2', 'weight'])
-		# load weight matrix from pickle file
-		if load_existing_sim_matrix:
-			with open(SIMILARITY_MATRIX_PATH, 'rb') as input:
-				self.similarity_matrix = pickle.load(input)
-			input.close()
-		# calculate the similarity values
-		else:
+		:param load_existing_sim_matrix: if True, load the existing matrix if it's up to date. if False, calculates it.
+		"""
+		if not (load_existing_sim_matrix and self.load_similarity_matrix()):
+			# calculate the similarity values
 			self.build_similarity_matrix()
 
+	def similarity_file_fields(self):
+		"""
+		:return: the header fields of the similarity matrix file, which identify the ratings and the model settings
+		"""
+		fields = {'ratings_hash': self.ratings_hash, 'item_ids': [str(item) for item in self.item_ids],
+				  'dtype': np.dtype(self.similarity_dtype).str, 'min_common_users': int(self.min_common_users)}
+		if self.num_of_neighbors is not None:
+			fields['num_of_neighbors'] = int(self.num_of_neighbors)
+		else:
+			fields['symmetric'] = bool(self.symmetric_similarities)
+		return fields
+
+	def load_similarity_matrix(self):
+		"""
+		map the weight matrix file to memory, if it was built from the current ratings with the model's settings.
+		:return: True if the matrix was loaded, False if the file is missing or stale
+		"""
+		header = read_similarity_header(SIMILARITY_MATRIX_PATH)
+		fields = self.similarity_file_fields()
+		if header is None or fields['ratings_hash'] is None or \
+				any(header.get(field) != value for field, value in fields.items()):
+			return False
+		arrays = map_similarity_arrays(SIMILARITY_MATRIX_PATH, header)
+		if self.num_of_neighbors is not None:
+			self.similarity_matrix = NeighborSimilarityMatrix.from_arrays(len(self.item_ids), arrays,
+																		  self.num_of_neighbors)
+		else:
+			self.similarity_matrix = SimilarityMatrix.from_arrays(len(self.item_ids), arrays,
+																  self.symmetric_similarities)
+		self.user_scores = None
+		return True
+
 	def build_similarity_matrix(self):
 		"""
 		if the similarity matrix wasn't loaded, builds it based on the current ratings.
 		"""
-		distinct_items = np.unique(self.adjusted_ratings['itemId'])
-		i = 0
-		# for each item_1 in all items
-		for item_1 in distinct_items:
-			# extract all users who rated item_1
-			user_data = self.adjusted_ratings[self.adjusted_ratings['itemId'] == item_1]
-			distinct_users = np.unique(user_data['userId'])
-
-			# record the ratings for users who rated both item_1 and item_2
-			record_row_columns = ['userId', 'item_1', 'item_2', 'rating_adjusted_1', 'rating_adjusted_2']
-			record_item_1_2 = pd.DataFrame(columns=record_row_columns)
-			# for each customer C who rated item_1
-			for c_userid in distinct_users:
-				# the customer's rating for item_1
-				c_item_1_rating = user_data[user_data['userId'] == c_userid]['rating_adjusted'].iloc[0]
-				# extract items rated by the customer excluding item_1
-				c_user_data = self.adjusted_ratings[(self.adjusted_ratings['userId'] == c_userid) & (self.adjusted_ratings['itemId'] != item_1)]
-				c_distinct_items = np.unique(c_user_data['itemId'])
-
-				# for each item rated by customer C as item=2
-				for item_2 in c_distinct_items:
-					# the customer's rating for item_2
-					c_item_2_rating = c_user_data[c_user_data['itemId'] == item_2]['rating_adjusted'].iloc[0]
-					record_row = pd.Series([c_userid, item_1, item_2, c_item_1_rating, c_item_2_rating], index=record_row_columns)
-					record_item_1_2 = record_item_1_2.append(record_row, ignore_index=True)
-
-			# calculate the similarity values between item_1 and the above recorded items
-			distinct_item_2 = np.unique(record_item_1_2['item_2'])
-			# for each item 2
-			for item_2 in distinct_item_2:
-				paired_item_1_2 = record_item_1_2[record_item_1_2['item_2'] == item_2]
-				sim_value_numerator = (paired_item_1_2['rating_adjusted_1'] * paired_item_1_2['rating_adjusted_2']).sum()
-				sim_value_denominator = np.sqrt(np.square(paired_item_1_2['rating_adjusted_1']).sum())\
-										* np.sqrt(np.square(paired_item_1_2['rating_adjusted_2']).sum())
-				sim_value_denominator = sim_value_denominator if sim_value_denominator != 0 else 1e-8
-				sim_value = sim_value_numerator / sim_value_denominator
-				self.similarity_matrix = self.similarity_matrix.append(pd.Series([item_1, item_2, sim_value],
-																				 index=['item_1', 'item_2', 'weight']),
-																	   ignore_index=True)
-
-			i = i + 1
-
-		# output weight matrix to pickle file
-		with open(SIMILARITY_MATRIX_PATH, 'wb') as output:
-			pickle.dump(self.similarity_matrix, output, pickle.HIGHEST_PROTOCOL)
-		output.close()
+		# calculate the similarity values of all co-rated items at once, from the sparse users x items ratings
+		ratings_matrix = self.get_ratings_matrix()
+		item_1, item_2, weights = adjusted_cosine_similarities(ratings_matrix, self.min_common_users, self.n_jobs)
+		self.set_similarity_matrix(item_1, item_2, weights)
+
+		# output weight matrix file
+		write_similarity_file(SIMILARITY_MATRIX_PATH, self.similarity_matrix.to_arrays(),
+							  **self.similarity_file_fields())
+
+	def index_item_numbers(self):
+		"""
+		keep the number of each new item by its index (e.g. 7 for the itemId i7), which the recommendations return.
+		"""
+		new_item_ids = self.item_ids[len(self.item_numbers):]
+		if len(new_item_ids) > 0:
+			self.item_numbers = np.append(self.item_numbers, [int(item[1:]) for item in new_item_ids]).astype(np.int64)
+
+	def get_ratings_matrix(self, user_codes=None):
+		"""
+		:param user_codes: if given, sorted array of the codes of the only users whose ratings are in the matrix
+		:return: the sparse users x items matrix of the current adjusted ratings
+		"""
+		if user_codes is not None:
+			positions, items, adjusted_ratings = self.ratings_data.get_users_adjusted_ratings(user_codes)
+			return build_ratings_matrix(positions, items, adjusted_ratings, (len(user_codes), self.ratings_data.n_items))
+		size = self.ratings_data.size
+		return build_ratings_matrix(self.ratings_data.user_codes[:size], self.ratings_data.item_codes[:size],
+									self.ratings_data.get_adjusted_ratings(),
+									(self.ratings_data.n_users, self.ratings_data.n_items))
+
+	def set_similarity_matrix(self, item_1, item_2, weights):
+		"""
+		keep the given similarities indexed by the items indexes, in an item x item array or, if num_of_neighbors is
+		given, as the neighbors of each item.
+		:param item_1: array of items indexes
+		:param item_2: array of items indexes
+		:param weights: array of the similarity of each pair
+		"""
+		if self.num_of_neighbors is not None:
+			self.similarity_matrix = NeighborSimilarityMatrix.from_pairs(len(self.item_ids), item_1, item_2, weights,
+																		 self.num_of_neighbors,
+																		 dtype=self.similarity_dtype)
+		else:
+			self.similarity_matrix = SimilarityMatrix.from_pairs(len(self.item_ids), item_1, item_2, weights,
+																 dtype=self.similarity_dtype,
+																 symmetric=self.symmetric_similarities)
+		self.user_scores = None
 
 	def login_user(self, username):
 		"""
@@ -105,6 +188,7 @@ class RecommenderBaseModel:
 		if username not in self.users:
 			self.users[username] = self.items.copy()
 		self.cur_user = username
+		self.user_scores = None
 
 	def get_recommendations(self, num_of_recommendations):
 		"""
@@ -112,24 +196,27 @@ class RecommenderBaseModel:
 		:param num_of_recommendations: number of items to recommend
 		:return: list of items indexes
 		"""
-		distinct_items = np.unique(self.adjusted_ratings['itemId'])
-		user_ratings_all_items = pd.DataFrame(columns=['itemId', 'rating'])
-		user_ratings = self.adjusted_ratings[self.adjusted_ratings['userId'] == self.cur_user]
-
-		# calculate the ratings for all items that the user hasn't rated
-		i = 0
-		for item in distinct_items:
-			user_rating = user_ratings[user_ratings['itemId'] == item]
-			if user_rating.shape[0] > 0:
-				rating_value = user_ratings_all_items.loc[i, 'rating'] = user_rating["rating"].iloc[0]
-			else:
-				rating_value = user_ratings_all_items.loc[i, 'rating'] = self.predict(item)
-			user_ratings_all_items.loc[i] = [item, rating_value]
-			i = i + 1
-
-		# select top num_of_recommendations items rated by the user
-		recommendations = user_ratings_all_items.sort_values(by=['rating'], ascending=False).head(num_of_recommendations)
-		return [int(item[1:]) for item in recommendations["itemId"]]
+		if num_of_recommendations <= 0:
+			return []
+		user_items, user_item_ratings = self.get_user_ratings()
+
+		# read the ratings of all items from the user's scores, the items that the user rated keep the user's rating
+		item_ratings = self.predict_all_items()
+		item_ratings[user_items] = user_item_ratings
+
+		# select top num_of_recommendations items with a partial sort
+		num_of_recommendations = min(num_of_recommendations, len(item_ratings))
+		recommendations = np.argpartition(-item_ratings, num_of_recommendations - 1)[:num_of_recommendations]
+		recommendations = recommendations[np.argsort(-item_ratings[recommendations], kind='stable')]
+		return self.item_numbers[recommendations].tolist()
+
+	def get_user_ratings(self):
+		"""
+		get the current user's first rating of each item the user rated.
+		:return: array of the rated items indexes, and array of their ratings
+		"""
+		user_items, user_item_ratings = self.ratings_data.get_user_ratings(self.cur_user_code)
+		return user_items, user_item_ratings.astype(np.float64)
 
 	def predict(self, item):
 		"""
@@ -137,37 +224,137 @@ class RecommenderBaseModel:
 		:param item: the itemId to predict rating for
 		:return: the predicted rating
 		"""
-		mean_rating = self.rating_mean[self.rating_mean['itemId'] == item]['rating_mean'].iloc[0]
+		item_index = self.item_index[item]
+		mean_rating = self.item_means[item_index]
 		# calculate the rating of the given item by the given user
-		user_other_ratings = self.adjusted_ratings[self.adjusted_ratings['userId'] == self.cur_user]
-		user_distinct_items = np.unique(user_other_ratings['itemId'])
-		sum_weighted_other_ratings = 0
-		sum_weights = 0
-		for item_j in user_distinct_items:
-			#if rating_mean[rating_mean['itemId'] == item_j].shape[0] > 0:
-			rating_mean_j = self.rating_mean[self.rating_mean['itemId'] == item_j]['rating_mean'].iloc[0]
-			# only calculate the weighted values when the weight between item_1 and item_2 exists in weight matrix
-			w_item_1_2 = self.similarity_matrix[(self.similarity_matrix['item_1'] == item) &
-												(self.similarity_matrix['item_2'] == item_j)]
-			if w_item_1_2.shape[0] > 0:
-				user_rating_j = user_other_ratings[user_other_ratings['itemId']==item_j]
-				sum_weighted_other_ratings += (user_rating_j['rating'].iloc[0] - rating_mean_j) * w_item_1_2['weight'].iloc[0]
-				sum_weights += np.abs(w_item_1_2['weight'].iloc[0])
+		user_items, user_item_ratings = self.get_user_ratings()
+		# items without a weight with the given item have weight 0
+		weights = self.similarity_matrix.weight(item_index, user_items)
+		deviations = user_item_ratings - self.item_means[user_items]
+		sum_weighted_other_ratings = np.sum(deviations * weights)
+		sum_weights = np.sum(np.abs(weights))
 
 		# if sum_weights is 0 (which may be because of no ratings from new users), use the mean ratings
 		return mean_rating if sum_weights == 0 else mean_rating + sum_weighted_other_ratings/sum_weights
 
+	def predict_all_items(self):
+		"""
+		predict the ratings of all items for the current user at once, from the user's scores.
+		:return: array of the predicted ratings by the items indexes
+		"""
+		sum_weighted_other_ratings, sum_weights, num_of_weights = self.get_user_scores()
+
+		# items without weights with the user's items get their mean rating. the number of weights is exact, so
+		# rounding errors left in the sums by the incremental updates don't count as weights
+		predicted_ratings = self.item_means.copy()
+		has_weights = num_of_weights > 0
+		predicted_ratings[has_weights] += sum_weighted_other_ratings[has_weights] / sum_weights[has_weights]
+		return predicted_ratings
+
+	def item_scores(self, items, deviations):
+		"""
+		:param items: array of items indexes
+		:param deviations: array of the current user's rating deviation (rating - mean rating) of each of the items
+		:return: list of the weighted sums of the deviations, the sums of absolute weights and the numbers of nonzero
+			weights of the given items with each item
+		"""
+		sum_weighted_other_ratings, sum_weights = self.similarity_matrix.weighted_sums(items, deviations)
+		return [sum_weighted_other_ratings, sum_weights, self.similarity_matrix.weight_counts(items)]
+
+	def get_user_scores(self):
+		"""
+		:return: the current user's scores of all items, calculated from all the user's ratings only once and then
+			updated by update_ratings
+		"""
+		if self.user_scores is None:
+			user_items, user_item_ratings = self.get_user_ratings()
+			self.user_scores = self.item_scores(user_items, user_item_ratings - self.item_means[user_items])
+		return self.user_scores
+
+	def update_user_scores(self, previous_items, changed_items, updated_items):
+		"""
+		update the current user's scores after the user's new ratings, in O(items) for each item whose weights or
+		deviation changed: replace the terms of the user's items that were rated for the first time or whose mean
+		rating changed, and recalculate the scores of the items whose similarities were updated.
+		:param previous_items: indexes of the items the user rated before the new ratings
+		:param changed_items: indexes of the items whose mean rating changed
+		:param updated_items: indexes of the items whose similarities were updated
+		"""
+		user_items, user_item_ratings = self.get_user_ratings()
+		deviations = user_item_ratings - self.item_means[user_items]
+		replaced = np.isin(user_items, changed_items) | ~np.isin(user_items, previous_items)
+		for scores, added_scores in zip(self.user_scores,
+										self.item_scores(user_items[replaced], deviations[replaced])):
+			scores += added_scores
+
+		# the weights of the updated items with all the user's items
+		weights = self.similarity_matrix.weight(updated_items[:, None], user_items[None, :])
+		self.user_scores[0][updated_items] = weights @ deviations
+		self.user_scores[1][updated_items] = np.abs(weights).sum(axis=1, dtype=np.float64)
+		self.user_scores[2][updated_items] = np.count_nonzero(weights, axis=1)
+
 	def update_ratings(self, items, ratings):
 		"""
 		update the model's ratings data according to the given ratings, that the current user rated.
 		:param items: the items the current user rated
 		:param ratings: the ratings of the given items
 		"""
-		user_id = [self.cur_user for i in range(len(items))]
-		self.ratings = pd.concat([self.ratings,
-								  pd.DataFrame(data={"userId": user_id, "itemId": items, "rating": ratings})],
-								 ignore_index=True).astype({"rating": np.int64})
-		self.process_ratings_data()
+		self.get_user_scores()
+		previous_means = self.item_means.copy()
+		previous_size = self.ratings_data.size
+		previous_items, previous_ratings = self.get_user_ratings()
+		changed_items = self.ratings_data.append([self.cur_user] * len(items), items, ratings)
+		self.ratings_hash = None
+		self.index_item_numbers()
+
+		# make room for new items in the similarities and the scores
+		n_items = self.ratings_data.n_items
+		if self.similarity_matrix.n_items < n_items:
+			self.similarity_matrix = self.similarity_matrix.resized(n_items)
+			self.user_scores = [np.append(scores, np.zeros(n_items - len(scores), dtype=scores.dtype))
+								for scores in self.user_scores]
+
+		# remove the terms of the user's previous items whose deviation changed, before their weights change
+		replaced = np.isin(previous_items, changed_items)
+		for scores, removed_scores in zip(self.user_scores, self.item_scores(
+				previous_items[replaced], previous_ratings[replaced] - previous_means[previous_items[replaced]])):
+			scores -= removed_scores
+
+		updated_items = np.empty(0, dtype=np.int64)
+		if self.incremental_similarities:
+			updated_items = self.update_similarities(changed_items, previous_size)
+		self.update_user_scores(previous_items, changed_items, updated_items)
+
+	def update_similarities(self, changed_items, previous_size):
+		"""
+		update the similarities affected by the current user's new ratings, without recalculating the rest: the
+		similarities of the items whose mean rating changed, and of the items the user rated for the first time. they
+		are recalculated exactly as in a full rebuild, from the ratings of only the users who rated these items, which
+		are found through the items ratings index.
+		:param changed_items: indexes of the items whose mean rating changed
+		:param previous_size: number of ratings before the new ratings
+		:return: indexes of the items whose similarities were updated
+		"""
+		previous_user_items, _ = self.ratings_data.get_user_ratings(self.cur_user_code, previous_size)
+		user_items, _ = self.ratings_data.get_user_ratings(self.cur_user_code)
+		updated_items = np.union1d(changed_items, np.setdiff1d(user_items, previous_user_items))
+		if self.num_of_neighbors is not None:
+			# the neighbors of the items co-rated with the updated items may change as well
+			_, co_rated_items, _ = self.ratings_data.get_users_adjusted_ratings(self.item_users(updated_items))
+			updated_items = np.union1d(updated_items, co_rated_items)
+
+		ratings_matrix = self.get_ratings_matrix(self.item_users(updated_items))
+		self.similarity_matrix.set_rows(updated_items,
+										*item_similarities(ratings_matrix, updated_items, self.min_common_users))
+		return updated_items
+
+	def item_users(self, items):
+		"""
+		:param items: array of items indexes
+		:return: sorted array of the codes of the users who rated any of the given items
+		"""
+		return np.unique(np.concatenate([np.empty(0, dtype=np.int32)] +
+										[self.ratings_data.get_item_ratings(item)[0] for item in items]))
 
 	def get_item_for_rating(self):
 		"""
@@ -11,7 +11,6 @@ class RecommenderBaseModel:
 		self.cur_user = ""
 		self.process_initial_data(data_filename)
 		self.cur_recommendation = []
-		self.users_data_for_update = pd.DataFrame(columns=["user_id", "item_id", "rating"])
 
 	def process_initial_data(self, data_filename):
 		"""
@@ -22,6 +21,8 @@ class RecommenderBaseModel:
 		self.users_data, self.ratings = (self.initial_data[["user_id", "item_id"]], self.initial_data["rating"],)
 		self.matrix_fact = KernelMF(n_factors=50, verbose=0, min_rating=1)
 		self.matrix_fact.fit(self.users_data, self.ratings)
+		# rating history of each user, so a user from the initial data is retrained with their original ratings too
+		self.users_ratings = {user: dict(zip(user_data["item_id"], user_data["rating"])) for user, user_data in self.initial_data.groupby("user_id", sort=False)}
 
 	def login_user(self, username):
 		"""
@@ -41,7 +42,7 @@ class RecommenderBaseModel:
 		:return: a list with size num_of_recommendations of the cur_user's most recommended items
 		"""
 		if len(self.cur_recommendation) == 0:
-			items_known = self.users_data_for_update.query("user_id == @self.cur_user")["item_id"]
+			items_known = list(self.users_ratings.get(self.cur_user, dict()))
 			recommendations_df = self.matrix_fact.recommend(user=self.cur_user, items_known=items_known, amount=num_of_recommendations)
 			print(recommendations_df)
 			self.cur_recommendation = [int(item[1:]) for item in recommendations_df["item_id"]]
@@ -49,14 +50,14 @@ class RecommenderBaseModel:
 
 	def update_ratings(self, items, ratings): #ratings):
 		"""
-		use the given ratings to update the model
+		use the given ratings to update the model. only the current user is retrained, from he's complete rating history
 		:param ratings:
 		:return:
 		"""
-		user_id = [self.cur_user for i in range(len(items))]
-		self.users_data_for_update = pd.concat([self.users_data_for_update, pd.DataFrame(data={"user_id": user_id, "item_id": items, "rating": ratings})],
-											   ignore_index=True).astype({"rating": np.int64})
-		self.matrix_fact.update_users(self.users_data_for_update[["user_id", "item_id"]], self.users_data_for_update["rating"], verbose=0)
+		user_ratings = self.users_ratings.setdefault(self.cur_user, dict())
+		user_ratings.update(zip(items, ratings))
+		user_data = pd.DataFrame(data={"user_id": self.cur_user, "item_id": list(user_ratings), "rating": list(user_ratings.values())}).astype({"rating": np.int64})
+		self.matrix_fact.update_users(user_data[["user_id", "item_id"]], user_data["rating"], verbose=0, method="solve")
 		self.cur_recommendation = []
 
 	def get_item_for_rating(self):
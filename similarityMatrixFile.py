@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+
+# file layout: MAGIC, the length of the json header as uint64, the header, and the raw arrays, each starting at a
+# multiple of ALIGNMENT bytes. the header has the format version, the arrays dtypes, shapes and offsets (from the
+# start of the arrays data), and the fields given when the file was written.
+MAGIC = b'ITEMSIM\n'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+def _aligned(position):
+	return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+def ratings_file_hash(filename):
+	"""
+	:param filename: path of the ratings file
+	:return: sha256 hex digest of the file content
+	"""
+	file_hash = hashlib.sha256()
+	with open(filename, 'rb') as ratings_file:
+		for chunk in iter(lambda: ratings_file.read(1 << 20), b''):
+			file_hash.update(chunk)
+	return file_hash.hexdigest()
+
+
+def write_similarity_file(path, arrays, **fields):
+	"""
+	write the given arrays and header fields to a similarity matrix file.
+	:param path: path of the file
+	:param arrays: dict of array name to NumPy array
+	:param fields: json serializable header fields
+	"""
+	header = dict(fields, version=FORMAT_VERSION, arrays={})
+	offset = 0
+	for name, values in arrays.items():
+		values = np.ascontiguousarray(values)
+		header['arrays'][name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset}
+		offset = _aligned(offset + values.nbytes)
+	header_bytes = json.dumps(header).encode('utf-8')
+	data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+	with open(path, 'wb') as output:
+		output.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+		for name, values in arrays.items():
+			output.seek(data_start + header['arrays'][name]['offset'])
+			output.write(np.ascontiguousarray(values).tobytes())
+		output.truncate(data_start + offset)
+
+
+def read_similarity_header(path):
+	"""
+	:param path: path of the file
+	:return: the header of the similarity matrix file, None if there is no such file of the current format version
+	"""
+	if not os.path.exists(path):
+		return None
+	with open(path, 'rb') as input:
+		if input.read(len(MAGIC)) != MAGIC:
+			return None
+		header_length, = struct.unpack('<Q', input.read(8))
+		header = json.loads(input.read(header_length).decode('utf-8'))
+	if header.get('version') != FORMAT_VERSION:
+		return None
+	header['data_start'] = _aligned(len(MAGIC) + 8 + header_length)
+	return header
+
+
+def map_similarity_arrays(path, header):
+	"""
+	map the arrays of a similarity matrix file to memory. the pages are shared with other processes that map the file,
+	until they are written to (copy-on-write, the file itself is never changed).
+	:param path: path of the file
+	:param header: the file header, from read_similarity_header
+	:return: dict of array name to array
+	"""
+	arrays = dict()
+	for name, layout in header['arrays'].items():
+		dtype, shape = np.dtype(layout['dtype']), tuple(layout['shape'])
+		if int(np.prod(shape)) == 0:
+			arrays[name] = np.empty(shape, dtype=dtype)
+		else:
+			arrays[name] = np.memmap(path, dtype=dtype, mode='c', offset=header['data_start'] + layout['offset'],
+									 shape=shape)
+	return arrays
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules are imported from the repository root, as the application does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def low_rank_ratings():
+	"""
+	ratings of 500 users on 2000 items from random rank 5 user and item vectors, rounded to 1 to 5 stars
+	"""
+	rng = np.random.default_rng(0)
+	user_vectors, item_vectors = rng.normal(size=(500, 5)), rng.normal(size=(2000, 5))
+	X = pd.DataFrame({'user_id': rng.integers(0, 500, 60000), 'item_id': rng.integers(0, 2000, 60000)})
+	X = X.drop_duplicates().reset_index(drop=True)
+	scores = (user_vectors[X['user_id']] * item_vectors[X['item_id']]).sum(axis=1)
+	y = pd.Series(np.clip(np.round(3 + scores / 2), 1, 5))
+	return X, y
+
+
+@pytest.fixture(scope='session')
+def small_ratings():
+	"""
+	ratings of 60 users on about 15 of 40 items each, with string user and item ids
+	"""
+	rng = np.random.default_rng(1)
+	rows = [('u%d' % user, 'i%d' % item) for user in range(60) for item in rng.choice(40, 15, replace=False)]
+	X = pd.DataFrame(rows, columns=['user_id', 'item_id'])
+	y = pd.Series(rng.integers(1, 6, len(X)))
+	return X, y
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from matrix_factorization import IdIndex
+
+
+def test_to_numpy_is_cached_until_append():
+	index = IdIndex(['b', 'a'])
+	ids = index.to_numpy()
+	assert index.to_numpy() is ids
+	assert not ids.flags.writeable
+
+	index.append(['a'])
+	assert index.to_numpy() is ids
+
+	index.append(['c'])
+	assert list(index.to_numpy()) == ['b', 'a', 'c']
+	assert list(ids) == ['b', 'a']
+
+
+def test_lookups_match_a_pandas_index():
+	rng = np.random.default_rng(0)
+	index = IdIndex()
+	ids = []
+	for batch in range(5):
+		new_ids = ['id%d' % id for id in rng.integers(0, 300, 80)]
+		codes = index.append(new_ids)
+		unique_new = [id for id in dict.fromkeys(new_ids) if id not in ids]
+		ids += unique_new
+		np.testing.assert_array_equal(codes, np.arange(len(ids) - len(unique_new), len(ids)))
+
+		# small batches look up the dict, large ones the pandas index
+		for size in (3, 400):
+			queries = ['id%d' % id for id in rng.integers(0, 400, size)]
+			np.testing.assert_array_equal(index.get_indexer(queries), pd.Index(ids).get_indexer(queries))
+	assert len(index) == len(ids) and list(index) == ids and ('id0' in index) == ('id0' in ids)
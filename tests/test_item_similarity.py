@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from itemSimilarity import adjusted_cosine_similarities, build_ratings_matrix, SimilarityMatrix, NeighborSimilarityMatrix
+from recommenderBaseModelItemBased import RecommenderBaseModel
+
+
+def write_ratings(path, rng, n_users=40, n_items=20):
+	"""
+	write random ratings, plus items i21 and i22 that everyone rates 3, so their adjusted ratings are all the 1e-8 that
+	replaces 0 and their pairs have near-zero norms.
+	"""
+	rows = [('u%d' % user, 'i%d' % item, rng.integers(1, 6))
+			for user in range(n_users) for item in rng.choice(np.arange(1, n_items + 1), 8, replace=False)]
+	rows += [('u%d' % user, 'i%d' % item, 3) for user in range(0, n_users, 2) for item in (21, 22)]
+	pd.DataFrame(rows, columns=['userId', 'itemId', 'rating']).to_csv(path, index=False)
+
+
+def full_rebuild(model):
+	"""
+	:return: the dense similarities of a full rebuild from the model's current ratings
+	"""
+	item_1, item_2, weights = adjusted_cosine_similarities(model.get_ratings_matrix(), model.min_common_users)
+	n_items = model.ratings_data.n_items
+	if model.num_of_neighbors is not None:
+		return NeighborSimilarityMatrix.from_pairs(n_items, item_1, item_2, weights, model.num_of_neighbors).to_dense()
+	return SimilarityMatrix.from_pairs(n_items, item_1, item_2, weights).to_dense()
+
+
+@pytest.mark.parametrize('options', [{}, {'symmetric_similarities': True}, {'num_of_neighbors': 5},
+									 {'min_common_users': 3}])
+def test_incremental_similarities_match_full_rebuild(tmp_path, monkeypatch, options):
+	monkeypatch.chdir(tmp_path)
+	rng = np.random.default_rng(0)
+	write_ratings(tmp_path / 'ratings.csv', rng)
+	model = RecommenderBaseModel(str(tmp_path / 'ratings.csv'), False, **options)
+
+	for session in range(150):
+		model.login_user('u%d' % rng.integers(0, 50))
+		items = ['i%d' % item for item in rng.integers(1, 26, rng.integers(1, 6))]
+		# the near-zero-norm items keep being rated at their mean
+		ratings = [3 if item in ('i21', 'i22') else rng.integers(1, 6) for item in items]
+		model.update_ratings(items, ratings)
+
+		if session % 25 == 24:
+			weights = model.similarity_matrix.to_dense()
+			assert np.all(np.abs(weights) <= 1)
+			np.testing.assert_allclose(weights, full_rebuild(model), rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('min_common_users', [1, 3])
+def test_parallel_build_matches_serial(min_common_users):
+	rng = np.random.default_rng(1)
+	n_users, n_items = 200, 60
+	user_codes, item_codes = rng.integers(0, n_users, 3000), rng.integers(0, n_items, 3000)
+	ratings_matrix = build_ratings_matrix(user_codes, item_codes, rng.normal(size=3000), (n_users, n_items))
+
+	serial = adjusted_cosine_similarities(ratings_matrix, min_common_users)
+	parallel = adjusted_cosine_similarities(ratings_matrix, min_common_users, n_jobs=3)
+	for serial_column, parallel_column in zip(serial, parallel):
+		np.testing.assert_array_equal(serial_column, parallel_column)
+	assert len(serial[0]) > 0
+
+
+def test_set_rows_matches_rebuild():
+	rng = np.random.default_rng(2)
+	n_items = 30
+	item_1, item_2, weights = rng.integers(0, n_items, 400), rng.integers(0, n_items, 400), rng.normal(size=400)
+	matrix = NeighborSimilarityMatrix.from_pairs(n_items, item_1, item_2, weights, 5)
+
+	# item 4 loses all its neighbors, and the others get fewer or more pairs than before
+	items = np.array([0, 4, 7, 29])
+	new_item_1, new_item_2 = rng.choice([0, 7, 29], 40), rng.integers(0, n_items, 40)
+	new_weights = rng.normal(size=40)
+	matrix.set_rows(items, new_item_1, new_item_2, new_weights)
+
+	kept = ~np.isin(item_1, items)
+	expected = NeighborSimilarityMatrix.from_pairs(n_items, np.concatenate([item_1[kept], new_item_1]),
+												   np.concatenate([item_2[kept], new_item_2]),
+												   np.concatenate([weights[kept], new_weights]), 5)
+	for name, values in expected.to_arrays().items():
+		np.testing.assert_array_equal(matrix.to_arrays()[name], values)
+	np.testing.assert_array_equal(matrix.weight(item_1, item_2), expected.weight(item_1, item_2))
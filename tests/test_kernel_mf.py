@@ -0,0 +1,244 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+from numba.typed import List
+
+from matrix_factorization import KernelMF
+from matrix_factorization.kernel_matrix_factorization import _shuffled_order, kernel_loops
+from matrix_factorization.kernels import dot, squared_distance
+from matrix_factorization.recommender_base import stop_early
+
+
+@pytest.fixture(scope='module')
+def small_model(small_ratings):
+	X, y = small_ratings
+	np.random.seed(0)
+	return KernelMF(n_factors=5, n_epochs=10, kernel='sigmoid', verbose=0).fit(X, y)
+
+
+# blocks of 1 user, of 3 users with a shorter last block, and of all users
+@pytest.mark.parametrize('memory_budget', [1, 3 * 8 * 40 * 3, 2 ** 28])
+def test_recommend_batch_matches_recommend(small_ratings, small_model, memory_budget):
+	X, _ = small_ratings
+	users = ['u0', 'u7', 'unknown', 'u33']
+	# u7 knows all but 3 items, so its row is padded
+	items_known = {'u0': list(X['item_id'][X['user_id'] == 'u0']), 'u7': ['i%d' % item for item in range(37)]}
+	items, ratings = small_model.recommend_batch(users, amount=5, items_known=items_known, memory_budget=memory_budget)
+
+	assert items.shape == ratings.shape == (4, 5)
+	for row, user in enumerate(users):
+		expected = small_model.recommend(user, amount=5, items_known=items_known.get(user))
+		n = len(expected)
+		assert list(items[row, :n]) == list(expected['item_id'])
+		np.testing.assert_allclose(ratings[row, :n], expected['rating_pred'])
+		assert all(item is None for item in items[row, n:])
+		assert np.isnan(ratings[row, n:]).all()
+	assert list(items[1, 3:]) == [None, None]
+
+
+@pytest.mark.parametrize('kernel', ['linear', 'sigmoid', 'rbf'])
+def test_recommend_matches_per_row_predict(small_ratings, kernel, monkeypatch):
+	X, y = small_ratings
+	np.random.seed(0)
+	model = KernelMF(n_factors=5, n_epochs=10, kernel=kernel, verbose=0).fit(X, y)
+	items_known = list(X['item_id'][X['user_id'] == 'u3'])
+	fast = [model.recommend(user, amount=8, items_known=items_known) for user in ('u3', 'unknown')]
+
+	# without the matrix product path, recommend predicts each user and item pair with predict
+	monkeypatch.setattr(model, '_predict_all_items', lambda user: None)
+	for user, recommendations in zip(('u3', 'unknown'), fast):
+		expected = model.recommend(user, amount=8, items_known=items_known)
+		assert list(recommendations['item_id']) == list(expected['item_id'])
+		np.testing.assert_allclose(recommendations['rating_pred'], expected['rating_pred'], rtol=1e-10)
+
+
+@pytest.mark.parametrize('kernel', ['linear', 'sigmoid', 'rbf'])
+def test_hogwild_matches_serial_on_disjoint_partitions(kernel):
+	# each of the 3 partitions rates only its own 10 users and 20 items, so the threads never update the same parameters
+	rng = np.random.default_rng(2)
+	user_ids = np.repeat(np.arange(30), 8).astype(np.int32)
+	item_ids = np.concatenate([20 * (user // 10) + rng.choice(20, 8, replace=False) for user in range(30)]).astype(np.int32)
+	ratings = rng.integers(1, 6, 240).astype(np.float64)
+	order = np.concatenate([rng.permutation(np.arange(80 * group, 80 * (group + 1))) for group in range(3)])
+	parameters = [np.zeros(30), np.zeros(60), rng.normal(0, 0.1, (30, 4)), rng.normal(0, 0.1, (60, 4))]
+
+	loops = kernel_loops(kernel)
+	serial, hogwild = [array.copy() for array in parameters], [array.copy() for array in parameters]
+	options = {'gamma': 0.25, 'lr': 0.05, 'reg': 0.1, 'min_rating': 1.0, 'max_rating': 5.0, 'update_user_params': True,
+			   'update_item_params': True}
+	serial_error = loops.sgd_update_ratings(user_ids, item_ids, ratings, order, 0, 240, 3.0, *serial, **options)
+	hogwild_error = loops.sgd_update_ratings_hogwild(user_ids, item_ids, ratings, order, 3, 3.0, *hogwild, **options)
+
+	assert hogwild_error == pytest.approx(serial_error, rel=1e-12)
+	for serial_array, hogwild_array in zip(serial, hogwild):
+		np.testing.assert_array_equal(hogwild_array, serial_array)
+
+
+def ridge_solution(features, biases, targets, reg):
+	"""
+	solve the regularized least squares [p, bias] of the targets minus the biases, with x = [features, 1], with numpy
+	"""
+	x = np.hstack([features, np.ones((len(features), 1))])
+	return np.linalg.solve(x.T @ x + reg * np.eye(x.shape[1]), x.T @ (targets - biases))
+
+
+def test_als_items_solve_their_normal_equations(small_ratings):
+	X, y = small_ratings
+	np.random.seed(0)
+	model = KernelMF(n_factors=4, n_epochs=5, method='als', reg=0.5, verbose=0).fit(X, y)
+	users = model.user_index.get_indexer(X['user_id'])
+	items = model.item_index.get_indexer(X['item_id'])
+
+	# the items are solved last in each epoch, given the final user parameters
+	for item in range(model.n_items):
+		rated = items == item
+		solution = ridge_solution(model.user_features[users[rated]], model.user_biases[users[rated]],
+								  y.to_numpy()[rated] - model.global_mean, model.reg)
+		np.testing.assert_allclose(model.item_features[item], solution[:-1], atol=1e-10)
+		assert model.item_biases[item] == pytest.approx(solution[-1], abs=1e-10)
+
+	predictions = np.array(model.predict(X, bound_ratings=False))
+	assert model.train_rmse[-1] == pytest.approx(np.sqrt(np.mean((predictions - y.to_numpy()) ** 2)), rel=1e-10)
+	assert model.train_rmse[-1] < model.train_rmse[0]
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('length', [0, 1, 7, 100])
+def test_fastmath_kernels_match_numpy(dtype, length):
+	rng = np.random.default_rng(length)
+	x, y = rng.normal(size=length).astype(dtype), rng.normal(size=length).astype(dtype)
+	rtol = 1e-5 if dtype == np.float32 else 1e-12
+	assert dot(x, y) == pytest.approx(np.dot(x.astype(np.float64), y), rel=rtol, abs=rtol)
+	assert squared_distance(x, y) == pytest.approx(np.sum(np.square(x.astype(np.float64) - y)), rel=rtol, abs=rtol)
+
+
+@pytest.mark.parametrize('kernel', ['linear', 'sigmoid', 'rbf'])
+def test_float32_predict_matches_matrix_products(small_ratings, kernel):
+	X, y = small_ratings
+	np.random.seed(0)
+	model = KernelMF(n_factors=5, n_epochs=10, kernel=kernel, dtype='float32', verbose=0).fit(X, y)
+	assert model.user_features.dtype == model.item_biases.dtype == np.float32
+
+	predictions = np.array(model.predict(X, bound_ratings=False))
+	item_ratings = model._predict_users_items(list(X['user_id']))
+	expected = item_ratings[np.arange(len(X)), model.item_index.get_indexer(X['item_id'])]
+	np.testing.assert_allclose(predictions, expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize('losses, tol, patience, stop', [
+	([1.0, 0.9, 0.8], 0, 2, False),
+	([1.0, 0.9, 0.95, 0.92], 0, 2, True),
+	([1.0, 0.9, 0.95, 0.85], 0, 2, False),
+	([1.0, 0.9, 0.95, 0.85], 0.1, 2, True),
+	([1.0, 1.0, 1.0, 1.0], -np.inf, 1, False),
+	([1.0, 2.0], 0, 2, False),
+])
+def test_stop_early(losses, tol, patience, stop):
+	assert stop_early(List(losses), tol, patience) == stop
+
+
+def test_early_stopping_on_validation_ratings(small_ratings):
+	X, y = small_ratings
+	np.random.seed(0)
+	model = KernelMF(n_factors=5, n_epochs=50, validation_fraction=0.25, tol=1e6, patience=3, verbose=0).fit(X, y)
+	# no epoch improves by more than tol, so training stops after the first epoch and patience more
+	assert len(model.train_rmse) == len(model.val_rmse) == 4
+
+	# the validation ratings are drawn first in fit, so the same seed draws them again
+	np.random.seed(0)
+	split = KernelMF()
+	data = split._training_data(split._preprocess_data(X, y), validation_fraction=0.25)
+	assert len(data['ratings']) + len(data['val_ratings']) == len(X) and len(data['val_ratings']) == round(len(X) / 4)
+	validation = pd.DataFrame({'user_id': split.user_index.to_numpy()[data['val_user_ids']],
+							   'item_id': split.item_index.to_numpy()[data['val_item_ids']]})
+	predictions = np.array(model.predict(validation, bound_ratings=False))
+	assert model.val_rmse[-1] == pytest.approx(np.sqrt(np.mean((predictions - data['val_ratings']) ** 2)), rel=1e-10)
+
+
+@pytest.mark.parametrize('block_size', [0, 1, 7, 105])
+def test_shuffled_order_is_a_blocked_permutation(block_size):
+	order = _shuffled_order(100, block_size)
+	assert sorted(order) == list(range(100))
+	if block_size > 0:
+		# the blocks are visited one after the other
+		blocks = order // block_size
+		assert np.count_nonzero(np.diff(blocks)) == -(-100 // block_size) - 1
+
+
+def test_training_data_is_typed_and_sorted_by_user(small_ratings):
+	X, y = small_ratings
+	model = KernelMF()
+	X = model._preprocess_data(X.sample(frac=1, random_state=0), y)
+	data = model._training_data(X, dtype='float32', sort_users=True)
+	assert data['user_ids'].dtype == data['item_ids'].dtype == np.int32 and data['ratings'].dtype == np.float32
+	assert np.all(np.diff(data['user_ids']) >= 0)
+
+	# the sort keeps the ratings of each user in their original order
+	expected = X.sort_values('user_id', kind='stable')
+	np.testing.assert_array_equal(data['item_ids'], expected['item_id'])
+	np.testing.assert_array_equal(data['ratings'], expected['rating'])
+
+
+def test_blocked_shuffle_trains_as_well_as_uniform(low_rank_ratings):
+	X, y = low_rank_ratings
+	rmse = []
+	for shuffle_block_size in (None, 64):
+		np.random.seed(0)
+		model = KernelMF(n_factors=10, n_epochs=20, reg=0.05, min_rating=1, shuffle_block_size=shuffle_block_size,
+						 verbose=0).fit(X, y)
+		assert model.train_rmse[-1] < 0.8 * model.train_rmse[0]
+		rmse.append(model.train_rmse[-1])
+	assert rmse[1] == pytest.approx(rmse[0], rel=0.02)
+
+
+def test_fold_in_solves_the_user_normal_equations(small_ratings):
+	X, y = small_ratings
+	model = KernelMF(n_factors=4, n_epochs=5, reg=0.5, verbose=0)
+	np.random.seed(0)
+	model.fit(X, y)
+	item_features, item_biases = model.item_features.copy(), model.item_biases.copy()
+
+	# a known user with new ratings and a new user
+	rng = np.random.default_rng(3)
+	new = pd.DataFrame({'user_id': ['u5'] * 12 + ['new'] * 6, 'item_id': ['i%d' % item for item in range(12)] +
+						['i%d' % item for item in range(6, 12)]})
+	ratings = pd.Series(rng.integers(1, 6, len(new)))
+	model.update_users(new, ratings, method='solve')
+
+	np.testing.assert_array_equal(model.item_features, item_features)
+	for user in ('u5', 'new'):
+		rated = (new['user_id'] == user).to_numpy()
+		items = model.item_index.get_indexer(new['item_id'][rated])
+		solution = ridge_solution(item_features[items], item_biases[items],
+								  ratings.to_numpy()[rated] - model.global_mean, model.reg)
+		user_id = model.user_index.get_indexer([user])[0]
+		np.testing.assert_allclose(model.user_features[user_id], solution[:-1], atol=1e-10)
+		assert model.user_biases[user_id] == pytest.approx(solution[-1], abs=1e-10)
+
+
+def test_update_users_grows_the_parameter_buffers(small_ratings):
+	X, y = small_ratings
+	np.random.seed(0)
+	model = KernelMF(n_factors=4, n_epochs=5, verbose=0).fit(X, y)
+	batch = copy.deepcopy(model)
+
+	rng = np.random.default_rng(4)
+	new = pd.DataFrame({'user_id': np.repeat(['new%d' % user for user in range(100)], 5),
+						'item_id': ['i%d' % item for item in rng.integers(0, 40, 500)]}).drop_duplicates()
+	ratings = pd.Series(rng.integers(1, 6, len(new)), index=new.index)
+	first_users = model.user_features[:60].copy()
+	buffers = set()
+	for user, user_ratings in new.groupby('user_id', sort=False):
+		model.update_users(user_ratings, ratings[user_ratings.index], method='solve')
+		buffers.add(model._user_features_buffer.ctypes.data)
+		assert model.user_features.flags.c_contiguous
+	batch.update_users(new, ratings, method='solve')
+
+	# 100 users added one at a time to 60 users take 2 reallocations, 120 and 240 rows
+	assert len(buffers) == 2 and model._user_features_buffer.shape[0] == 240
+	assert model.user_features.shape == (160, 4) and model.user_biases.shape == (160,)
+	np.testing.assert_array_equal(model.user_features[:60], first_users)
+	np.testing.assert_allclose(model.user_features, batch.user_features, atol=1e-12)
+	np.testing.assert_allclose(model.user_biases, batch.user_biases, atol=1e-12)
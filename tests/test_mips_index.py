@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from matrix_factorization import KernelMF, MIPSIndex
+
+
+@pytest.mark.parametrize('options', [{'n_probe': 0}, {'n_probe': -1}, {'n_lists': 0}])
+def test_invalid_lists_are_rejected(options):
+	with pytest.raises(ValueError):
+		MIPSIndex(**options)
+
+
+@pytest.mark.parametrize('kernel', ['linear', 'rbf'])
+def test_approximate_recommend_recall(low_rank_ratings, kernel):
+	X, y = low_rank_ratings
+	np.random.seed(0)
+	model = KernelMF(n_factors=10, n_epochs=20, kernel=kernel, min_rating=1, reg=0.05, verbose=0).fit(X, y)
+	model.build_ann_index(random_state=0)
+
+	recalls = []
+	for user in range(0, 500, 10):
+		items_known = X['item_id'][X['user_id'] == user].tolist()
+		exact = model.recommend(user, amount=10, items_known=items_known)
+		approximate = model.recommend(user, amount=10, items_known=items_known, approximate=True)
+		assert len(approximate) == 10 and not approximate['item_id'].isin(items_known).any()
+		recalls.append(approximate['item_id'].isin(exact['item_id']).mean())
+	assert np.mean(recalls) >= 0.9
+	assert model.ann_recall >= 0.9
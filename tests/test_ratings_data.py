@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ratingsData import RatingsData
+
+
+def test_appended_ids_keep_their_codes():
+	data = RatingsData(pd.DataFrame({'userId': ['u2', 'u1', 'u2'], 'itemId': ['i2', 'i1', 'i1'], 'rating': [1, 2, 3]}))
+	for session in range(40):
+		data.append(['u%d' % session] * 2, ['i1', 'i%d' % (session + 3)], [4, 5])
+
+	frame = data.to_frame()
+	assert list(frame['userId'][:3]) == ['u2', 'u1', 'u2']
+	assert list(frame['itemId'][-2:]) == ['i1', 'i42']
+	assert data.n_users == 40 and data.n_items == 42
+	assert data.user_ids[data.user_index['u7']] == 'u7'
+	assert data.item_means[data.item_index['i1']] == pytest.approx(np.mean([2, 3] + [4] * 40))
+	assert np.isnan(data.item_means).sum() == 0
+
+
+@pytest.mark.parametrize('rating', [3.5, 200, -129])
+def test_invalid_ratings_are_rejected(rating):
+	data = RatingsData(pd.DataFrame({'userId': ['u1'], 'itemId': ['i1'], 'rating': [3]}))
+	with pytest.raises(ValueError):
+		data.append(['u1'], ['i2'], [rating])
+	assert data.size == 1
@@ -0,0 +1,44 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+from recommenderBaseModelMatrixFactorization import RecommenderBaseModel
+
+
+def write_ratings(path, rng, n_users=30, n_items=20):
+	"""
+	write random ratings without a header, as the model reads the columns by position. item i21 is left unrated.
+	"""
+	rows = [('u%d' % user, 'i%d' % item, rng.integers(1, 6))
+			for user in range(n_users) for item in rng.choice(np.arange(1, n_items + 1), 8, replace=False)]
+	pd.DataFrame(rows).to_csv(path, index=False, header=False)
+
+
+def user_vector(matrix_fact, user):
+	user_id = matrix_fact.user_index.get_indexer([user])[0]
+	return np.append(matrix_fact.user_features[user_id], matrix_fact.user_biases[user_id])
+
+
+def test_initial_user_keeps_original_ratings(tmp_path):
+	np.random.seed(0)
+	write_ratings(tmp_path / 'ratings.csv', np.random.default_rng(0))
+	model = RecommenderBaseModel(str(tmp_path / 'ratings.csv'))
+	original = model.initial_data[model.initial_data['user_id'] == 'u3']
+	assert model.users_ratings['u3'] == dict(zip(original['item_id'], original['rating']))
+
+	before = copy.deepcopy(model.matrix_fact)
+	model.login_user('u3')
+	model.update_ratings(['i21'], [5])
+
+	# the fold-in must use the original ratings plus the new one, not the new rating alone
+	history = pd.DataFrame({'user_id': 'u3', 'item_id': list(original['item_id']) + ['i21'],
+							'rating': list(original['rating']) + [5]})
+	full = copy.deepcopy(before)
+	full.update_users(history[['user_id', 'item_id']], history['rating'], verbose=0, method='solve')
+	new_only = copy.deepcopy(before)
+	new_only.update_users(history[['user_id', 'item_id']].tail(1), history['rating'].tail(1), verbose=0, method='solve')
+
+	assert len(model.users_ratings['u3']) == len(original) + 1
+	np.testing.assert_allclose(user_vector(model.matrix_fact, 'u3'), user_vector(full, 'u3'))
+	assert not np.allclose(user_vector(model.matrix_fact, 'u3'), user_vector(new_only, 'u3'))
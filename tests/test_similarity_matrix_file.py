@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from recommenderBaseModelItemBased import RecommenderBaseModel, SIMILARITY_MATRIX_PATH
+from similarityMatrixFile import ALIGNMENT, FORMAT_VERSION, MAGIC, map_similarity_arrays, read_similarity_header, \
+	write_similarity_file
+
+
+def write_ratings(path, seed):
+	rng = np.random.default_rng(seed)
+	rows = [('u%d' % user, 'i%d' % item, rng.integers(1, 6))
+			for user in range(30) for item in rng.choice(np.arange(1, 16), 6, replace=False)]
+	pd.DataFrame(rows, columns=['userId', 'itemId', 'rating']).to_csv(path, index=False)
+
+
+def test_arrays_round_trip(tmp_path):
+	arrays = {'weights': np.arange(12, dtype=np.float32).reshape(3, 4), 'indices': np.array([3, 1, 2], dtype=np.int32),
+			  'empty': np.empty(0, dtype=np.int64)}
+	write_similarity_file(tmp_path / 'matrix.sim', arrays, ratings_hash='abc', item_ids=['i1', 'i2'])
+
+	header = read_similarity_header(tmp_path / 'matrix.sim')
+	assert header['version'] == FORMAT_VERSION and header['ratings_hash'] == 'abc' and header['item_ids'] == ['i1', 'i2']
+	assert all((header['data_start'] + layout['offset']) % ALIGNMENT == 0 for layout in header['arrays'].values())
+	mapped = map_similarity_arrays(tmp_path / 'matrix.sim', header)
+	for name, values in arrays.items():
+		assert mapped[name].dtype == values.dtype
+		np.testing.assert_array_equal(mapped[name], values)
+
+	# the mapping is copy-on-write, so writing to it leaves the file as it was
+	mapped['weights'][0, 0] = 100
+	np.testing.assert_array_equal(map_similarity_arrays(tmp_path / 'matrix.sim', header)['weights'], arrays['weights'])
+
+
+def test_other_files_have_no_header(tmp_path):
+	assert read_similarity_header(tmp_path / 'missing.sim') is None
+	(tmp_path / 'old.sim').write_bytes(b'0.5,0.25\n' * 10)
+	assert read_similarity_header(tmp_path / 'old.sim') is None
+
+	write_similarity_file(tmp_path / 'matrix.sim', {'weights': np.ones(2)})
+	content = (tmp_path / 'matrix.sim').read_bytes()
+	(tmp_path / 'matrix.sim').write_bytes(content.replace(b'"version": %d' % FORMAT_VERSION, b'"version": 0'))
+	assert content.startswith(MAGIC) and read_similarity_header(tmp_path / 'matrix.sim') is None
+
+
+def test_stale_matrix_file_is_rebuilt(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	write_ratings(tmp_path / 'ratings.csv', 0)
+	built = RecommenderBaseModel(str(tmp_path / 'ratings.csv'), True)
+	loaded = RecommenderBaseModel(str(tmp_path / 'ratings.csv'), True)
+	assert isinstance(loaded.similarity_matrix.values, np.memmap)
+	np.testing.assert_array_equal(loaded.similarity_matrix.to_dense(), built.similarity_matrix.to_dense())
+
+	# the file of the other ratings, or of other settings, is not loaded but built again and replaced
+	write_ratings(tmp_path / 'other.csv', 1)
+	other = RecommenderBaseModel(str(tmp_path / 'other.csv'), True)
+	assert not isinstance(other.similarity_matrix.values, np.memmap)
+	assert not np.array_equal(other.similarity_matrix.to_dense(), built.similarity_matrix.to_dense())
+	assert read_similarity_header(SIMILARITY_MATRIX_PATH)['ratings_hash'] == other.ratings_hash
+
+	neighbors = RecommenderBaseModel(str(tmp_path / 'other.csv'), True, num_of_neighbors=3)
+	assert not isinstance(neighbors.similarity_matrix.weights, np.memmap)
+	assert read_similarity_header(SIMILARITY_MATRIX_PATH)['num_of_neighbors'] == 3